@@ -1,34 +1,70 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi import BackgroundTasks
-from fastapi.responses import JSONResponse, HTMLResponse, Response
+from fastapi import FastAPI, Request, HTTPException, Query
+from fastapi.responses import JSONResponse, HTMLResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-import json
-import hashlib
-import hmac
+import asyncio
+import atexit
+import functools
+import glob
 import logging
+import time
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import uvicorn
-from models.zalo_events import ZaloEvent, parse_zalo_event
+from models.zalo_events import ZaloEvent, parse_event_envelope, EVENT_CLASSES
 from handlers.event_handler import EventHandler
+from pipeline.journal import IngestionJournal, JournalLocked
+from pipeline.dedup import DedupIndex, make_dedup_key
+from middleware import signature_verifier, RateLimitMiddleware, WebhookSecurityMiddleware
+from monitoring.logging_pipeline import LoggingPipeline, PayloadSampler
+from monitoring.shared_stats import SharedStatsStore
+from monitoring.live_stream import BroadcastHub
+from monitoring.metrics import registry as metrics, STAGE_SECONDS, ERRORS
+from services.zalo_client import zalo_client
+from services.send_scheduler import send_scheduler
+from services.token_manager import token_manager
+from services.profile_cache import profile_cache
+from services.attachment_fetcher import attachment_fetcher
 from config import settings
 import os
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, Integer, BigInteger, JSON, Index
-
-# Cấu hình logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('webhook.log'),
-        logging.StreamHandler()
-    ]
+from storage.database import (
+    EventDedupKey, AsyncSessionLocal, init_models, batch_writer, follower_store, event_partitions,
 )
+from storage.queries import decode_cursor, list_submissions, list_user_submissions, stream_images
+
+# Thống kê dùng chung giữa các worker; mỗi worker nhận một index cố định để
+# tách file log và journal (hai process không được ghi chung một file)
+shared_stats = SharedStatsStore.from_settings().open()
+# Metric cũng được tổng hợp qua mọi worker; label event_name chỉ nhận các event đã biết
+metrics.attach(shared_stats)
+metrics.known_event_names = set(EVENT_CLASSES)
+
+def worker_path(path: str, is_dir: bool = False) -> str:
+    """Đường dẫn riêng cho worker hiện tại (worker 0 giữ nguyên đường dẫn gốc)"""
+    index = shared_stats.worker_index
+    if index == 0:
+        return path
+    if is_dir:
+        return os.path.join(path, f"worker-{index}")
+    root, ext = os.path.splitext(path)
+    return f"{root}.worker-{index}{ext}"
+
+# Cấu hình logging: ghi bất đồng bộ qua hàng đợi, file JSON lines xoay vòng + nén
+log_pipeline = LoggingPipeline(
+    worker_path(settings.LOG_FILE),
+    level=settings.LOG_LEVEL,
+    max_bytes=settings.LOG_MAX_BYTES,
+    backup_count=settings.LOG_BACKUP_COUNT,
+    queue_size=settings.LOG_QUEUE_SIZE,
+)
+log_pipeline.start()
+atexit.register(log_pipeline.stop)
+
+# Lấy mẫu việc log toàn bộ payload theo loại event
+payload_sampler = PayloadSampler(settings.LOG_PAYLOAD_SAMPLE_RATES)
 
 logger = logging.getLogger(__name__)
+logger.info("Worker %d (pid %d) using shared stats at %s", shared_stats.worker_index, os.getpid(), shared_stats.path)
 
 app = FastAPI(
     title="Zalo Webhook Server",
@@ -36,40 +72,58 @@ app = FastAPI(
     version="1.0.0",
 )
 
+# Rate limit (GCRA) theo IP / app_id / user_id_by_app cho POST /webhook
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
+# Kiểm tra Content-Type / kích thước body khi đang nhận; thêm sau cùng để chạy đầu tiên
+app.add_middleware(WebhookSecurityMiddleware)
+
 # Khởi tạo event handler
-event_handler = EventHandler()
+event_handler = EventHandler(shared_stats)
 
-# Khởi tạo Jinja2 templates
-templates = Jinja2Templates(directory="templates")
+# Journal ghi payload xuống đĩa trước khi ack để không mất event khi crash/restart
+journal = IngestionJournal(
+    worker_path(settings.JOURNAL_DIR, is_dir=True),
+    segment_max_bytes=settings.JOURNAL_SEGMENT_MAX_BYTES,
+    flush_interval_ms=settings.JOURNAL_FLUSH_INTERVAL_MS,
+)
+_replay_tasks = set()
+# Event mà handler ném exception được lưu cạnh journal thay vì replay lặp lại
+event_handler.dead_letters = journal
 
-# ===================== Database setup (SQLAlchemy Async) =====================
-class Base(DeclarativeBase):
-    pass
-
-class ImageMessageEvent(Base):
-    __tablename__ = "image_message_events"
-
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    app_id: Mapped[str] = mapped_column(String(64), nullable=False)
-    user_id_by_app: Mapped[str] = mapped_column(String(64), nullable=False, index=True)
-    sender_id: Mapped[str] = mapped_column(String(64), nullable=False)
-    recipient_id: Mapped[str] = mapped_column(String(64), nullable=False)
-    event_name: Mapped[str] = mapped_column(String(64), nullable=False)
-    timestamp: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
-    msg_id: Mapped[str] = mapped_column(String(128), nullable=True)
-    text: Mapped[str] = mapped_column(String(2048), nullable=True)
-    attachments: Mapped[dict] = mapped_column(JSON, nullable=True)
-
-    __table_args__ = (
-        Index("idx_image_msg_user_time", "user_id_by_app", "timestamp"),
-    )
+# Chống trùng event do Zalo retry (Bloom filter + LRU + unique constraint trong DB)
+dedup_index = DedupIndex(
+    AsyncSessionLocal,
+    batch_writer,
+    EventDedupKey.__table__,
+    bloom_capacity=settings.DEDUP_BLOOM_CAPACITY,
+    lru_size=settings.DEDUP_LRU_SIZE,
+    retention_hours=settings.DEDUP_RETENTION_HOURS,
+)
 
-engine = create_async_engine(settings.DATABASE_URL, echo=False, pool_pre_ping=True)
-AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+# Phát event mới + thống kê tới dashboard qua SSE (đọc ring chung, không chạm luồng nhận webhook)
+live_hub = BroadcastHub(
+    shared_stats,
+    poll_interval_ms=settings.SSE_POLL_INTERVAL_MS,
+    client_buffer=settings.SSE_CLIENT_BUFFER,
+    heartbeat_seconds=settings.SSE_HEARTBEAT_SECONDS,
+    max_clients=settings.SSE_MAX_CLIENTS,
+    max_stream_seconds=settings.SSE_MAX_STREAM_SECONDS,
+)
 
-async def init_models():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+# Nhiều worker: khóa dedup được giữ chỗ trong DB thay vì chỉ trong Bloom/LRU của từng process
+dedup_index.worker_count = shared_stats.live_workers
+
+# Cache follow của mỗi worker đọc thêm event follow/unfollow của các worker khác qua ring chung
+follower_store.shared_stats = shared_stats
+# Quota gửi tin là của OA: chia đều cho các worker đang sống
+send_scheduler.worker_count = shared_stats.live_workers
+# Có refresh token: mọi request ra Zalo lấy access token qua token manager (tự làm mới)
+if token_manager.can_refresh:
+    zalo_client.token_manager = token_manager
+
+# Khởi tạo Jinja2 templates
+templates = Jinja2Templates(directory="templates")
 
 @app.on_event("startup")
 async def on_startup():
@@ -77,26 +131,133 @@ async def on_startup():
         await init_models()
         logger.info("Database tables ensured")
     except Exception as e:
-        logger.error(f"Failed to init database: {e}")
+        logger.error("Failed to init database: %s", e)
+    await event_partitions.start()
+    await batch_writer.start()
+    await dedup_index.start()
+    await follower_store.start()
+    await zalo_client.start()
+    await token_manager.start()
+    await attachment_fetcher.start()
+
+    await event_handler.start()
+
+    # Mở journal và replay các event chưa xử lý xong từ lần chạy trước. Khóa dedup được
+    # giữ chỗ trước khi nhận webhook mới để bản Zalo retry của các event này bị bỏ qua
+    unprocessed = await journal.start()
+    replay = await claim_journaled(journal, unprocessed)
+    if replay:
+        start_replay(replay_journal(journal, replay))
+    # Journal của worker không còn chạy (ví dụ sau khi giảm số worker) không ai replay
+    await adopt_orphan_journals()
+
+def start_replay(coro):
+    task = asyncio.create_task(coro)
+    _replay_tasks.add(task)
+    task.add_done_callback(_replay_tasks.discard)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await live_hub.close()
+    # Dừng các lane trước; event chưa xử lý kịp vẫn nằm trong journal để replay
+    await event_handler.stop()
+    for task in list(_replay_tasks):
+        task.cancel()
+    await asyncio.gather(*_replay_tasks, return_exceptions=True)
+    # Gửi nốt các tin đang chờ trước khi đóng connection pool
+    await send_scheduler.close()
+    await dedup_index.close()
+    await profile_cache.close()
+    await attachment_fetcher.close()
+    await token_manager.close()
+    await zalo_client.close()
+    # Flush trạng thái follow còn trong bộ nhớ vào batch writer trước khi đóng writer
+    await follower_store.close()
+    await batch_writer.close()
+    await event_partitions.close()
+    await journal.close()
+    shared_stats.close()
+
+async def claim_journaled(source: IngestionJournal, entries):
+    """
+    Parse các entry cần replay và giữ chỗ khóa dedup của chúng
+
+    Bỏ qua (đánh dấu xong) entry không decode được, entry trùng khóa với một entry trước
+    đó trong journal, và entry mà bản Zalo retry đã được nhận sau khi restart.
+
+    Returns:
+        Danh sách (seq, event) cần đưa lại vào lane
+    """
+    replay = []
+    seen = set()
+    for seq, payload in entries:
+        try:
+            zalo_event = parse_event_envelope(payload)
+        except Exception as e:
+            logger.error("Cannot decode journal entry %s: %s", seq, e)
+            zalo_event = None
+        if zalo_event is None:
+            source.mark_done(seq)
+            continue
+        dedup_key = make_dedup_key(zalo_event)
+        if dedup_key in seen or not await dedup_index.claim_replayed(dedup_key):
+            logger.info("Duplicate journal entry %s skipped: %s", seq, dedup_key)
+            source.mark_done(seq)
+            continue
+        seen.add(dedup_key)
+        replay.append((seq, zalo_event))
+    return replay
+
+async def replay_journal(source: IngestionJournal, events):
+    """Replay các entry còn nằm trong journal sau khi restart"""
+    logger.info("Replaying %s journaled events from %s", len(events), source.directory)
+    for seq, zalo_event in events:
+        await event_handler.dispatch_wait(zalo_event, functools.partial(source.mark_done, seq))
+
+def other_journal_dirs():
+    """Thư mục journal của mọi worker index khác (kể cả index không còn dùng)"""
+    own = os.path.abspath(journal.directory)
+    candidates = [settings.JOURNAL_DIR] + sorted(glob.glob(os.path.join(settings.JOURNAL_DIR, "worker-*")))
+    return [path for path in candidates if os.path.isdir(path) and os.path.abspath(path) != own]
+
+async def adopt_orphan_journals():
+    """
+    Replay journal của các worker index không có worker nào đang giữ
+
+    Worker đang sống giữ flock trên journal của mình, nên chỉ journal mồ côi mới mở được;
+    worker đầu tiên mở được sẽ giữ lock tới khi replay xong, các worker khác bỏ qua.
+    """
+    for path in other_journal_dirs():
+        orphan = IngestionJournal(path, segment_max_bytes=settings.JOURNAL_SEGMENT_MAX_BYTES)
+        try:
+            entries = await orphan.start(blocking=False)
+        except JournalLocked:
+            continue
+        start_replay(drain_orphan_journal(orphan, entries))
+
+async def drain_orphan_journal(orphan: IngestionJournal, entries):
+    """Replay journal mồ côi rồi đóng (ghi checkpoint, nhả lock) khi mọi entry đã xong"""
+    try:
+        events = await claim_journaled(orphan, entries)
+        if events:
+            await replay_journal(orphan, events)
+        while orphan.get_stats()["in_flight"]:
+            await asyncio.sleep(1)
+    finally:
+        await orphan.close()
 
-def verify_signature(request_body: str, signature: str) -> bool:
+def verify_signature(request_body: bytes, signature: str) -> bool:
     """
     Xác thực chữ ký từ Zalo để đảm bảo request hợp lệ
     """
     # Cho phép tắt bắt buộc chữ ký khi REQUIRE_SIGNATURE=False
     if not settings.REQUIRE_SIGNATURE:
         return True
-    if not settings.ZALO_SECRET_KEY:
+    if not signature_verifier.enabled:
         logger.warning("ZALO_SECRET_KEY chưa được cấu hình")
         return True  # Bỏ qua validation nếu chưa có secret key
     
-    expected_signature = hmac.new(
-        settings.ZALO_SECRET_KEY.encode('utf-8'),
-        request_body.encode('utf-8'),
-        hashlib.sha256
-    ).hexdigest()
-    
-    return hmac.compare_digest(expected_signature, signature)
+    return signature_verifier.verify(request_body, signature)
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
@@ -146,18 +307,37 @@ async def webhook_verification(hub_challenge: str = None, hub_verify_token: str
         logger.info("Webhook verification successful")
         return hub_challenge
     else:
-        logger.error(f"Webhook verification failed. Token: {hub_verify_token}")
+        logger.error("Webhook verification failed. Token: %s", hub_verify_token)
         raise HTTPException(status_code=403, detail="Verification failed")
 
 @app.post("/webhook")
-async def handle_webhook(request: Request, background_tasks: BackgroundTasks):
+async def handle_webhook(request: Request):
     """
     Endpoint chính để nhận các sự kiện từ Zalo
     """
+    started = time.perf_counter()
+    status_code = 500
     try:
-        # Đọc request body
-        body = await request.body()
-        body_str = body.decode('utf-8')
+        response = await process_webhook(request)
+        status_code = response.status_code
+        return response
+    except HTTPException as e:
+        status_code = e.status_code
+        raise
+    finally:
+        # Độ trễ ack (tới lúc trả response cho Zalo) và số lần trả lỗi, theo loại event
+        label = metrics.event_label(request.scope.get("state", {}).get("event_name"))
+        STAGE_SECONDS.observe(time.perf_counter() - started, label, "ack")
+        if status_code >= 300:
+            ERRORS.inc(label, "ack")
+
+async def process_webhook(request: Request) -> JSONResponse:
+    """Xác thực, chống trùng, ghi journal và đưa event vào lane xử lý"""
+    try:
+        # Đọc request body (giữ nguyên bytes cho cả HMAC, parse và journal);
+        # dùng lại nếu middleware đã đọc trước đó
+        state = request.scope.setdefault("state", {})
+        body = state["body"] if "body" in state else await request.body()
         
         # Lấy signature từ header (Zalo có thể dùng 'X-Zalo-Signature' hoặc 'X-ZSign')
         signature = (
@@ -166,29 +346,53 @@ async def handle_webhook(request: Request, background_tasks: BackgroundTasks):
             or ''
         )
         
-        # Verify signature
-        if not verify_signature(body_str, signature):
+        # Verify signature (bỏ qua nếu middleware đã xác thực body này)
+        if not state.get("signature_valid") and not verify_signature(body, signature):
             logger.error("Invalid signature")
             raise HTTPException(status_code=401, detail="Invalid signature")
         
-        # Parse JSON
+        # Chỉ validate envelope (app_id, event_name, user, timestamp, msg_id) từ raw bytes;
+        # model đầy đủ được dựng lazy trong worker
         try:
-            event_data = json.loads(body_str)
-        except json.JSONDecodeError as e:
-            logger.error(f"Invalid JSON: {e}")
+            zalo_event = state["envelope"] if state.get("envelope") else parse_event_envelope(body)
+        except ValueError as e:
+            logger.error("Invalid JSON: %s", e)
             raise HTTPException(status_code=400, detail="Invalid JSON")
         
-        logger.info(f"Received webhook: {event_data}")
-        
-        # Parse event từ raw data
-        zalo_event = parse_zalo_event(event_data)
-        
         if zalo_event:
-            # Đưa việc xử lý vào background để phản hồi 200 sớm cho Zalo
-            background_tasks.add_task(event_handler.handle_event, zalo_event)
-            logger.info(f"Queued event for async handling: {zalo_event.event_name}")
+            state["event_name"] = zalo_event.event_name
+            logger.info("Received webhook: %s from %s", zalo_event.event_name, zalo_event.user_id_by_app)
+            if payload_sampler.should_log(zalo_event.event_name):
+                logger.info(
+                    "Webhook payload",
+                    extra={"event_name": zalo_event.event_name, "payload": body.decode("utf-8", "replace")},
+                )
+            # Bỏ qua bản trùng (Zalo retry khi ack chậm) trước khi tới bất kỳ handler nào
+            dedup_key = make_dedup_key(zalo_event)
+            if not await dedup_index.claim(dedup_key):
+                logger.info("Duplicate event dropped: %s", dedup_key)
+                return JSONResponse(status_code=200, content={"message": "duplicate"})
+            
+            # Giữ chỗ trong lane của user trước khi ghi journal: entry đã ghi xuống đĩa luôn
+            # được đưa vào lane, không bao giờ bị bỏ lại rồi replay sau crash.
+            # Lane đầy thì từ chối sớm để Zalo gửi lại sau
+            if not event_handler.reserve(zalo_event):
+                await dedup_index.release(dedup_key)
+                event_handler.reject(zalo_event)
+                return queue_full_response()
+            # Ghi vào journal (group-commit fsync) trước khi ack để đảm bảo at-least-once
+            try:
+                seq = await journal.append(body)
+            except Exception:
+                event_handler.cancel_reservation(zalo_event)
+                await dedup_index.release(dedup_key)
+                raise
+            # Đưa vào lane của user để phản hồi 200 sớm cho Zalo
+            event_handler.dispatch(zalo_event, functools.partial(journal.mark_done, seq), reserved=True)
+            await dedup_index.confirm(dedup_key)
+            logger.info("Queued event for async handling: %s", zalo_event.event_name)
         else:
-            logger.warning(f"Unknown event type: {event_data}")
+            logger.warning("Unknown event type: %s", body[:1000].decode("utf-8", "replace"))
         
         # Trả về 200 ngay lập tức theo khuyến nghị của Zalo
         return JSONResponse(status_code=200, content={"message": "ok"})
@@ -196,15 +400,149 @@ async def handle_webhook(request: Request, background_tasks: BackgroundTasks):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error processing webhook: {str(e)}")
+        logger.error("Error processing webhook: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
+def queue_full_response() -> JSONResponse:
+    """Response 503 kèm Retry-After khi hàng đợi xử lý đã đầy"""
+    logger.warning("Event queue is full, rejecting webhook")
+    return JSONResponse(
+        status_code=503,
+        content={"message": "Server busy, retry later"},
+        headers={"Retry-After": str(settings.QUEUE_FULL_RETRY_AFTER)},
+    )
+
+@app.get("/stats")
+async def get_stats():
+    """
+    Thống kê events (tổng hợp mọi worker); các lane, dedup, journal, batch writer,
+    logging, outbound, send queue, profile cache và attachments là của worker phục vụ request
+    """
+    return {
+        "events": event_handler.get_statistics(),
+        "lanes": event_handler.get_dispatcher_stats(),
+        "db_writer": batch_writer.get_stats(),
+        "event_partitions": event_partitions.get_stats(),
+        "dedup": dedup_index.get_stats(),
+        "followers": follower_store.get_stats(),
+        "journal": journal.get_stats(),
+        "logging": log_pipeline.get_stats(),
+        "worker": shared_stats.get_stats(),
+        "live_stream": live_hub.get_stats(),
+        "outbound": zalo_client.get_stats(),
+        "send_queue": send_scheduler.get_stats(),
+        "oa_token": token_manager.get_stats(),
+        "profile_cache": profile_cache.get_stats(),
+        "attachments": attachment_fetcher.get_stats(),
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Metric dạng Prometheus text (tổng hợp mọi worker): thời gian theo giai đoạn
+    (ack, queue_wait, route, handler, batch_enqueue), số lỗi, thời gian commit lô DB
+    theo bảng
+    """
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/events")
-async def get_recent_events():
+async def get_recent_events(
+    limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[int] = Query(None, ge=1, description="Lấy các event cũ hơn seq này"),
+    event_name: Optional[str] = None,
+    user_id: Optional[str] = None,
+):
     """
     Endpoint để xem các events gần đây (có thể dùng để debug)
+    
+    Phân trang bằng `next_cursor` trong response; lọc theo `event_name`, `user_id`.
     """
-    return event_handler.get_recent_events()
+    return Response(
+        content=event_handler.get_recent_events(limit, cursor, event_name, user_id),
+        media_type="application/json",
+    )
+
+@app.get("/followers/{user_id}")
+async def get_follower_status(user_id: str):
+    """Người dùng có đang follow OA không (từ cache trong bộ nhớ, chỉ hỏi DB khi cache không có)"""
+    try:
+        following = await follower_store.check_following(user_id)
+    except Exception as e:
+        logger.error("Follower lookup failed: %s", e)
+        raise HTTPException(status_code=503, detail="Follower store unavailable")
+    return {"user_id": user_id, "following": following}
+
+@app.get("/users/{user_id}/submissions")
+async def get_user_submissions(
+    user_id: str,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="`next_cursor` của trang trước"),
+):
+    """Thông tin người dùng đã submit, mới nhất trước (phân trang keyset)"""
+    try:
+        async with AsyncSessionLocal() as session:
+            return await list_user_submissions(session, user_id, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/submissions")
+async def get_submissions(
+    limit: int = Query(500, ge=1, le=5000),
+    cursor: int = Query(0, ge=0, description="`next_cursor` của trang trước (id)"),
+):
+    """Toàn bộ submissions theo thứ tự ghi, để kéo dữ liệu ra theo lô (phân trang keyset)"""
+    async with AsyncSessionLocal() as session:
+        return await list_submissions(session, limit, cursor)
+
+def _image_cursor(cursor: Optional[str]):
+    try:
+        return decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/users/{user_id}/images")
+async def get_user_images(
+    user_id: str,
+    limit: int = Query(50, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="`next_cursor` của trang trước"),
+):
+    """Ảnh người dùng đã gửi, mới nhất trước (phân trang keyset, stream JSON)"""
+    return StreamingResponse(
+        stream_images(AsyncSessionLocal, limit, _image_cursor(cursor), user_id=user_id),
+        media_type="application/json",
+    )
+
+@app.get("/images")
+async def get_images(
+    since: Optional[int] = Query(None, ge=0, description="Từ timestamp (ms, tính cả)"),
+    until: Optional[int] = Query(None, ge=0, description="Tới timestamp (ms, không tính)"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="`next_cursor` của trang trước"),
+):
+    """Ảnh của mọi người dùng trong khoảng thời gian, mới nhất trước (phân trang keyset, stream JSON)"""
+    return StreamingResponse(
+        stream_images(AsyncSessionLocal, limit, _image_cursor(cursor), since=since, until=until),
+        media_type="application/json",
+    )
+
+@app.get("/events/stream")
+async def stream_events(request: Request):
+    """
+    Server-Sent Events: event mới (`event`), thống kê thay đổi (`stats`) và số event
+    bị bỏ khi client đọc chậm (`lagged`)
+    """
+    if live_hub.full:
+        return JSONResponse(status_code=503, content={"message": "Too many live clients"})
+    try:
+        last_event_id = int(request.headers.get("last-event-id", ""))
+    except ValueError:
+        last_event_id = None
+    return StreamingResponse(
+        live_hub.stream(last_event_id),
+        media_type="text/event-stream",
+        # Tắt buffer của nginx để event tới dashboard ngay
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark + kiểm tra AttachmentFetcher trên stub_zalo_server.py (localhost, không cần mạng)
+
+- Tải `--files` URL, trong đó chỉ có `--distinct` nội dung khác nhau: mỗi nội dung chỉ
+  được ghi ra đĩa một lần, file trên đĩa có tên đúng bằng SHA-256 nội dung
+- Bộ nhớ cấp phát tối đa (tracemalloc, gồm cả stub server chạy cùng process) không tăng
+  theo kích thước file, vì file được stream xuống đĩa từng chunk (so sánh --size-kb 1024
+  và 8192)
+- File lớn hơn ATTACHMENT_MAX_BYTES bị bỏ, không để lại file tạm
+
+Chạy: python benchmarks/bench_attachments.py [--files 200] [--distinct 20] [--size-kb 2048]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn
+
+from benchmarks.stub_zalo_server import create_app
+from services.attachment_fetcher import AttachmentFetcher
+
+
+async def main():
+    logging.getLogger("services.attachment_fetcher").setLevel(logging.CRITICAL)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=20)
+    parser.add_argument("--size-kb", type=int, default=2048)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8902)
+    args = parser.parse_args()
+    size = args.size_kb * 1024
+
+    app = create_app()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    with tempfile.TemporaryDirectory() as storage_dir:
+        fetcher = AttachmentFetcher(
+            storage_dir,
+            max_concurrency=args.concurrency,
+            max_bytes=size,
+            allowed_hosts=["127.0.0.1"],
+            require_https=False,
+        )
+        await fetcher.start()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def fetch(index):
+            # Query khác nhau: URL khác nhau nhưng nội dung trùng theo seed
+            async with semaphore:
+                return await fetcher.fetch(f"{base_url}/stub/files/{index % args.distinct}?size={size}&n={index}")
+
+        try:
+            tracemalloc.start()
+            started = time.perf_counter()
+            paths = await asyncio.gather(*(fetch(index) for index in range(args.files)))
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            too_large = await fetcher.fetch(f"{base_url}/stub/files/0?size={size + 1}")
+        finally:
+            await fetcher.close()
+            server.should_exit = True
+            await server_task
+
+        stored = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(storage_dir)
+            if not root.endswith("tmp")
+            for name in names
+        ]
+        for path in stored:
+            with open(path, "rb") as f:
+                assert hashlib.sha256(f.read()).hexdigest() == os.path.basename(path), path
+        stats = fetcher.get_stats()
+        print(f"{args.files} downloads of {args.size_kb} KB ({args.distinct} distinct), "
+              f"concurrency {args.concurrency}")
+        print(f"  {args.files * size / elapsed / 1024 / 1024:.1f} MB/s, {elapsed:.2f}s")
+        print(f"  files on disk: {len(stored)}  stored {stats['stored']}  duplicates {stats['duplicates']}")
+        print(f"  peak traced memory: {peak / 1024:.0f} KB (file size {args.size_kb} KB)")
+        assert None not in paths
+        assert len(stored) == args.distinct == stats["stored"]
+        assert too_large is None and not os.listdir(os.path.join(storage_dir, "tmp"))
+        print("OK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Benchmark so khớp từ khóa: chuỗi `keyword in text.lower()` (cách cũ của
+MessageHandler) so với automaton Aho-Corasick của IntentMatcher, khi số từ khóa tăng.
+
+Chạy: python benchmarks/bench_intent_matcher.py
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from handlers.intent_matcher import IntentRules, normalize_text
+
+SYLLABLES = [
+    "xin", "chào", "cảm", "ơn", "giá", "bao", "nhiêu", "đặt", "hàng", "giao", "địa", "chỉ",
+    "mở", "cửa", "khuyến", "mãi", "bảo", "hành", "đổi", "trả", "ship", "size", "màu", "còn",
+]
+MESSAGES = 20_000
+
+
+def make_rules(keyword_count: int):
+    random.seed(keyword_count)
+    keywords = [" ".join(random.sample(SYLLABLES, 2)) + f" {i}" for i in range(keyword_count)]
+    intents = [
+        {"name": f"intent{i}", "keywords": keywords[i::10], "reply": "ok"}
+        for i in range(10)
+    ]
+    return keywords, intents
+
+
+def naive_match(text, intents):
+    lowered = text.lower()
+    for intent in intents:
+        for keyword in intent["keywords"]:
+            if keyword in lowered:
+                return intent
+    return None
+
+
+def main():
+    random.seed(0)
+    messages = [
+        " ".join(random.choice(SYLLABLES) for _ in range(random.randint(3, 25)))
+        for _ in range(MESSAGES)
+    ]
+    print(f"{MESSAGES} messages, 3-25 syllables each")
+    print(f"{'keywords':>9} {'naive chain':>14} {'aho-corasick':>14}")
+    for keyword_count in (10, 100, 1000, 5000):
+        _, intents = make_rules(keyword_count)
+        rules = IntentRules({"intents": intents})
+
+        started = time.perf_counter()
+        for text in messages:
+            naive_match(text, intents)
+        naive = (time.perf_counter() - started) / MESSAGES * 1e6
+
+        started = time.perf_counter()
+        for text in messages:
+            rules.automaton.best_match(normalize_text(text))
+        automaton = (time.perf_counter() - started) / MESSAGES * 1e6
+
+        print(f"{keyword_count:>9} {naive:>11.2f} µs {automaton:>11.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
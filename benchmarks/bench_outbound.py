@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Benchmark client gọi Zalo Send API: ZaloClient dùng chung (connection pool keep-alive,
+giới hạn đồng thời, retry) so với cách tạo httpx.AsyncClient mới cho mỗi tin nhắn.
+
+Tự chạy stub_zalo_server.py trên localhost (HTTP/1.1, không TLS), không cần mạng.
+
+Chạy: python benchmarks/bench_outbound.py [--messages 1000] [--latency-ms 20] [--failure-rate 0.02]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import uvicorn
+
+from benchmarks.stub_zalo_server import create_app
+from services.zalo_client import ZaloClient
+
+CONCURRENCY = 50
+
+
+def _report(name: str, elapsed: float, latencies, extra: str = ""):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{name:<28} {len(latencies) / elapsed:>8.0f} msg/s  "
+        f"p50 {statistics.median(latencies) * 1000:>7.2f} ms  p99 {p99 * 1000:>7.2f} ms  {extra}"
+    )
+
+
+async def _run(messages: int, worker):
+    latencies = []
+    queue = asyncio.Queue()
+    for index in range(messages):
+        queue.put_nowait(index)
+
+    async def consume():
+        while not queue.empty():
+            index = queue.get_nowait()
+            started = time.perf_counter()
+            await worker(index)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(consume() for _ in range(CONCURRENCY)))
+    return time.perf_counter() - started, latencies
+
+
+async def bench_per_request_client(base_url: str, messages: int):
+    failures = 0
+
+    async def send(index):
+        nonlocal failures
+        async with httpx.AsyncClient(base_url=base_url, timeout=10) as client:
+            response = await client.post(
+                "/v3.0/oa/message/cs",
+                json={"recipient": {"user_id": f"user{index}"}, "message": {"text": "hi"}},
+                headers={"access_token": "bench"},
+            )
+            if response.status_code != 200:
+                failures += 1
+
+    elapsed, latencies = await _run(messages, send)
+    _report("new client per message", elapsed, latencies, f"failed {failures}")
+
+
+async def bench_shared_client(base_url: str, messages: int):
+    client = ZaloClient(base_url, access_token="bench", max_concurrency=CONCURRENCY,
+                        max_connections=20, max_keepalive=20, backoff_base_ms=10)
+    await client.start()
+    failures = 0
+
+    async def send(index):
+        nonlocal failures
+        try:
+            await client.send_text(f"user{index}", "hi")
+        except Exception:
+            failures += 1
+
+    elapsed, latencies = await _run(messages, send)
+    stats = client.get_stats()
+    await client.close()
+    _report("shared ZaloClient (pool)", elapsed, latencies,
+            f"failed {failures}  retries {stats['retries']}")
+
+
+async def main():
+    # Log retry của client không làm nhiễu kết quả
+    logging.getLogger("services.zalo_client").setLevel(logging.ERROR)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--failure-rate", type=float, default=0.02)
+    parser.add_argument("--port", type=int, default=8901)
+    args = parser.parse_args()
+
+    app = create_app(args.latency_ms, args.failure_rate)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    print(f"{args.messages} messages, concurrency {CONCURRENCY}, stub latency {args.latency_ms} ms, "
+          f"failure rate {args.failure_rate}")
+    try:
+        for bench in (bench_shared_client, bench_per_request_client):
+            connections_before = len(app.state.connections)
+            await bench(base_url, args.messages)
+            print(f"{'':<28} TCP connections opened: {len(app.state.connections) - connections_before}")
+    finally:
+        server.should_exit = True
+        await server_task
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
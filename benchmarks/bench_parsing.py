@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: so sánh chi phí CPU mỗi request của đường parse cũ
+(decode -> json.loads -> log dict -> parse_zalo_event) với đường đang dùng: chỉ
+validate envelope trên request path (parse_event_envelope), rồi dựng model đầy đủ
+trong worker (load_event, cùng dùng lại kết quả parse).
+
+Chạy: python benchmarks/bench_parsing.py
+"""
+
+import importlib.util
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+from models.zalo_events import parse_zalo_event, parse_event_envelope
+
+ITERATIONS = 20000
+
+def make_payload(attachments: int) -> bytes:
+    """Tạo payload user_send_image với số attachment cho trước"""
+    return json.dumps({
+        "app_id": "bench_app",
+        "event_name": "user_send_image",
+        "timestamp": "1700000000000",
+        "user_id_by_app": "bench_user",
+        "message": {
+            "msg_id": "bench_msg",
+            "text": "xin chào",
+            "attachments": [
+                {
+                    "type": "image",
+                    "payload": {
+                        "url": f"https://example.com/image_{i}.jpg",
+                        "thumbnail": f"https://example.com/thumb_{i}.jpg",
+                    },
+                }
+                for i in range(attachments)
+            ],
+        },
+        "sender": {"id": "bench_user", "name": "Bench User"},
+        "recipient": {"id": "bench_oa"},
+    }).encode("utf-8")
+
+def legacy_path(body: bytes):
+    body_str = body.decode("utf-8")
+    event_data = json.loads(body_str)
+    f"Received webhook: {event_data}"  # chi phí format log cũ
+    return parse_zalo_event(event_data)
+
+def full_path(body: bytes):
+    return parse_event_envelope(body).load_event()
+
+def envelope_path(body: bytes):
+    return parse_event_envelope(body)
+
+def measure(func, body: bytes) -> float:
+    """Trả về thời gian CPU trung bình mỗi lần gọi (micro giây)"""
+    for _ in range(200):
+        func(body)
+    started = time.process_time()
+    for _ in range(ITERATIONS):
+        func(body)
+    return (time.process_time() - started) / ITERATIONS * 1e6
+
+def main():
+    print("🧪 Parsing microbenchmark\n")
+    backends = ["pydantic"]
+    if importlib.util.find_spec("orjson") is not None:
+        backends.append("orjson")
+    else:
+        print("⚠️  orjson not installed, skipping orjson backend\n")
+
+    for attachments in (1, 10, 100):
+        body = make_payload(attachments)
+        legacy = measure(legacy_path, body)
+        print(f"📦 {attachments} attachments ({len(body)} bytes)")
+        print(f"   legacy             : {legacy:8.2f} µs/request")
+        for backend in backends:
+            settings.JSON_BACKEND = backend
+            envelope = measure(envelope_path, body)
+            print(f"   envelope ({backend:8}): {envelope:8.2f} µs/request  ({(1 - envelope / legacy) * 100:5.1f}% less CPU)")
+            full = measure(full_path, body)
+            print(f"   + model ({backend:8}) : {full:8.2f} µs/event    ({(1 - full / legacy) * 100:5.1f}% less CPU)")
+        print()
+
+if __name__ == "__main__":
+    main()
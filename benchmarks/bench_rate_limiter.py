@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark rate limiter: so sánh limiter cũ (deque các datetime cho mỗi IP) với
+RateLimiter GCRA (một float cho mỗi key, loại bỏ key idle) trên 100k key khác nhau.
+
+Chạy: python benchmarks/bench_rate_limiter.py
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from middleware import RateLimiter
+
+KEYS = 100_000
+REQUESTS_PER_KEY = 5
+RATE_PER_MINUTE = 100
+
+class LegacyRateLimiter:
+    """Bản sao limiter cũ: deque datetime cho mỗi key, không bao giờ xóa key"""
+
+    def __init__(self):
+        self.requests = defaultdict(deque)
+        self.window_size = timedelta(minutes=1)
+
+    def is_rate_limited(self, client_ip: str) -> bool:
+        now = datetime.now()
+        while (self.requests[client_ip] and
+               now - self.requests[client_ip][0] > self.window_size):
+            self.requests[client_ip].popleft()
+        if len(self.requests[client_ip]) >= RATE_PER_MINUTE:
+            return True
+        self.requests[client_ip].append(now)
+        return False
+
+def drive(limiter, keys):
+    for _ in range(REQUESTS_PER_KEY):
+        for key in keys:
+            limiter.is_rate_limited(key)
+
+def run(factory, keys):
+    """Trả về (thời gian mỗi lần check, bộ nhớ giữ lại sau khi chạy, limiter)"""
+    limiter = factory()
+    started = time.perf_counter()
+    drive(limiter, keys)
+    elapsed = time.perf_counter() - started
+
+    # Đo bộ nhớ ở một lần chạy riêng vì tracemalloc làm chậm đáng kể
+    tracemalloc.start()
+    measured = factory()
+    drive(measured, keys)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del measured
+    return elapsed / (len(keys) * REQUESTS_PER_KEY) * 1e9, retained, limiter
+
+def main():
+    print(f"🧪 Rate limiter benchmark: {KEYS} keys x {REQUESTS_PER_KEY} requests\n")
+    keys = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(KEYS)]
+
+    legacy_ns, legacy_mem, _ = run(LegacyRateLimiter, keys)
+    gcra_ns, gcra_mem, _ = run(lambda: RateLimiter(RATE_PER_MINUTE, max_keys=KEYS), keys)
+
+    print(f"   legacy (deque)    : {legacy_ns:8.1f} ns/check, {legacy_mem / 1024 / 1024:7.2f} MB retained")
+    print(f"   GCRA              : {gcra_ns:8.1f} ns/check, {gcra_mem / 1024 / 1024:7.2f} MB retained")
+
+    # Key idle được loại bỏ: giới hạn số key nhỏ hơn số key đang gửi
+    bounded_ns, bounded_mem, bounded = run(lambda: RateLimiter(RATE_PER_MINUTE, max_keys=KEYS // 10), keys)
+    print(f"   GCRA (max {KEYS // 10} keys): {bounded_ns:8.1f} ns/check, {bounded_mem / 1024 / 1024:7.2f} MB retained, "
+          f"{bounded.evicted} evictions")
+
+if __name__ == "__main__":
+    main()
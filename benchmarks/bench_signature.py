@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Benchmark xác thực chữ ký webhook: so sánh cách cũ (encode secret + decode/encode
+body + hmac.new mỗi request) với SignatureVerifier (HMAC đã key sẵn, copy() và hash
+thẳng trên raw bytes), cho payload thường và payload lớn nhiều MB.
+
+Chạy: python benchmarks/bench_signature.py
+"""
+
+import hashlib
+import hmac
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from middleware import SignatureVerifier
+
+SECRET = "bench_secret_key"
+PREVIOUS_SECRET = "bench_previous_secret_key"
+
+def legacy_verify(body: bytes, signature: str) -> bool:
+    body_str = body.decode('utf-8')
+    expected_signature = hmac.new(
+        SECRET.encode('utf-8'),
+        body_str.encode('utf-8'),
+        hashlib.sha256
+    ).hexdigest()
+    return hmac.compare_digest(expected_signature, signature)
+
+def measure(func, body: bytes, signature: str, iterations: int) -> float:
+    """Trả về thời gian trung bình mỗi lần xác thực (micro giây)"""
+    assert func(body, signature)
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func(body, signature)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+def main():
+    print("🧪 Signature verification benchmark\n")
+    verifier = SignatureVerifier([SECRET])
+    # Trong lúc xoay vòng key, chữ ký cũ phải thử qua secret mới trước
+    rotating = SignatureVerifier([PREVIOUS_SECRET, SECRET])
+
+    cases = [
+        ("typical (600 B)", 600, 200000),
+        ("medium (64 KB)", 64 * 1024, 20000),
+        ("large (4 MB)", 4 * 1024 * 1024, 200),
+    ]
+    for label, size, iterations in cases:
+        body = (b'{"text": "' + b"x" * size + b'"}')[:size]
+        signature = verifier.sign(body)
+        legacy = measure(legacy_verify, body, signature, iterations)
+        shared = measure(verifier.verify, body, signature, iterations)
+        rotated = measure(rotating.verify, body, signature, iterations)
+        print(f"📦 {label}")
+        print(f"   legacy            : {legacy:10.2f} µs")
+        print(f"   verifier          : {shared:10.2f} µs  ({(1 - shared / legacy) * 100:5.1f}% faster)")
+        print(f"   verifier, 2 keys  : {rotated:10.2f} µs  (worst case during rotation)")
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Server giả lập Zalo OpenAPI để benchmark/test client gọi ra ngoài mà không cần mạng
+
+Trả về {"error": 0, ...} cho /v3.0/oa/message/cs sau một độ trễ cố định; có thể cho
+một tỉ lệ request trả về 503 (kèm Retry-After) để kiểm tra retry. /stub/files/{seed}
+trả về file giả (nội dung xác định theo seed và size) theo từng chunk, như CDN attachment.
+
+Chạy: python benchmarks/stub_zalo_server.py --port 8900 --latency-ms 20 --failure-rate 0.05
+"""
+
+import argparse
+import asyncio
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def create_app(latency_ms: float = 20, failure_rate: float = 0.0) -> FastAPI:
+    app = FastAPI()
+    app.state.requests = 0
+    app.state.connections = set()
+
+    @app.post("/v3.0/oa/message/cs")
+    async def send_message(request: Request):
+        app.state.requests += 1
+        client = request.scope.get("client")
+        if client:
+            app.state.connections.add(tuple(client))
+        body = await request.json()
+        await asyncio.sleep(latency_ms / 1000.0)
+        if random.random() < failure_rate:
+            return JSONResponse({"error": -32, "message": "Service unavailable"}, status_code=503,
+                                headers={"Retry-After": "0"})
+        if not request.headers.get("access_token"):
+            return JSONResponse({"error": -216, "message": "Access token is invalid"})
+        return {
+            "error": 0,
+            "message": "Success",
+            "data": {"message_id": f"stub-{app.state.requests}", "user_id": body["recipient"]["user_id"]},
+        }
+
+    @app.get("/stub/files/{seed}")
+    async def download_file(seed: int, size: int = 1024 * 1024):
+        app.state.requests += 1
+        block = random.Random(seed).randbytes(64 * 1024)
+
+        async def body():
+            sent = 0
+            while sent < size:
+                chunk = block[: min(len(block), size - sent)]
+                sent += len(chunk)
+                yield chunk
+                await asyncio.sleep(0)
+
+        return StreamingResponse(body(), media_type="application/octet-stream",
+                                 headers={"Content-Length": str(size)})
+
+    @app.get("/stub/stats")
+    async def stats():
+        return {"requests": app.state.requests, "connections": len(app.state.connections)}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub Zalo OpenAPI server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency_ms, args.failure_rate), host=args.host, port=args.port,
+                log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,23 @@
 import logging
-from typing import Dict, Any, List
-from datetime import datetime, timedelta
-from collections import deque
-import asyncio
+from typing import Dict, Any, Callable, Optional
+from datetime import datetime
+import time
 
 from models.zalo_events import (
-    ZaloEvent, UserSendTextEvent, UserSendImageEvent, UserSendFileEvent,
+    EventEnvelope, UserSendTextEvent, UserSendImageEvent, UserSendFileEvent,
     UserSendStickerEvent, UserSendLocationEvent, FollowOAEvent, UnfollowOAEvent,
     UserSubmitInfoEvent, UserClickButtonEvent
 )
 from handlers.message_handler import MessageHandler
 from handlers.user_action_handler import UserActionHandler
+from pipeline.dispatcher import ShardedDispatcher
+from monitoring.shared_stats import SharedStatsStore
+from monitoring.recent_events import RecentEventsRing
+from monitoring.metrics import registry as metrics, STAGE_SECONDS, ERRORS
+from pipeline.completion import EventCompletion, reset_current, set_current
+from pipeline.dedup import make_dedup_key
+from storage.database import ImageMessageEvent, RawEvent, batch_writer
+from config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -19,25 +26,114 @@ class EventHandler:
     Main event handler để xử lý tất cả các sự kiện từ Zalo
     """
     
-    def __init__(self):
+    def __init__(self, stats_store: Optional[SharedStatsStore] = None):
         self.message_handler = MessageHandler()
         self.user_action_handler = UserActionHandler()
         
-        # Lưu trữ events gần đây để debug (trong memory)
-        self.recent_events: deque = deque(maxlen=100)
+        # Statistics + events gần đây để debug: dùng chung giữa các worker process
+        self.stats_store = stats_store or SharedStatsStore.from_settings().open()
+        self.recent_events = RecentEventsRing(self.stats_store)
         
-        # Statistics
-        self.event_stats = {}
+        # Nơi lưu payload của event mà handler ném exception (gắn từ app, ví dụ journal)
+        self.dead_letters = None
         
-    async def handle_event(self, event: ZaloEvent) -> bool:
+        # Dispatcher theo user: event của cùng một user_id_by_app xử lý đúng thứ tự,
+        # các user khác nhau xử lý song song trên các lane
+        self.dispatcher = ShardedDispatcher(
+            self._process_dispatched,
+            lanes=settings.EVENT_LANES,
+            lane_capacity=settings.EVENT_LANE_QUEUE_SIZE,
+            name="event-lane",
+        )
+    
+    async def start(self):
+        """Khởi động các lane xử lý event"""
+        await self.dispatcher.start()
+    
+    async def stop(self):
+        """Dừng các lane sau khi xử lý hết hàng đợi"""
+        await self.dispatcher.stop()
+    
+    def reserve(self, event: EventEnvelope) -> bool:
+        """Giữ trước một chỗ trong lane của user (False nếu lane đã đầy)"""
+        return self.dispatcher.reserve(event.user_id_by_app)
+    
+    def cancel_reservation(self, event: EventEnvelope):
+        """Trả lại chỗ đã giữ khi event không được đưa vào lane"""
+        self.dispatcher.cancel_reservation(event.user_id_by_app)
+    
+    def reject(self, event: EventEnvelope):
+        """Ghi nhận event bị từ chối do lane đầy"""
+        self.dispatcher.record_rejection(event.user_id_by_app)
+    
+    def dispatch(
+        self, event: EventEnvelope, on_done: Optional[Callable[[], None]] = None, reserved: bool = False
+    ) -> bool:
+        """
+        Đưa event vào lane của user, không chờ
+        
+        Args:
+            event: EventEnvelope đã validate trên request path
+            on_done: callback gọi sau khi event được xử lý xong
+            reserved: dùng chỗ đã giữ bằng `reserve` (luôn thành công)
+            
+        Returns:
+            bool: False nếu lane đã đầy
+        """
+        return self.dispatcher.submit(
+            event.user_id_by_app, event, on_done, time.perf_counter(), reserved=reserved
+        )
+    
+    async def dispatch_wait(self, event: EventEnvelope, on_done: Optional[Callable[[], None]] = None):
+        """Đưa event vào lane của user, chờ nếu lane đầy (dùng cho replay)"""
+        await self.dispatcher.put(event.user_id_by_app, event, on_done, time.perf_counter())
+    
+    async def _process_dispatched(
+        self, event: EventEnvelope, on_done: Optional[Callable[[], None]], enqueued_at: float
+    ):
+        """
+        Xử lý một event lấy từ lane rồi báo hoàn tất cho journal (`on_done`)
+        
+        - Xử lý xong bình thường (kể cả handler trả về False): gọi `on_done` sau khi mọi
+          row handler đưa vào batch writer đã commit (pipeline.completion), để watermark
+          của journal không vượt qua event mà dữ liệu chưa nằm trong database
+        - Handler ném exception: payload được ghi vào dead-letter (nếu có) rồi mới gọi
+          `on_done`, để event lỗi không bị replay lặp lại mãi sau mỗi lần restart
+        - Bị hủy (lane dừng khi shutdown quá thời gian chờ): không gọi `on_done`, event
+          còn trong journal và được replay khi khởi động lại
+        """
+        STAGE_SECONDS.observe(
+            time.perf_counter() - enqueued_at, metrics.event_label(event.event_name), "queue_wait"
+        )
+        completion = EventCompletion(on_done)
+        token = set_current(completion)
+        try:
+            await self.handle_event(event)
+        except Exception as e:
+            if self.dead_letters is not None:
+                try:
+                    await self.dead_letters.dead_letter(event.raw, f"{type(e).__name__}: {e}")
+                except Exception as dl_error:
+                    # Không ghi được dead-letter: giữ event trong journal để replay
+                    logger.error("Failed to dead-letter event %s: %s", event.event_name, dl_error)
+                    return
+            logger.error("Event %s from %s dead-lettered: %s", event.event_name, event.user_id_by_app, e)
+        finally:
+            reset_current(token)
+        completion.release()
+        
+    async def handle_event(self, event: EventEnvelope) -> bool:
         """
         Xử lý event từ Zalo
         
         Args:
-            event: ZaloEvent object
+            event: EventEnvelope; model đầy đủ chỉ được dựng khi handler cần đến
             
         Returns:
             bool: True nếu xử lý thành công
+            
+        Raises:
+            Exception: lỗi không lường trước của handler (sau khi đã log và tính metric)
         """
         try:
             # Lưu event vào recent events
@@ -47,129 +143,165 @@ class EventHandler:
             self._update_stats(event.event_name)
             
             # Log event
-            logger.info(f"Handling event: {event.event_name} from user: {event.user_id_by_app}")
+            logger.info("Handling event: %s from user: %s", event.event_name, event.user_id_by_app)
+            
+            # Lưu payload gốc của mọi event (bảng events, ghi theo lô)
+            await self._persist_raw_event(event)
             
             # Route event đến handler tương ứng
+            started = time.perf_counter()
             success = await self._route_event(event)
+            STAGE_SECONDS.observe(time.perf_counter() - started, metrics.event_label(event.event_name), "route")
             
             if success:
-                logger.info(f"Successfully processed event: {event.event_name}")
+                logger.info("Successfully processed event: %s", event.event_name)
             else:
-                logger.warning(f"Failed to process event: {event.event_name}")
+                ERRORS.inc(metrics.event_label(event.event_name), "route")
+                logger.warning("Failed to process event: %s", event.event_name)
                 
             return success
             
         except Exception as e:
-            logger.error(f"Error handling event {event.event_name}: {str(e)}")
-            return False
+            ERRORS.inc(metrics.event_label(event.event_name), "route")
+            logger.error("Error handling event %s: %s", event.event_name, e)
+            raise
     
-    async def _route_event(self, event: ZaloEvent) -> bool:
+    async def _route_event(self, envelope: EventEnvelope) -> bool:
         """Route event đến handler phù hợp"""
+        label = metrics.event_label(envelope.event_name)
+        
+        # Event không có handler riêng: không cần dựng model đầy đủ
+        if not envelope.is_typed:
+            started = time.perf_counter()
+            handled = await self._handle_generic_event(envelope)
+            STAGE_SECONDS.observe(time.perf_counter() - started, label, "generic_handler")
+            return handled
         
+        # Dựng model đầy đủ (lazy) vì handler sẽ đọc các field chi tiết
+        event = envelope.load_event()
+        if event is None:
+            logger.warning("Invalid payload for event: %s", envelope.event_name)
+            return False
+        
+        started = time.perf_counter()
         # Message events
         if isinstance(event, (UserSendTextEvent, UserSendImageEvent, UserSendFileEvent, 
                             UserSendStickerEvent, UserSendLocationEvent)):
             handled = await self.message_handler.handle_message_event(event)
+            STAGE_SECONDS.observe(time.perf_counter() - started, label, "message_handler")
             try:
-                # Ghi riêng sự kiện ảnh vào DB nếu có
+                # Ghi riêng sự kiện ảnh vào DB nếu có (qua batch writer)
                 if isinstance(event, UserSendImageEvent):
-                    from app import AsyncSessionLocal, ImageMessageEvent
-                    async with AsyncSessionLocal() as session:
-                        await self._persist_image_event(session, event)
+                    started = time.perf_counter()
+                    await self._persist_image_event(event)
+                    STAGE_SECONDS.observe(time.perf_counter() - started, label, "batch_enqueue")
                 return handled
             except Exception as e:
-                logger.error(f"DB persist error: {e}")
+                ERRORS.inc(label, "batch_enqueue")
+                logger.error("DB persist error: %s", e)
                 return handled
         
         # User action events
         elif isinstance(event, (FollowOAEvent, UnfollowOAEvent, UserSubmitInfoEvent, 
                               UserClickButtonEvent)):
-            return await self.user_action_handler.handle_user_action_event(event)
+            handled = await self.user_action_handler.handle_user_action_event(event)
+            STAGE_SECONDS.observe(time.perf_counter() - started, label, "user_action_handler")
+            return handled
         
         # Generic event handler
         else:
-            return await self._handle_generic_event(event)
+            handled = await self._handle_generic_event(envelope)
+            STAGE_SECONDS.observe(time.perf_counter() - started, label, "generic_handler")
+            return handled
 
-    async def _persist_image_event(self, session, event: "UserSendImageEvent") -> None:
+    async def _persist_raw_event(self, envelope: EventEnvelope) -> None:
+        label = metrics.event_label(envelope.event_name)
+        started = time.perf_counter()
+        try:
+            await batch_writer.add(RawEvent.__table__, {
+                "timestamp": int(envelope.timestamp),
+                "event_key": make_dedup_key(envelope),
+                "app_id": envelope.app_id,
+                "event_name": envelope.event_name,
+                "user_id_by_app": envelope.user_id_by_app,
+                "msg_id": envelope.msg_id,
+                "payload": envelope.payload(),
+            })
+        except Exception as e:
+            ERRORS.inc(label, "batch_enqueue")
+            logger.error("Raw event persist error: %s", e)
+        else:
+            STAGE_SECONDS.observe(time.perf_counter() - started, label, "batch_enqueue")
+    
+    async def _persist_image_event(self, event: "UserSendImageEvent") -> None:
         attachments = event.message.attachments or []
         # Chuyển đổi timestamp từ string sang int
         timestamp_int = int(event.timestamp) if isinstance(event.timestamp, str) else event.timestamp
-        record = ImageMessageEvent(
-            app_id=event.app_id,
-            user_id_by_app=event.user_id_by_app,
-            sender_id=event.sender.id if getattr(event, "sender", None) else "",
-            recipient_id=event.recipient.id if getattr(event, "recipient", None) else "",
-            event_name=event.event_name,
-            timestamp=timestamp_int,
-            msg_id=event.message.msg_id if event.message else None,
-            text=event.message.text if event.message else None,
-            attachments={"attachments": attachments},
-        )
-        session.add(record)
-        await session.commit()
+        row = {
+            "app_id": event.app_id,
+            "user_id_by_app": event.user_id_by_app,
+            "sender_id": event.sender.id if getattr(event, "sender", None) else "",
+            "recipient_id": event.recipient.id if getattr(event, "recipient", None) else "",
+            "event_name": event.event_name,
+            "timestamp": timestamp_int,
+            "msg_id": event.message.msg_id if event.message else None,
+            "text": event.message.text if event.message else None,
+            "attachments": {"attachments": attachments},
+        }
+        await batch_writer.add(ImageMessageEvent.__table__, row)
     
-    async def _handle_generic_event(self, event: ZaloEvent) -> bool:
+    async def _handle_generic_event(self, event: EventEnvelope) -> bool:
         """Xử lý các events chưa được định nghĩa cụ thể"""
-        logger.info(f"Handling generic event: {event.event_name}")
-        logger.debug(f"Event data: {event.model_dump()}")
+        logger.info("Handling generic event: %s", event.event_name)
+        logger.debug("Event data: %s", event.raw)
         
         # Ở đây bạn có thể thêm logic xử lý chung
         # Ví dụ: lưu vào database, gửi notification, etc.
         
         return True
     
-    def _store_recent_event(self, event: ZaloEvent):
-        """Lưu trữ event gần đây"""
-        event_record = {
-            "timestamp": datetime.now(),
-            "event_name": event.event_name,
-            "user_id": event.user_id_by_app,
-            "app_id": event.app_id,
-            "data": event.model_dump()
-        }
-        self.recent_events.append(event_record)
+    def _store_recent_event(self, event: EventEnvelope):
+        """Lưu trữ event gần đây (mã hóa JSON một lần khi nhận)"""
+        self.recent_events.add(event)
     
     def _update_stats(self, event_name: str):
-        """Cập nhật statistics"""
-        if event_name not in self.event_stats:
-            self.event_stats[event_name] = {
-                "count": 0,
-                "last_received": None
-            }
-        
-        self.event_stats[event_name]["count"] += 1
-        self.event_stats[event_name]["last_received"] = datetime.now()
+        """Cập nhật statistics (hàng counter riêng của worker này)"""
+        self.stats_store.increment(event_name)
     
-    def get_recent_events(self, limit: int = 10) -> List[Dict[str, Any]]:
-        """Lấy danh sách events gần đây"""
-        events = list(self.recent_events)[-limit:]
-        
-        # Convert datetime to string để serialize JSON
-        for event in events:
-            event["timestamp"] = event["timestamp"].isoformat()
-            if event.get("data", {}).get("timestamp"):
-                # Convert unix timestamp to readable format
-                timestamp_value = event["data"]["timestamp"]
-                # Xử lý cả string và int timestamp
-                if isinstance(timestamp_value, str):
-                    timestamp_value = int(timestamp_value)
-                event["data"]["timestamp_readable"] = datetime.fromtimestamp(
-                    timestamp_value
-                ).isoformat()
+    def get_recent_events(
+        self,
+        limit: int = 10,
+        cursor: Optional[int] = None,
+        event_name: Optional[str] = None,
+        user_id: Optional[str] = None,
+    ) -> bytes:
+        """
+        Lấy events gần đây (của mọi worker) dưới dạng JSON bytes sẵn để trả về
         
-        return events
+        Returns:
+            bytes: {"events": [...], "next_cursor": seq hoặc null}
+        """
+        return self.recent_events.query_json(limit, cursor, event_name, user_id)
+    
+    def get_dispatcher_stats(self) -> Dict[str, Any]:
+        """Thống kê các lane xử lý event"""
+        return self.dispatcher.get_stats()
     
     def get_statistics(self) -> Dict[str, Any]:
-        """Lấy thống kê events"""
+        """Lấy thống kê events (tổng hợp trên mọi worker)"""
         stats = {}
-        for event_name, data in self.event_stats.items():
+        total = 0
+        for event_name, (count, last_received) in self.stats_store.counters().items():
+            total += count
             stats[event_name] = {
-                "count": data["count"],
-                "last_received": data["last_received"].isoformat() if data["last_received"] else None
+                "count": count,
+                "last_received": datetime.fromtimestamp(last_received).isoformat() if last_received else None
             }
         
         return {
-            "total_events": len(self.recent_events),
+            "total_events": total,
             "event_types": stats,
+            "workers": self.stats_store.live_workers(),
+            "started_at": datetime.fromtimestamp(self.stats_store.created_at).isoformat(),
             "uptime": datetime.now().isoformat()
         }
@@ -0,0 +1,242 @@
+import json
+import logging
+import os
+import time
+import unicodedata
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+def _strip_marks(text: str) -> str:
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+# Bảng bỏ dấu dựng sẵn cho các chữ Latin có dấu (gồm toàn bộ chữ tiếng Việt dựng sẵn),
+# để str.translate làm việc chính thay vì NFD từng ký tự; "đ" không tách được bằng NFD
+_FOLD_TABLE = {
+    code: _strip_marks(chr(code))
+    for code in list(range(0x00C0, 0x0250)) + list(range(0x1E00, 0x1F00))
+    if _strip_marks(chr(code)) != chr(code)
+}
+_FOLD_TABLE.update({ord("đ"): "d", ord("Đ"): "d"})
+
+
+def normalize_text(text: str) -> str:
+    """
+    Chuẩn hóa tin nhắn để so khớp: chữ thường, bỏ dấu tiếng Việt, gộp khoảng trắng
+
+    "Xin  CHÀO, Đức" -> "xin chao, duc". Người dùng hay gõ không dấu nên từ khóa và tin
+    nhắn đều được bỏ dấu trước khi so khớp.
+    """
+    folded = text.lower().translate(_FOLD_TABLE)
+    if not folded.isascii():
+        # Dấu tổ hợp rời (bàn phím gõ dạng NFD) hoặc ký tự ngoài bảng
+        folded = _strip_marks(folded)
+    return " ".join(folded.split())
+
+
+class _Automaton:
+    """
+    Automaton Aho-Corasick cho tập từ khóa đã chuẩn hóa
+
+    Thời gian so khớp tuyến tính theo độ dài tin nhắn (cộng số lần khớp), không phụ
+    thuộc số từ khóa.
+    """
+
+    def __init__(self, keywords: List[Tuple[str, int, bool]]):
+        # keywords: (từ khóa, index intent, chỉ khớp nguyên từ)
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[Tuple[int, int, bool]]] = [[]]
+
+        for keyword, intent, whole_word in keywords:
+            state = 0
+            for ch in keyword:
+                next_state = self.goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][ch] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].append((len(keyword), intent, whole_word))
+
+        # BFS dựng failure link; output của một state gồm cả output của failure state
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(ch, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def best_match(self, text: str) -> Optional[int]:
+        """Index intent nhỏ nhất (khai báo trước) có từ khóa xuất hiện trong `text`"""
+        goto, fail, output = self.goto, self.fail, self.output
+        best = None
+        state = 0
+        for position, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, intent, whole_word in output[state]:
+                if best is not None and intent >= best:
+                    continue
+                if whole_word:
+                    start = position - length + 1
+                    if start > 0 and text[start - 1].isalnum():
+                        continue
+                    if position + 1 < len(text) and text[position + 1].isalnum():
+                        continue
+                best = intent
+                if best == 0:
+                    return best
+        return best
+
+
+# Rules có sẵn (hành vi trước khi có file rules): file rules được gộp đè lên, nên thiếu
+# file hoặc file lỗi thì /start, /help, /info và các câu trả lời cơ bản vẫn hoạt động
+DEFAULT_RULES: Dict[str, Any] = {
+    "commands": {
+        "/start": {"handler": "start", "description": "Bắt đầu sử dụng dịch vụ"},
+        "/help": {"handler": "help", "description": "Hiển thị trợ giúp"},
+        "/info": {"handler": "info", "description": "Thông tin về hệ thống"},
+    },
+    "intents": [
+        {
+            "name": "greeting",
+            "keywords": ["hello", "xin chào"],
+            "substring": True,
+            "reply": "Xin chào! Tôi có thể giúp gì cho bạn? 😊",
+        },
+        {
+            "name": "thanks",
+            "keywords": ["cảm ơn", "thank"],
+            "substring": True,
+            "reply": "Không có gì! Rất vui được giúp đỡ bạn! 🤗",
+        },
+    ],
+    "fallback": "Bạn vừa gửi: '{text}'\n\nTôi đã nhận được tin nhắn của bạn. Cảm ơn bạn! 📝",
+}
+
+
+def merge_rules(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Gộp rules trong file lên DEFAULT_RULES
+
+    Command được gộp theo tên (file ghi đè hoặc thêm command); "intents" và "fallback"
+    trong file thay thế hẳn bản có sẵn nếu được khai báo.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("Intent rules must be a JSON object")
+    commands = spec.get("commands") or {}
+    if not isinstance(commands, dict):
+        raise ValueError("'commands' must be an object")
+    merged = {**DEFAULT_RULES, **spec}
+    merged["commands"] = {**DEFAULT_RULES["commands"], **commands}
+    return merged
+
+
+class IntentRules:
+    """Một phiên bản rules đã biên dịch (thay nguyên khối khi reload)"""
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.commands: Dict[str, Dict[str, Any]] = {}
+        for name, rule in (spec.get("commands") or {}).items():
+            if not name.startswith("/") or not isinstance(rule, dict):
+                raise ValueError(f"Invalid command rule: {name!r}")
+            if "handler" not in rule and "reply" not in rule:
+                raise ValueError(f"Command {name!r} needs 'handler' or 'reply'")
+            self.commands[name.lower()] = rule
+
+        self.intents: List[Dict[str, Any]] = []
+        keywords: List[Tuple[str, int, bool]] = []
+        for index, rule in enumerate(spec.get("intents") or []):
+            if not isinstance(rule, dict) or not rule.get("name") or "reply" not in rule:
+                raise ValueError(f"Intent #{index} needs 'name' and 'reply'")
+            whole_word = not rule.get("substring", False)
+            for keyword in rule.get("keywords") or []:
+                normalized = normalize_text(keyword)
+                if normalized:
+                    keywords.append((normalized, index, whole_word))
+            self.intents.append(rule)
+
+        self.fallback: Optional[str] = spec.get("fallback")
+        self.keyword_count = len(keywords)
+        self.automaton = _Automaton(keywords)
+
+
+class IntentMatcher:
+    """
+    So khớp tin nhắn với rules khai báo trong file JSON (commands, intents, fallback)
+
+    Tất cả từ khóa được biên dịch thành một automaton Aho-Corasick. Rules trong file
+    được gộp lên DEFAULT_RULES. File rules được kiểm tra thay đổi (mtime) tối đa mỗi
+    `reload_interval` giây khi có tin nhắn; rules mới bị lỗi thì giữ nguyên rules cũ
+    (lúc khởi động là DEFAULT_RULES) và log lỗi.
+    """
+
+    def __init__(self, path: str, reload_interval: float = 2.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.rules = IntentRules(DEFAULT_RULES)
+        self._mtime: Optional[int] = None
+        self._checked = 0.0
+        self.reloads = 0
+        self._load()
+
+    @classmethod
+    def from_settings(cls) -> "IntentMatcher":
+        """Tạo matcher theo cấu hình INTENT_RULES_*"""
+        return cls(settings.INTENT_RULES_FILE, settings.INTENT_RULES_RELOAD_SECONDS)
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            if self._mtime is None:
+                logger.error("Intent rules file %s not readable, using built-in rules: %s", self.path, e)
+                self._mtime = 0
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                rules = IntentRules(merge_rules(json.load(f)))
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.error("Invalid intent rules in %s, keeping previous rules: %s", self.path, e)
+            return
+        self.rules = rules
+        self.reloads += 1
+        logger.info(
+            "Loaded intent rules from %s: %d commands, %d intents, %d keywords",
+            self.path, len(rules.commands), len(rules.intents), rules.keyword_count,
+        )
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked >= self.reload_interval:
+            self._checked = now
+            self._load()
+
+    def command(self, name: str) -> Optional[Dict[str, Any]]:
+        """Rule của command (ví dụ "/help"), None nếu không có"""
+        self._maybe_reload()
+        return self.rules.commands.get(name.lower())
+
+    def match(self, text: str) -> Optional[Dict[str, Any]]:
+        """Intent khớp với tin nhắn (intent khai báo trước được ưu tiên), None nếu không có"""
+        self._maybe_reload()
+        rules = self.rules
+        index = rules.automaton.best_match(normalize_text(text))
+        return rules.intents[index] if index is not None else None
@@ -7,6 +7,11 @@ from models.zalo_events import (
     UserSendTextEvent, UserSendImageEvent, UserSendFileEvent,
     UserSendStickerEvent, UserSendLocationEvent
 )
+from handlers.intent_matcher import IntentMatcher
+from services.zalo_client import zalo_client
+from services.send_scheduler import send_scheduler, PRIORITY_INTERACTIVE
+from services.profile_cache import profile_cache
+from services.attachment_fetcher import attachment_fetcher
 
 logger = logging.getLogger(__name__)
 
@@ -17,10 +22,13 @@ class MessageHandler:
     
     def __init__(self):
         # Có thể khởi tạo AI service, database connection, etc.
+        # Commands và từ khóa khai báo trong file rules (INTENT_RULES_FILE, tự reload)
+        self.intents = IntentMatcher.from_settings()
+        # Handler có sẵn mà command trong rules có thể trỏ tới ("handler": "help")
         self.command_handlers = {
-            "/start": self._handle_start_command,
-            "/help": self._handle_help_command,
-            "/info": self._handle_info_command,
+            "start": self._handle_start_command,
+            "help": self._handle_help_command,
+            "info": self._handle_info_command,
         }
     
     async def handle_message_event(self, event) -> bool:
@@ -29,7 +37,7 @@ class MessageHandler:
         """
         try:
             event_type = type(event).__name__
-            logger.info(f"Processing message event: {event_type}")
+            logger.info("Processing message event: %s", event_type)
             
             if isinstance(event, UserSendTextEvent):
                 return await self._handle_text_message(event)
@@ -45,7 +53,7 @@ class MessageHandler:
             return True
             
         except Exception as e:
-            logger.error(f"Error handling message event: {str(e)}")
+            logger.error("Error handling message event: %s", e)
             return False
     
     async def _handle_text_message(self, event: UserSendTextEvent) -> bool:
@@ -54,7 +62,7 @@ class MessageHandler:
         user_id = event.user_id_by_app
         sender_name = event.sender.name
         
-        logger.info(f"Text message from {sender_name} ({user_id}): {message_text}")
+        logger.info("Text message from %s (%s): %s", sender_name, user_id, message_text)
         
         # Xử lý commands
         if message_text.startswith("/"):
@@ -67,11 +75,14 @@ class MessageHandler:
         """Xử lý các commands từ người dùng"""
         parts = command.split()
         cmd = parts[0].lower()
+        rule = self.intents.command(cmd)
         
-        if cmd in self.command_handlers:
-            return await self.command_handlers[cmd](event, parts[1:] if len(parts) > 1 else [])
+        if rule is not None and rule.get("handler") in self.command_handlers:
+            return await self.command_handlers[rule["handler"]](event, parts[1:])
+        elif rule is not None and "reply" in rule:
+            return await self._send_response(event.user_id_by_app, self._render(rule["reply"], command, event))
         else:
-            logger.info(f"Unknown command: {cmd}")
+            logger.info("Unknown command: %s", cmd)
             # Có thể gửi tin nhắn "Lệnh không được hỗ trợ" về cho user
             return await self._send_response(
                 event.user_id_by_app, 
@@ -80,18 +91,19 @@ class MessageHandler:
     
     async def _handle_start_command(self, event: UserSendTextEvent, args: list) -> bool:
         """Xử lý lệnh /start"""
-        user_name = event.sender.name or "Bạn"
+        user_name = self._sender_name(event) or "Bạn"
         response = f"Xin chào {user_name}! 👋\n\nChào mừng bạn đến với dịch vụ của chúng tôi.\nGửi /help để xem các lệnh có sẵn."
         
         return await self._send_response(event.user_id_by_app, response)
     
     async def _handle_help_command(self, event: UserSendTextEvent, args: list) -> bool:
         """Xử lý lệnh /help"""
-        help_text = """📋 Danh sách lệnh có sẵn:
+        commands = "\n".join(
+            f"{name} - {rule.get('description', '')}" for name, rule in self.intents.rules.commands.items()
+        )
+        help_text = f"""📋 Danh sách lệnh có sẵn:
 
-/start - Bắt đầu sử dụng dịch vụ
-/help - Hiển thị trợ giúp
-/info - Thông tin về hệ thống
+{commands}
 
 Bạn cũng có thể gửi tin nhắn thông thường và chúng tôi sẽ phản hồi."""
         
@@ -104,7 +116,7 @@ Bạn cũng có thể gửi tin nhắn thông thường và chúng tôi sẽ ph
 🆔 User ID: {event.user_id_by_app}
 📱 App ID: {event.app_id}
 ⏰ Thời gian: {event.timestamp}
-👤 Tên: {event.sender.name or 'Không có'}
+👤 Tên: {self._sender_name(event) or 'Không có'}
 
 Hệ thống đang hoạt động bình thường! ✅"""
         
@@ -120,25 +132,43 @@ Hệ thống đang hoạt động bình thường! ✅"""
         # 3. Tìm kiếm trong database
         # 4. Gọi external APIs
         
-        # Example: Echo response với một số xử lý đơn giản
-        if "hello" in text.lower() or "xin chào" in text.lower():
-            response = "Xin chào! Tôi có thể giúp gì cho bạn? 😊"
-        elif "cảm ơn" in text.lower() or "thank" in text.lower():
-            response = "Không có gì! Rất vui được giúp đỡ bạn! 🤗"
+        # Trả lời theo intent khớp từ khóa trong file rules, không khớp thì dùng fallback
+        intent = self.intents.match(text)
+        if intent is not None:
+            logger.info("Matched intent '%s' for %s", intent["name"], user_id)
+            template = intent["reply"]
         else:
-            response = f"Bạn vừa gửi: '{text}'\n\nTôi đã nhận được tin nhắn của bạn. Cảm ơn bạn! 📝"
+            template = self.intents.rules.fallback
+        if not template:
+            return True
         
-        return await self._send_response(user_id, response)
+        return await self._send_response(user_id, self._render(template, text, event))
+    
+    @staticmethod
+    def _sender_name(event: UserSendTextEvent) -> Optional[str]:
+        """
+        Tên người gửi: ưu tiên profile (cache), không có thì dùng tên trong payload
+
+        Không chờ API profile trong lane xử lý (chặn mọi user cùng lane); profile chưa có
+        trong cache được tải ở nền cho tin nhắn sau.
+        """
+        return profile_cache.peek_display_name(event.user_id_by_app, event.sender.id, fallback=event.sender.name)
+    
+    def _render(self, template: str, text: str, event: UserSendTextEvent) -> str:
+        """Điền {name} (tên người gửi) và {text} (tin nhắn) vào câu trả lời trong rules"""
+        if "{name}" in template:
+            template = template.replace("{name}", self._sender_name(event) or "bạn")
+        return template.replace("{text}", text)
     
     async def _handle_image_message(self, event: UserSendImageEvent) -> bool:
         """Xử lý tin nhắn hình ảnh"""
         user_id = event.user_id_by_app
         attachments = event.message.attachments
         
-        logger.info(f"Image message from {user_id}: {len(attachments) if attachments else 0} attachments")
+        logger.info("Image message from %s: %s attachments", user_id, len(attachments) if attachments else 0)
         
-        # Xử lý hình ảnh
-        # Có thể download, phân tích, OCR, etc.
+        # Tải ảnh về nền (không chờ); có thể phân tích, OCR, etc. sau khi tải xong
+        attachment_fetcher.submit(event)
         
         response = "Tôi đã nhận được hình ảnh của bạn! 📸\n\nChức năng xử lý hình ảnh đang được phát triển."
         return await self._send_response(user_id, response)
@@ -148,7 +178,8 @@ Hệ thống đang hoạt động bình thường! ✅"""
         user_id = event.user_id_by_app
         attachments = event.message.attachments
         
-        logger.info(f"File message from {user_id}: {len(attachments) if attachments else 0} files")
+        logger.info("File message from %s: %s files", user_id, len(attachments) if attachments else 0)
+        attachment_fetcher.submit(event)
         
         response = "Tôi đã nhận được file của bạn! 📎\n\nChức năng xử lý file đang được phát triển."
         return await self._send_response(user_id, response)
@@ -157,7 +188,7 @@ Hệ thống đang hoạt động bình thường! ✅"""
         """Xử lý tin nhắn sticker"""
         user_id = event.user_id_by_app
         
-        logger.info(f"Sticker message from {user_id}")
+        logger.info("Sticker message from %s", user_id)
         
         response = "Sticker đẹp quá! 😄"
         return await self._send_response(user_id, response)
@@ -166,7 +197,7 @@ Hệ thống đang hoạt động bình thường! ✅"""
         """Xử lý tin nhắn vị trí"""
         user_id = event.user_id_by_app
         
-        logger.info(f"Location message from {user_id}")
+        logger.info("Location message from %s", user_id)
         
         # Xử lý location data
         # Có thể lưu vào database, tìm kiếm nearby services, etc.
@@ -176,22 +207,20 @@ Hệ thống đang hoạt động bình thường! ✅"""
     
     async def _send_response(self, user_id: str, message: str) -> bool:
         """
-        Gửi phản hồi về cho người dùng qua Zalo API
+        Gửi phản hồi về cho người dùng qua Zalo Send API
         
-        Note: Đây là placeholder. Bạn cần implement thực tế với Zalo Send API
+        Tin được đưa vào hàng đợi ưu tiên cao nhất của send scheduler (không chờ gửi
+        xong). Chưa cấu hình ZALO_OA_ACCESS_TOKEN thì chỉ log, không gửi.
         """
         try:
-            logger.info(f"Sending response to {user_id}: {message}")
+            logger.info("Sending response to %s: %s", user_id, message)
             
-            # TODO: Implement actual Zalo Send API call
-            # Ví dụ:
-            # await zalo_api.send_message(user_id, message)
+            if not zalo_client.enabled:
+                logger.info("Response logged (not sent - ZALO_OA_ACCESS_TOKEN not configured)")
+                return True
             
-            # Hiện tại chỉ log để test
-            logger.info("Response logged (not sent - Zalo Send API not implemented yet)")
-            
-            return True
+            return send_scheduler.enqueue(user_id, message, PRIORITY_INTERACTIVE) is not None
             
         except Exception as e:
-            logger.error(f"Error sending response: {str(e)}")
+            logger.error("Error sending response: %s", e)
             return False
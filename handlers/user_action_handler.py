@@ -5,6 +5,11 @@ from datetime import datetime
 from models.zalo_events import (
     FollowOAEvent, UnfollowOAEvent, UserSubmitInfoEvent, UserClickButtonEvent
 )
+from services.zalo_client import zalo_client
+from pipeline.dedup import make_dedup_key
+from storage.database import UserSubmission, batch_writer, follower_store
+from services.send_scheduler import send_scheduler, PRIORITY_INTERACTIVE, PRIORITY_TRANSACTIONAL
+from services.profile_cache import profile_cache
 
 logger = logging.getLogger(__name__)
 
@@ -23,7 +28,7 @@ class UserActionHandler:
         """
         try:
             event_type = type(event).__name__
-            logger.info(f"Processing user action event: {event_type}")
+            logger.info("Processing user action event: %s", event_type)
             
             if isinstance(event, FollowOAEvent):
                 return await self._handle_follow_event(event)
@@ -37,7 +42,7 @@ class UserActionHandler:
             return True
             
         except Exception as e:
-            logger.error(f"Error handling user action event: {str(e)}")
+            logger.error("Error handling user action event: %s", e)
             return False
     
     async def _handle_follow_event(self, event: FollowOAEvent) -> bool:
@@ -45,32 +50,36 @@ class UserActionHandler:
         user_id = event.user_id_by_app
         follower = event.follower
         
-        logger.info(f"User {follower.name} ({user_id}) followed OA")
+        logger.info("User %s (%s) followed OA", follower.name, user_id)
         
         # Lưu thông tin người follow vào database
-        await self._save_follower_info(user_id, follower, "follow")
+        await self._save_follower_info(event, True)
+        
+        # Kết quả "không có profile" cache trước khi follow không còn đúng. Không chờ API
+        # profile trong lane: dùng tên trong payload, profile được tải ở nền
+        profile_cache.invalidate(user_id)
+        name = profile_cache.peek_display_name(user_id, follower.id, fallback=follower.name)
         
         # Gửi tin nhắn chào mừng
-        welcome_message = f"""🎉 Chào mừng {follower.name or 'bạn'} đến với Official Account của chúng tôi!
+        welcome_message = f"""🎉 Chào mừng {name or 'bạn'} đến với Official Account của chúng tôi!
 
 Cảm ơn bạn đã theo dõi. Chúng tôi sẽ cập nhật những thông tin mới nhất và hữu ích cho bạn.
 
 Gửi /help để xem các lệnh có sẵn."""
         
-        # TODO: Gửi welcome message qua Zalo Send API
-        logger.info(f"Welcome message for {user_id}: {welcome_message}")
-        
-        return True
+        logger.info("Welcome message for %s: %s", user_id, welcome_message)
+        return self._send_message(user_id, welcome_message, PRIORITY_TRANSACTIONAL)
     
     async def _handle_unfollow_event(self, event: UnfollowOAEvent) -> bool:
         """Xử lý sự kiện người dùng unfollow OA"""
         user_id = event.user_id_by_app
         follower = event.follower
         
-        logger.info(f"User {follower.name} ({user_id}) unfollowed OA")
+        logger.info("User %s (%s) unfollowed OA", follower.name, user_id)
         
         # Cập nhật status trong database
-        await self._save_follower_info(user_id, follower, "unfollow")
+        await self._save_follower_info(event, False)
+        profile_cache.invalidate(user_id)
         
         # Có thể trigger một số cleanup tasks
         # Ví dụ: xóa scheduled messages, dừng notifications, etc.
@@ -83,21 +92,19 @@ Gửi /help để xem các lệnh có sẵn."""
         info = event.info
         sender = event.sender
         
-        logger.info(f"User {sender.name} ({user_id}) submitted info: {info}")
+        logger.info("User %s (%s) submitted info: %s", sender.name, user_id, info)
         
         # Xử lý thông tin được submit
         # Có thể là form data, survey response, registration info, etc.
         
         # Lưu thông tin vào database
-        await self._save_user_submitted_info(user_id, info)
+        await self._save_user_submitted_info(event)
         
         # Xác nhận đã nhận được thông tin
         confirmation_message = "✅ Cảm ơn bạn đã gửi thông tin!\n\nChúng tôi đã nhận được và sẽ xử lý sớm nhất có thể."
         
-        # TODO: Gửi confirmation message
-        logger.info(f"Confirmation message for {user_id}: {confirmation_message}")
-        
-        return True
+        logger.info("Confirmation message for %s: %s", user_id, confirmation_message)
+        return self._send_message(user_id, confirmation_message, PRIORITY_TRANSACTIONAL)
     
     async def _handle_button_click_event(self, event: UserClickButtonEvent) -> bool:
         """Xử lý sự kiện người dùng click button"""
@@ -105,7 +112,7 @@ Gửi /help để xem các lệnh có sẵn."""
         message = event.message
         sender = event.sender
         
-        logger.info(f"User {sender.name} ({user_id}) clicked button")
+        logger.info("User %s (%s) clicked button", sender.name, user_id)
         
         # Phân tích button được click
         button_payload = self._extract_button_payload(message)
@@ -135,7 +142,7 @@ Gửi /help để xem các lệnh có sẵn."""
             return {}
             
         except Exception as e:
-            logger.error(f"Error extracting button payload: {str(e)}")
+            logger.error("Error extracting button payload: %s", e)
             return {}
     
     async def _handle_button_payload(self, user_id: str, payload: Dict[str, Any]) -> bool:
@@ -144,7 +151,7 @@ Gửi /help để xem các lệnh có sẵn."""
             action = payload.get('action')
             data = payload.get('data', {})
             
-            logger.info(f"Button action '{action}' for user {user_id} with data: {data}")
+            logger.info("Button action '%s' for user %s with data: %s", action, user_id, data)
             
             # Xử lý các actions khác nhau
             if action == "get_info":
@@ -154,12 +161,12 @@ Gửi /help để xem các lệnh có sẵn."""
             elif action == "contact_support":
                 return await self._handle_contact_support_action(user_id, data)
             else:
-                logger.warning(f"Unknown button action: {action}")
+                logger.warning("Unknown button action: %s", action)
             
             return True
             
         except Exception as e:
-            logger.error(f"Error handling button payload: {str(e)}")
+            logger.error("Error handling button payload: %s", e)
             return False
     
     async def _handle_get_info_action(self, user_id: str, data: Dict[str, Any]) -> bool:
@@ -189,16 +196,14 @@ Liên hệ để biết thêm chi tiết!"""
         else:
             response = "ℹ️ Thông tin tổng quan về dịch vụ của chúng tôi..."
         
-        # TODO: Gửi response message
-        logger.info(f"Info response for {user_id}: {response}")
-        
-        return True
+        logger.info("Info response for %s: %s", user_id, response)
+        return self._send_message(user_id, response, PRIORITY_INTERACTIVE)
     
     async def _handle_make_order_action(self, user_id: str, data: Dict[str, Any]) -> bool:
         """Xử lý action đặt hàng"""
         product_id = data.get('product_id')
         
-        logger.info(f"Order request for product {product_id} from user {user_id}")
+        logger.info("Order request for product %s from user %s", product_id, user_id)
         
         # Tạo order hoặc chuyển hướng đến form đặt hàng
         response = f"""📦 Đặt hàng sản phẩm #{product_id}
@@ -207,16 +212,15 @@ Chúng tôi sẽ liên hệ với bạn trong thời gian sớm nhất để xá
 
 Cần hỗ trợ thêm? Gửi /help"""
         
-        # TODO: Gửi response và có thể tạo order record
-        logger.info(f"Order response for {user_id}: {response}")
-        
-        return True
+        # TODO: Tạo order record
+        logger.info("Order response for %s: %s", user_id, response)
+        return self._send_message(user_id, response, PRIORITY_TRANSACTIONAL)
     
     async def _handle_contact_support_action(self, user_id: str, data: Dict[str, Any]) -> bool:
         """Xử lý action liên hệ hỗ trợ"""
         issue_type = data.get('issue_type', 'general')
         
-        logger.info(f"Support request type '{issue_type}' from user {user_id}")
+        logger.info("Support request type '%s' from user %s", issue_type, user_id)
         
         # Chuyển đến team support hoặc tạo ticket
         response = """🎧 Hỗ trợ khách hàng
@@ -226,44 +230,57 @@ Team hỗ trợ sẽ liên hệ với bạn trong vòng 24h.
 
 Mã ticket: #SUP{timestamp}""".format(timestamp=int(datetime.now().timestamp()))
         
-        # TODO: Tạo support ticket và gửi response
-        logger.info(f"Support response for {user_id}: {response}")
+        # TODO: Tạo support ticket
+        logger.info("Support response for %s: %s", user_id, response)
+        return self._send_message(user_id, response, PRIORITY_TRANSACTIONAL)
+    
+    def _send_message(self, user_id: str, message: str, priority: int) -> bool:
+        """
+        Đưa tin nhắn vào hàng đợi gửi (send scheduler) với độ ưu tiên `priority`
         
-        return True
+        Chưa cấu hình access token thì chỉ log. Trả về False nếu hàng đợi đã đầy.
+        """
+        if not zalo_client.enabled:
+            return True
+        return send_scheduler.enqueue(user_id, message, priority) is not None
     
-    async def _save_follower_info(self, user_id: str, follower: Any, action: str) -> bool:
-        """Lưu thông tin follower vào database"""
+    async def _save_follower_info(self, event, following: bool) -> bool:
+        """Lưu trạng thái follow (cache + ghi xuống bảng followers theo lô)"""
         try:
-            # TODO: Implement database save
-            # Ví dụ:
-            # await db.followers.upsert({
-            #     "user_id": user_id,
-            #     "name": follower.name,
-            #     "avatar": follower.avatar,
-            #     "action": action,
-            #     "timestamp": datetime.now()
-            # })
+            follower = event.follower
+            follower_store.record(
+                event.user_id_by_app,
+                following,
+                int(event.timestamp),
+                event.app_id,
+                oa_id=getattr(event, "oa_id", None),
+                follower_id=follower.id,
+                name=follower.name,
+                avatar=follower.avatar,
+            )
             
-            logger.info(f"Saved follower info: {user_id} - {action}")
+            logger.info("Saved follower info: %s - %s", event.user_id_by_app, "follow" if following else "unfollow")
             return True
             
         except Exception as e:
-            logger.error(f"Error saving follower info: {str(e)}")
+            logger.error("Error saving follower info: %s", e)
             return False
     
-    async def _save_user_submitted_info(self, user_id: str, info: Dict[str, Any]) -> bool:
-        """Lưu thông tin do người dùng submit"""
+    async def _save_user_submitted_info(self, event: UserSubmitInfoEvent) -> bool:
+        """Lưu thông tin do người dùng submit (bảng user_submissions, ghi theo lô)"""
         try:
-            # TODO: Implement database save
-            # await db.user_submissions.insert({
-            #     "user_id": user_id,
-            #     "info": info,
-            #     "timestamp": datetime.now()
-            # })
+            await batch_writer.add(UserSubmission.__table__, {
+                "app_id": event.app_id,
+                "user_id_by_app": event.user_id_by_app,
+                "sender_id": event.sender.id,
+                "timestamp": int(event.timestamp),
+                "info": event.info,
+                "event_key": make_dedup_key(event),
+            })
             
-            logger.info(f"Saved user submitted info: {user_id}")
+            logger.info("Saved user submitted info: %s", event.user_id_by_app)
             return True
             
         except Exception as e:
-            logger.error(f"Error saving user submitted info: {str(e)}")
+            logger.error("Error saving user submitted info: %s", e)
             return False
@@ -1,138 +1,351 @@
-from fastapi import Request, HTTPException
 from fastapi.responses import JSONResponse
 import time
+import math
 import hashlib
 import hmac
 import logging
-from collections import defaultdict, deque
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from typing import List, Optional, Tuple
 from config import settings
+from models.zalo_events import parse_event_envelope
 
 logger = logging.getLogger(__name__)
 
-class RateLimitMiddleware:
+class SignatureVerifier:
     """
-    Middleware để giới hạn số lượng requests per minute
+    Xác thực chữ ký HMAC-SHA256 của webhook trên raw bytes
+    
+    HMAC được khởi tạo với key một lần (tính sẵn inner/outer pad), mỗi request chỉ
+    `copy()` rồi hash body. Hỗ trợ nhiều secret cùng lúc khi xoay vòng key: chữ ký hợp
+    lệ nếu khớp với bất kỳ secret đang active nào.
     """
-    def __init__(self):
-        self.requests = defaultdict(deque)
-        self.window_size = timedelta(minutes=1)
     
-    def is_rate_limited(self, client_ip: str) -> bool:
-        """Kiểm tra xem client có bị rate limit không"""
-        now = datetime.now()
-        
-        # Xóa các requests cũ (ngoài window)
-        while (self.requests[client_ip] and 
-               now - self.requests[client_ip][0] > self.window_size):
-            self.requests[client_ip].popleft()
-        
-        # Kiểm tra số lượng requests trong window
-        if len(self.requests[client_ip]) >= settings.MAX_EVENTS_PER_MINUTE:
-            return True
-        
-        # Thêm request hiện tại
-        self.requests[client_ip].append(now)
+    def __init__(self, secrets: List[str]):
+        self._keyed = [
+            hmac.new(secret.encode('utf-8'), digestmod=hashlib.sha256)
+            for secret in secrets if secret
+        ]
+    
+    @classmethod
+    def from_settings(cls) -> "SignatureVerifier":
+        """Tạo verifier từ ZALO_SECRET_KEY và các secret cũ còn hiệu lực"""
+        secrets = [settings.ZALO_SECRET_KEY] if settings.ZALO_SECRET_KEY else []
+        if settings.ZALO_PREVIOUS_SECRET_KEYS:
+            secrets += [key.strip() for key in settings.ZALO_PREVIOUS_SECRET_KEYS.split(",") if key.strip()]
+        return cls(secrets)
+    
+    @property
+    def enabled(self) -> bool:
+        """Có ít nhất một secret được cấu hình"""
+        return bool(self._keyed)
+    
+    def sign(self, body: bytes) -> str:
+        """Tính chữ ký của body với secret hiện tại (secret đầu tiên)"""
+        mac = self._keyed[0].copy()
+        mac.update(body)
+        return mac.hexdigest()
+    
+    def verify(self, body: bytes, signature: Optional[str]) -> bool:
+        """Kiểm tra chữ ký với tất cả secret đang active"""
+        if not signature:
+            return False
+        given = signature.strip().lower().encode('utf-8')
+        for keyed in self._keyed:
+            mac = keyed.copy()
+            mac.update(body)
+            if hmac.compare_digest(mac.hexdigest().encode('ascii'), given):
+                return True
         return False
 
-class SecurityValidation:
+# Verifier dùng chung cho app và middleware
+signature_verifier = SignatureVerifier.from_settings()
+
+class RateLimiter:
     """
-    Class để validate các yêu cầu bảo mật
+    Rate limiter GCRA (token bucket dạng "theoretical arrival time")
+    
+    Mỗi key chỉ lưu một số float (TAT) nên bộ nhớ là O(1) cho mỗi key, không phụ thuộc
+    số request. Dùng đồng hồ monotonic. Key đã idle (TAT <= now, tức bucket đã đầy lại)
+    được loại bỏ dần theo thứ tự LRU; số key tối đa được giới hạn bởi `max_keys`.
     """
     
-    @staticmethod
-    def validate_zalo_signature(request_body: str, signature: str) -> bool:
+    def __init__(self, rate_per_minute: int = None, burst: int = None, max_keys: int = 100000):
+        rate_per_minute = rate_per_minute or settings.MAX_EVENTS_PER_MINUTE
+        self.emission_interval = 60.0 / max(1, rate_per_minute)
+        self.burst = max(1, burst or rate_per_minute)
+        # Khoảng "vay trước" cho phép: burst request liên tiếp
+        self.tolerance = self.emission_interval * (self.burst - 1)
+        self.max_keys = max_keys
+        self._tat: "OrderedDict[str, float]" = OrderedDict()
+        self.evicted = 0
+    
+    def check(self, key: str) -> Tuple[bool, float]:
         """
-        Validate signature từ Zalo
+        Kiểm tra và tính một request cho key
+        
+        Returns:
+            (allowed, retry_after): retry_after là số giây cần chờ nếu bị từ chối
         """
-        if not settings.ZALO_SECRET_KEY:
-            logger.warning("ZALO_SECRET_KEY not configured, skipping signature validation")
-            return True
+        now = time.monotonic()
+        tats = self._tat
+        tat = tats.get(key)
+        if tat is None or tat < now:
+            tat = now
+        allow_at = tat - self.tolerance
+        if allow_at > now:
+            return False, allow_at - now
         
-        if not signature:
-            logger.error("No signature provided")
-            return False
+        tats[key] = tat + self.emission_interval
+        tats.move_to_end(key)
         
-        # Tính toán expected signature
-        expected_signature = hmac.new(
-            settings.ZALO_SECRET_KEY.encode('utf-8'),
-            request_body.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest()
+        # Key ở đầu LRU là key lâu nhất không có request; nếu bucket của nó đã đầy lại
+        # thì trạng thái tương đương với chưa từng thấy, có thể bỏ. Mỗi lần chỉ dọn
+        # một key nên chi phí luôn O(1).
+        oldest = next(iter(tats))
+        if tats[oldest] <= now or len(tats) > self.max_keys:
+            del tats[oldest]
+            self.evicted += 1
+        return True, 0.0
+    
+    def is_rate_limited(self, key: str) -> bool:
+        """Kiểm tra xem key có bị rate limit không"""
+        return not self.check(key)[0]
+    
+    def __len__(self) -> int:
+        return len(self._tat)
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware áp dụng RateLimiter cho POST /webhook
+    
+    Key có thể là IP client ("ip"), `app_id` hoặc `user_id_by_app`. Với hai key sau,
+    body (đã được WebhookSecurityMiddleware đọc, nếu có) được dùng để lấy envelope;
+    body và envelope được gắn vào `scope["state"]` để endpoint dùng lại, không phải
+    đọc/parse lần nữa.
+    """
+    
+    def __init__(self, app, limiter: RateLimiter = None, key: str = None, paths=("/webhook",)):
+        self.app = app
+        if limiter is None:
+            limiter = RateLimiter(
+                settings.MAX_EVENTS_PER_MINUTE, settings.RATE_LIMIT_BURST, settings.RATE_LIMIT_MAX_KEYS
+            )
+        self.limiter = limiter
+        self.key = key or settings.RATE_LIMIT_KEY
+        self.paths = set(paths)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
         
-        # So sánh signatures
-        is_valid = hmac.compare_digest(signature, expected_signature)
+        if self.key == "ip":
+            key = client_ip_from_scope(scope)
+        else:
+            state = scope.setdefault("state", {})
+            if "body" not in state:
+                try:
+                    state["body"] = await read_body(receive)
+                except ClientDisconnected:
+                    # Không còn ai nhận response: không xử lý body bị cắt cụt
+                    logger.warning("Client disconnected before sending the full body")
+                    return
+                receive = replay_body(state["body"], receive)
+            body = state["body"]
+            envelope = _parse_envelope_quietly(body)
+            state["envelope"] = envelope
+            key = getattr(envelope, self.key, None) if envelope else None
+            if key is not None and settings.REQUIRE_SIGNATURE and signature_verifier.enabled:
+                # Không để request giả mạo tiêu hao quota của user/app thật
+                state["signature_valid"] = signature_verifier.verify(body, signature_from_scope(scope))
+                if not state["signature_valid"]:
+                    key = None
+            if key is None:
+                # Payload không đọc được hoặc sai chữ ký: để endpoint trả lỗi phù hợp
+                await self.app(scope, receive, send)
+                return
         
-        if not is_valid:
-            logger.error(f"Signature mismatch. Expected: {expected_signature}, Got: {signature}")
+        allowed, retry_after = self.limiter.check(key)
+        if not allowed:
+            logger.warning("Rate limit exceeded for %s: %s", self.key, key)
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "Rate limit exceeded"},
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+            await response(scope, receive, send)
+            return
         
-        return is_valid
+        await self.app(scope, receive, send)
+
+
+def signature_from_scope(scope) -> str:
+    """Lấy chữ ký webhook từ header X-Zalo-Signature hoặc X-ZSign"""
+    headers = dict(scope.get("headers", []))
+    value = headers.get(b"x-zalo-signature") or headers.get(b"x-zsign") or b""
+    return value.decode("latin-1")
+
+
+def client_ip_from_scope(scope) -> str:
+    """
+    Lấy IP client; khi RATE_LIMIT_TRUST_PROXY bật, dùng header do nginx gắn vào
+
+    Ưu tiên X-Real-IP (nginx ghi đè bằng $remote_addr), rồi tới phần tử cuối của
+    X-Forwarded-For (do proxy nối thêm); các phần tử đầu do client tự gửi nên không tin.
+    """
+    if settings.RATE_LIMIT_TRUST_PROXY:
+        headers = dict(scope.get("headers", []))
+        real_ip = headers.get(b"x-real-ip", b"").decode("latin-1").strip()
+        if real_ip:
+            return real_ip
+        forwarded = headers.get(b"x-forwarded-for", b"").decode("latin-1").split(",")[-1].strip()
+        if forwarded:
+            return forwarded
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+class ClientDisconnected(Exception):
+    """Client ngắt kết nối trước khi gửi hết body"""
+
+
+async def read_body(receive) -> bytes:
+    """
+    Đọc toàn bộ body từ ASGI receive
     
-    @staticmethod
-    def validate_request_headers(request: Request) -> bool:
-        """
-        Validate request headers
-        """
-        # Kiểm tra Content-Type
-        content_type = request.headers.get("content-type", "")
-        if "application/json" not in content_type:
-            logger.warning(f"Invalid content type: {content_type}")
-            return False
-        
-        # Kiểm tra User-Agent (Zalo thường có user-agent đặc biệt)
-        user_agent = request.headers.get("user-agent", "")
-        if not user_agent:
-            logger.warning("No user-agent header")
-            return False
-        
-        return True
+    Raises:
+        ClientDisconnected: nếu client ngắt kết nối giữa chừng (body bị cắt cụt)
+    """
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+def replay_body(body: bytes, original_receive):
+    """Tạo ASGI receive trả lại body đã đọc cho app phía sau"""
+    sent = False
     
-    @staticmethod
-    def validate_request_size(request_body: bytes) -> bool:
-        """
-        Validate kích thước request
-        """
-        max_size = 10 * 1024 * 1024  # 10MB
-        
-        if len(request_body) > max_size:
-            logger.error(f"Request too large: {len(request_body)} bytes")
-            return False
-        
-        return True
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Sau body chỉ còn chờ sự kiện disconnect thật từ server
+        return await original_receive()
+    
+    return receive
+
 
-class WebhookSecurity:
+def _parse_envelope_quietly(body: bytes):
+    try:
+        return parse_event_envelope(body)
+    except ValueError:
+        return None
+
+class BodyTooLarge(Exception):
+    """Body vượt quá giới hạn trong lúc đang nhận"""
+
+
+async def read_body_limited(receive, max_size: int) -> bytes:
+    """
+    Đọc body từ ASGI receive, dừng ngay khi vượt quá `max_size` byte
+    
+    Raises:
+        BodyTooLarge: nếu body lớn hơn giới hạn (phần còn lại không được đọc)
+        ClientDisconnected: nếu client ngắt kết nối giữa chừng (body bị cắt cụt)
     """
-    Main security class tích hợp tất cả các validation
+    chunks = []
+    received = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected()
+        chunk = message.get("body", b"")
+        received += len(chunk)
+        if received > max_size:
+            raise BodyTooLarge(received)
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+class WebhookSecurityMiddleware:
+    """
+    ASGI middleware kiểm tra request webhook trước khi body được buffer
+    
+    - Content-Type phải là application/json (415)
+    - Content-Length không hợp lệ (400) hoặc lớn hơn `max_size` (413): từ chối ngay,
+      không đọc body
+    - Body dạng chunked: đếm từng chunk trong lúc nhận và trả 413 ngay khi vượt giới hạn
+    
+    Body hợp lệ được gắn vào `scope["state"]["body"]` và phát lại cho app phía sau, nên
+    rate limiter và `handle_webhook` không phải đọc lại. Cần đặt ở lớp ngoài cùng.
     """
     
-    def __init__(self):
-        self.rate_limiter = RateLimitMiddleware()
+    def __init__(self, app, max_size: int = None, paths=("/webhook",)):
+        self.app = app
+        self.max_size = max_size if max_size is not None else settings.MAX_REQUEST_SIZE
+        self.paths = set(paths)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        
+        content_type = b""
+        content_length = None
+        for name, value in scope.get("headers", []):
+            if name == b"content-type":
+                content_type = value
+            elif name == b"content-length":
+                content_length = value
+        
+        if b"application/json" not in content_type.lower():
+            logger.warning("Invalid content type: %s", content_type.decode("latin-1"))
+            await self._reject(scope, receive, send, 415, "Content-Type must be application/json")
+            return
+        
+        if content_length is not None:
+            try:
+                declared = int(content_length)
+            except ValueError:
+                declared = -1
+            if declared < 0:
+                await self._reject(scope, receive, send, 400, "Invalid Content-Length")
+                return
+            if declared > self.max_size:
+                logger.error("Request too large: %d bytes (Content-Length)", declared)
+                await self._reject(scope, receive, send, 413, "Request too large")
+                return
         
-    async def validate_webhook_request(self, request: Request) -> bool:
-        """
-        Validate toàn bộ webhook request
-        """
         try:
-            # 1. Rate limiting
-            client_ip = request.client.host if request.client else "unknown"
-            if self.rate_limiter.is_rate_limited(client_ip):
-                logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-                raise HTTPException(status_code=429, detail="Rate limit exceeded")
-            
-            # 2. Validate headers
-            if not SecurityValidation.validate_request_headers(request):
-                raise HTTPException(status_code=400, detail="Invalid headers")
-            
-            # 3. Validate request size
-            body = await request.body()
-            if not SecurityValidation.validate_request_size(body):
-                raise HTTPException(status_code=413, detail="Request too large")
-            
-            # 4. Validate signature (sẽ được check trong main handler)
-            return True
-            
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.error(f"Security validation error: {str(e)}")
-            raise HTTPException(status_code=500, detail="Security validation failed")
+            body = await read_body_limited(receive, self.max_size)
+        except BodyTooLarge as e:
+            logger.error("Request too large: more than %d bytes received", e.args[0])
+            await self._reject(scope, receive, send, 413, "Request too large")
+            return
+        except ClientDisconnected:
+            # Không còn ai nhận response: không xử lý body bị cắt cụt
+            logger.warning("Client disconnected before sending the full body")
+            return
+        
+        scope.setdefault("state", {})["body"] = body
+        await self.app(scope, replay_body(body, receive), send)
+    
+    @staticmethod
+    async def _reject(scope, receive, send, status_code: int, detail: str):
+        response = JSONResponse(
+            status_code=status_code,
+            content={"detail": detail},
+            # Không đọc phần body còn lại; yêu cầu client đóng kết nối
+            headers={"Connection": "close"},
+        )
+        await response(scope, receive, send)
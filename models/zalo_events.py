@@ -1,7 +1,19 @@
-from pydantic import BaseModel, Field
-from typing import Dict, Any, Optional, List, Union
+from pydantic import (
+    BaseModel, Field, TypeAdapter, Tag, Discriminator, ValidationError, AliasPath, PrivateAttr
+)
+from typing import Dict, Any, Optional, List, Union, Annotated
 from datetime import datetime
 import json
+import logging
+
+try:
+    import orjson
+except ImportError:  # orjson là optional
+    orjson = None
+
+from config import settings
+
+logger = logging.getLogger(__name__)
 
 class ZaloUser(BaseModel):
     """Thông tin người dùng Zalo"""
@@ -81,6 +93,37 @@ class OAEvent(ZaloEvent):
     """Sự kiện liên quan đến OA"""
     oa: Dict[str, Any]
 
+# Mapping các event types (dựng một lần khi import)
+EVENT_CLASSES = {
+    "user_send_text": UserSendTextEvent,
+    "user_send_image": UserSendImageEvent,
+    "user_send_file": UserSendFileEvent,
+    "user_send_sticker": UserSendStickerEvent,
+    "user_send_location": UserSendLocationEvent,
+    "follow": FollowOAEvent,
+    "unfollow": UnfollowOAEvent,
+    "user_submit_info": UserSubmitInfoEvent,
+    "user_click_button": UserClickButtonEvent,
+}
+
+_GENERIC_EVENT_TAG = "__generic__"
+
+def _event_tag(value: Any) -> str:
+    """Chọn event class theo event_name; event chưa biết dùng ZaloEvent generic"""
+    event_name = value.get("event_name") if isinstance(value, dict) else getattr(value, "event_name", None)
+    return event_name if event_name in EVENT_CLASSES else _GENERIC_EVENT_TAG
+
+# Validator dùng discriminator để validate thẳng từ raw bytes trong một lần parse
+_EVENT_ADAPTER = TypeAdapter(
+    Annotated[
+        Union[
+            tuple(Annotated[event_class, Tag(name)] for name, event_class in EVENT_CLASSES.items())
+            + (Annotated[ZaloEvent, Tag(_GENERIC_EVENT_TAG)],)
+        ],
+        Discriminator(_event_tag),
+    ]
+)
+
 def parse_zalo_event(event_data: Dict[str, Any]) -> Optional[ZaloEvent]:
     """
     Parse raw event data từ Zalo thành ZaloEvent object tương ứng
@@ -90,21 +133,8 @@ def parse_zalo_event(event_data: Dict[str, Any]) -> Optional[ZaloEvent]:
         
         if not event_name:
             return None
-            
-        # Mapping các event types
-        event_classes = {
-            "user_send_text": UserSendTextEvent,
-            "user_send_image": UserSendImageEvent,
-            "user_send_file": UserSendFileEvent,
-            "user_send_sticker": UserSendStickerEvent,
-            "user_send_location": UserSendLocationEvent,
-            "follow": FollowOAEvent,
-            "unfollow": UnfollowOAEvent,
-            "user_submit_info": UserSubmitInfoEvent,
-            "user_click_button": UserClickButtonEvent,
-        }
         
-        event_class = event_classes.get(event_name)
+        event_class = EVENT_CLASSES.get(event_name)
         
         if event_class:
             return event_class(**event_data)
@@ -113,9 +143,94 @@ def parse_zalo_event(event_data: Dict[str, Any]) -> Optional[ZaloEvent]:
             return ZaloEvent(**event_data)
             
     except Exception as e:
-        print(f"Error parsing event: {e}")
+        logger.warning("Error parsing event: %s", e)
         return None
 
+class EventEnvelope(BaseModel):
+    """
+    Phần "vỏ" tối thiểu của event, được validate ngay khi nhận webhook.
+    
+    Model đầy đủ (message, sender, attachments, ...) chỉ được dựng khi cần, qua
+    `load_event()` bên trong worker, để request path không phải validate toàn bộ payload.
+    """
+    app_id: str
+    event_name: str
+    timestamp: str  # Zalo gửi timestamp dưới dạng string
+    user_id_by_app: str
+    msg_id: Optional[str] = Field(default=None, validation_alias=AliasPath("message", "msg_id"))
+    
+    _raw: bytes = PrivateAttr(default=b"")
+    _data: Optional[Dict[str, Any]] = PrivateAttr(default=None)
+    _event: Optional[ZaloEvent] = PrivateAttr(default=None)
+    _loaded: bool = PrivateAttr(default=False)
+    
+    @property
+    def raw(self) -> bytes:
+        """Raw bytes của payload"""
+        return self._raw
+    
+    @property
+    def is_typed(self) -> bool:
+        """Event có class riêng (không phải ZaloEvent generic)"""
+        return self.event_name in EVENT_CLASSES
+    
+    def payload(self) -> Dict[str, Any]:
+        """Payload đầy đủ dạng dict (dùng lại dict đã parse nếu còn giữ)"""
+        if self._data is not None:
+            return self._data
+        if orjson is not None:
+            return orjson.loads(self._raw)
+        return json.loads(self._raw)
+    
+    def load_event(self) -> Optional[ZaloEvent]:
+        """Dựng (một lần) model đầy đủ của event, None nếu payload không hợp lệ"""
+        if not self._loaded:
+            self._loaded = True
+            try:
+                if self._data is not None:
+                    self._event = _EVENT_ADAPTER.validate_python(self._data)
+                else:
+                    self._event = _EVENT_ADAPTER.validate_json(self._raw)
+            except ValidationError as e:
+                logger.warning("Error parsing event: %s", e)
+            # Dict trung gian không còn cần nữa
+            self._data = None
+        return self._event
+
+def parse_event_envelope(raw: bytes) -> Optional[EventEnvelope]:
+    """
+    Validate phần envelope của event từ raw bytes (dùng trên request path)
+    
+    Với JSON_BACKEND=orjson, dict đã parse được giữ lại để dựng model đầy đủ sau này
+    mà không phải parse JSON lần nữa.
+    
+    Returns:
+        EventEnvelope, hoặc None nếu payload thiếu các field bắt buộc
+        
+    Raises:
+        ValueError: nếu body không phải JSON hợp lệ
+    """
+    data = None
+    try:
+        if orjson is not None and settings.JSON_BACKEND == "orjson":
+            try:
+                data = orjson.loads(raw)
+            except orjson.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON: {e}") from None
+            envelope = EventEnvelope.model_validate(data)
+        else:
+            envelope = EventEnvelope.model_validate_json(raw)
+    except ValidationError as e:
+        errors = e.errors()
+        if errors and errors[0]["type"] == "json_invalid":
+            raise ValueError(errors[0]["msg"]) from None
+        logger.warning("Error parsing event envelope: %s", e)
+        return None
+    
+    envelope._raw = raw
+    envelope._data = data
+    return envelope
+
 class EventResponse(BaseModel):
     """Response model cho API endpoints"""
     status: str
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Set, Tuple
+
+from monitoring.shared_stats import SharedStatsStore
+
+logger = logging.getLogger(__name__)
+
+
+def sse_frame(event: str, data: bytes, event_id: Optional[int] = None) -> bytes:
+    """Đóng gói một message Server-Sent Events"""
+    # Xuống dòng trong JSON chỉ có thể là khoảng trắng giữa các token, bỏ đi được
+    data = data.replace(b"\r", b"").replace(b"\n", b"")
+    head = b"event: " + event.encode() + b"\n"
+    if event_id is not None:
+        head = b"id: %d\n" % event_id + head
+    return head + b"data: " + data + b"\n\n"
+
+
+def _stats_payload(counters: Dict[str, Tuple[int, float]], total: int) -> bytes:
+    return json.dumps(
+        {
+            "total_events": total,
+            "event_types": {
+                name: {
+                    "count": count,
+                    "last_received": datetime.fromtimestamp(last).isoformat() if last else None,
+                }
+                for name, (count, last) in counters.items()
+            },
+        },
+        ensure_ascii=False,
+    ).encode("utf-8")
+
+
+class Subscriber:
+    """
+    Một dashboard đang kết nối
+
+    Event được giữ trong hàng đợi có giới hạn: client chậm sẽ mất các event cũ nhất
+    (đếm trong `dropped` và báo lại cho client). Thống kê được gộp: chỉ giữ giá trị mới
+    nhất của mỗi loại event cho tới lần gửi kế tiếp.
+    """
+
+    def __init__(self, buffer_size: int):
+        self.events: Deque[bytes] = deque(maxlen=buffer_size)
+        self.stats: Dict[str, Tuple[int, float]] = {}
+        self.total_events: Optional[int] = None
+        self.dropped = 0
+        self.wakeup = asyncio.Event()
+
+    def push_events(self, frames):
+        overflow = len(self.events) + len(frames) - self.events.maxlen
+        if overflow > 0:
+            self.dropped += overflow
+        self.events.extend(frames)
+        self.wakeup.set()
+
+    def push_stats(self, delta: Dict[str, Tuple[int, float]], total: int):
+        self.stats.update(delta)
+        self.total_events = total
+        self.wakeup.set()
+
+    def drain(self) -> bytes:
+        """Lấy toàn bộ dữ liệu đang chờ gửi thành một chunk"""
+        self.wakeup.clear()
+        chunks = list(self.events)
+        self.events.clear()
+        if self.dropped:
+            chunks.append(sse_frame("lagged", b'{"dropped": %d}' % self.dropped))
+            self.dropped = 0
+        if self.total_events is not None:
+            chunks.append(sse_frame("stats", _stats_payload(self.stats, self.total_events)))
+            self.stats = {}
+            self.total_events = None
+        return b"".join(chunks)
+
+
+class BroadcastHub:
+    """
+    Phát event mới và thay đổi thống kê tới các dashboard qua SSE
+
+    Hub không gắn vào luồng nhận webhook: một task nền (chỉ chạy khi có client) định kỳ
+    đọc ring chung của SharedStatsStore, nên thấy event của mọi worker và việc mở thêm
+    dashboard không làm chậm request /webhook. Mỗi event được đóng gói SSE một lần rồi
+    dùng chung bytes cho mọi client.
+    """
+
+    def __init__(
+        self,
+        store: SharedStatsStore,
+        poll_interval_ms: float = 500,
+        client_buffer: int = 100,
+        heartbeat_seconds: float = 15,
+        max_clients: int = 100,
+        max_stream_seconds: float = 300,
+    ):
+        self.store = store
+        self.poll_interval = poll_interval_ms / 1000.0
+        self.client_buffer = max(1, client_buffer)
+        self.heartbeat = heartbeat_seconds
+        self.max_clients = max_clients
+        self.max_stream_seconds = max_stream_seconds
+
+        self._subscribers: Set[Subscriber] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._last_seq = 0
+        self._last_counters: Dict[str, Tuple[int, float]] = {}
+
+        # Statistics
+        self._chunks_sent = 0
+        self._events_dropped = 0
+
+    @property
+    def full(self) -> bool:
+        return len(self._subscribers) >= self.max_clients
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.client_buffer)
+        if not self._subscribers:
+            self._last_seq = self.store.head
+            self._last_counters = self.store.counters()
+        self._subscribers.add(subscriber)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll_loop())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+        self._events_dropped += subscriber.dropped
+
+    async def close(self):
+        """Dừng task nền (các stream đang mở sẽ kết thúc khi server đóng kết nối)"""
+        self._subscribers.clear()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _event_frames(self, after_seq: int, upto_seq: int):
+        """Các frame SSE của event có after_seq < seq <= upto_seq còn trong ring"""
+        frames = []
+        for seq in range(max(after_seq + 1, self.store.oldest), upto_seq + 1):
+            record = self.store.read(seq)
+            if record is not None:
+                frames.append(sse_frame("event", b'{"seq": %d, ' % seq + record[1][1:], seq))
+        return frames
+
+    async def _poll_loop(self):
+        while self._subscribers:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                head = self.store.head
+                if head > self._last_seq:
+                    frames = self._event_frames(self._last_seq, head)
+                    self._last_seq = head
+                    for subscriber in self._subscribers:
+                        subscriber.push_events(frames)
+
+                counters = self.store.counters()
+                delta = {
+                    name: value for name, value in counters.items()
+                    if self._last_counters.get(name) != value
+                }
+                if delta:
+                    self._last_counters = counters
+                    total = sum(count for count, _ in counters.values())
+                    for subscriber in self._subscribers:
+                        subscriber.push_stats(delta, total)
+            except Exception as e:
+                logger.error("Live stream poll failed: %s", e)
+
+    async def stream(self, last_event_id: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        Luồng SSE cho một client
+
+        Gửi ngay một snapshot thống kê; nếu client kết nối lại với Last-Event-ID thì gửi bù
+        các event còn trong ring. Stream tự đóng sau `max_stream_seconds` (EventSource tự
+        kết nối lại kèm Last-Event-ID) để kết nối SSE không giữ server lại khi shutdown.
+        """
+        subscriber = self.subscribe()
+        deadline = time.monotonic() + self.max_stream_seconds
+        try:
+            counters = self.store.counters()
+            yield b"retry: 3000\n\n" + sse_frame(
+                "stats", _stats_payload(counters, sum(count for count, _ in counters.values()))
+            )
+            if last_event_id is not None:
+                # Chỉ gửi bù tới seq mà hub đã phát, phần sau sẽ đến qua hàng đợi
+                missed = self._event_frames(last_event_id, self._last_seq)
+                if missed:
+                    yield b"".join(missed)
+
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(subscriber.wakeup.wait(), min(self.heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                chunk = subscriber.drain()
+                if chunk:
+                    self._chunks_sent += 1
+                    yield chunk
+        finally:
+            self.unsubscribe(subscriber)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê các kết nối SSE của worker này"""
+        return {
+            "clients": len(self._subscribers),
+            "chunks_sent": self._chunks_sent,
+            "events_dropped": self._events_dropped + sum(s.dropped for s in self._subscribers),
+        }
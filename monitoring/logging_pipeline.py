@@ -0,0 +1,154 @@
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import shutil
+from datetime import datetime, timezone
+from typing import Dict, List
+
+# Các thuộc tính chuẩn của LogRecord, không đưa vào phần "extra" của dòng JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonLineFormatter(logging.Formatter):
+    """Format mỗi log record thành một dòng JSON (kèm các field truyền qua `extra=`)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class GzipRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler theo kích thước, nén gzip các file đã xoay vòng"""
+
+    def __init__(self, filename: str, max_bytes: int, backup_count: int):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._gzip_rotator
+
+    @staticmethod
+    def _gzip_rotator(source: str, dest: str):
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler không bao giờ block event loop: khi hàng đợi đầy thì bỏ record
+    và đếm số record bị bỏ, thay vì chờ hoặc báo lỗi.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class PayloadSampler:
+    """
+    Lấy mẫu việc log toàn bộ payload theo từng loại event
+
+    Cấu hình dạng "default=0.01,user_send_text=0.1,follow=1": tỉ lệ trong [0, 1].
+    """
+
+    def __init__(self, spec: str = ""):
+        self.default_rate = 0.0
+        self.rates: Dict[str, float] = {}
+        for part in (spec or "").split(","):
+            if "=" not in part:
+                continue
+            name, _, value = part.partition("=")
+            try:
+                rate = min(1.0, max(0.0, float(value)))
+            except ValueError:
+                continue
+            if name.strip() == "default":
+                self.default_rate = rate
+            else:
+                self.rates[name.strip()] = rate
+
+    def should_log(self, event_name: str) -> bool:
+        """Có log payload của event này không"""
+        rate = self.rates.get(event_name, self.default_rate)
+        return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+
+class LoggingPipeline:
+    """
+    Pipeline logging bất đồng bộ: logger chỉ đưa record vào hàng đợi (không I/O trên
+    event loop), một thread nền (QueueListener) ghi ra file JSON lines có xoay vòng +
+    nén và ra console.
+    """
+
+    def __init__(
+        self,
+        log_file: str,
+        level: str = "INFO",
+        max_bytes: int = 50 * 1024 * 1024,
+        backup_count: int = 10,
+        queue_size: int = 10000,
+    ):
+        self.level = getattr(logging, level.upper(), logging.INFO)
+
+        file_handler = GzipRotatingFileHandler(log_file, max_bytes, backup_count)
+        file_handler.setFormatter(JsonLineFormatter())
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(
+            logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        )
+        self.handlers: List[logging.Handler] = [file_handler, console_handler]
+
+        self.queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        self.listener = logging.handlers.QueueListener(
+            self.queue_handler.queue, *self.handlers, respect_handler_level=True
+        )
+        self._started = False
+
+    def start(self):
+        """Gắn queue handler vào root logger và bắt đầu thread ghi log"""
+        if self._started:
+            return
+        root = logging.getLogger()
+        root.setLevel(self.level)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        self.listener.start()
+        self._started = True
+
+    def stop(self):
+        """Ghi nốt các record còn trong hàng đợi rồi dừng thread"""
+        if not self._started:
+            return
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
+        self._started = False
+
+    def get_stats(self) -> Dict[str, int]:
+        """Thống kê hàng đợi log"""
+        return {
+            "queued": self.queue_handler.queue.qsize(),
+            "dropped": self.queue_handler.dropped,
+        }
@@ -0,0 +1,303 @@
+import bisect
+import fcntl
+import logging
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"ZWMETR01"
+# magic, max_workers, max_slots, max_series, series_count, slots_used, created_at (của shared stats)
+_HEADER = struct.Struct("<8s5Id")
+_HEADER_SIZE = 64
+_SERIES_COUNT_OFFSET = 20
+# key (family + label values), slot đầu tiên, số slot
+_SERIES = struct.Struct("<120sII")
+_LABEL_SEP = "\x1f"
+
+# Bucket mặc định (giây): từ 0.5ms tới 10s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Child:
+    """Một series (bộ giá trị label cụ thể) của một metric; giữ sẵn vị trí slot"""
+
+    __slots__ = ("registry", "start", "bounds")
+
+    def __init__(self, registry: "MetricsRegistry", start: int, bounds: Tuple[float, ...] = ()):
+        self.registry = registry
+        self.start = start
+        self.bounds = bounds
+
+    def inc(self, amount: float = 1.0):
+        self.registry._values[self.start] += amount
+
+    def observe(self, value: float):
+        # Bucket không cộng dồn (mỗi lần observe chỉ tăng một bucket), cộng dồn khi xuất text
+        values = self.registry._values
+        start = self.start
+        values[start + bisect.bisect_left(self.bounds, value)] += 1.0
+        values[start + len(self.bounds) + 1] += value
+
+
+class _Metric:
+    """Một metric family (counter hoặc histogram) có label"""
+
+    def __init__(self, registry: "MetricsRegistry", kind: str, name: str, documentation: str,
+                 labelnames: Sequence[str] = (), buckets: Sequence[float] = ()):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.bounds = tuple(sorted(buckets))
+        # counter: 1 slot; histogram: các bucket + bucket +Inf + sum
+        self.width = len(self.bounds) + 2 if kind == "histogram" else 1
+        self._children: Dict[Tuple[str, ...], _Child] = {}
+
+    def labels(self, *values: str) -> _Child:
+        """Series ứng với bộ giá trị label (được cache, chỉ cấp slot ở lần đầu)"""
+        child = self._children.get(values)
+        if child is None:
+            key = _LABEL_SEP.join((self.name,) + values)
+            child = _Child(self.registry, self.registry._allocate(key, self.width), self.bounds)
+            self._children[values] = child
+        return child
+
+    def inc(self, *values: str, amount: float = 1.0):
+        self.labels(*values).inc(amount)
+
+    def observe(self, value: float, *values: str):
+        self.labels(*values).observe(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs: List[str]) -> str:
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class MetricsRegistry:
+    """
+    Registry metric kiểu Prometheus (counter + histogram bucket cố định)
+
+    Giá trị là mảng float64 cấp phát sẵn; observe chỉ là một lần bisect và vài phép
+    cộng tại chỗ trên memoryview, không tạo dict/object mới. Sau `attach`, mảng nằm
+    trong một file mmap cạnh file shared stats: mỗi worker ghi hàng riêng (theo
+    worker_index), bảng series dùng chung (cấp phát dưới flock), nên `/metrics` ở worker
+    nào cũng trả về tổng của mọi worker.
+    """
+
+    def __init__(self, max_slots: int = 16384, max_series: int = 2048):
+        self.max_slots = max_slots
+        self.max_series = max_series
+        self._metrics: List[_Metric] = []
+        # Giá trị label event_name hợp lệ (event_name đến từ payload, tránh series vô hạn)
+        self.known_event_names: Optional[set] = None
+
+        # Trước khi attach: mảng cục bộ trong process
+        self._values = memoryview(bytearray(max_slots * 8)).cast("d")
+        self._local_series: Dict[str, Tuple[int, int]] = {}
+        self._local_used = 0
+
+        self._fd: Optional[int] = None
+        self._mm: Optional[mmap.mmap] = None
+        self.worker_index = -1
+        self.max_workers = 0
+        self._series_offset = _HEADER_SIZE
+        self._values_offset = 0
+
+    # Đăng ký metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> _Metric:
+        metric = _Metric(self, "counter", name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> _Metric:
+        metric = _Metric(self, "histogram", name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def event_label(self, event_name: Optional[str]) -> str:
+        """Giá trị label event_name: tên event đã biết, còn lại gộp vào "other" """
+        if not event_name:
+            return "unknown"
+        if self.known_event_names is None or event_name in self.known_event_names:
+            return event_name
+        return "other"
+
+    # Bộ nhớ dùng chung
+
+    def attach(self, stats_store):
+        """
+        Chuyển sang file mmap dùng chung, hàng của worker = `stats_store.worker_index`
+
+        File được khởi tạo lại khi shared stats vừa được khởi tạo lại (deploy mới).
+        """
+        self.worker_index = stats_store.worker_index
+        self.max_workers = stats_store.max_workers
+        self._stats_store = stats_store
+        self._values_offset = self._series_offset + self.max_series * _SERIES.size
+        size = self._values_offset + self.max_workers * self.max_slots * 8
+
+        self._fd = os.open(stats_store.path + ".metrics", os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked():
+            header = os.pread(self._fd, _HEADER.size, 0)
+            expected = (_MAGIC, self.max_workers, self.max_slots, self.max_series)
+            if (
+                os.fstat(self._fd).st_size != size
+                or len(header) < _HEADER.size
+                or _HEADER.unpack(header)[:4] != expected
+                or _HEADER.unpack(header)[6] != stats_store.created_at
+            ):
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, _HEADER.pack(*expected, 0, 0, stats_store.created_at), 0)
+            self._mm = mmap.mmap(self._fd, size)
+
+        row = self._values_offset + self.worker_index * self.max_slots * 8
+        self._values = memoryview(self._mm)[row:row + self.max_slots * 8].cast("d")
+        # Slot cục bộ không còn hợp lệ, series sẽ được cấp lại trong file chung
+        for metric in self._metrics:
+            metric._children.clear()
+
+    @contextmanager
+    def _locked(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _allocate(self, key: str, width: int) -> int:
+        """Cấp `width` slot liên tiếp cho series `key` (dùng lại nếu worker khác đã cấp)"""
+        encoded = key.encode("utf-8")
+        if len(encoded) > _SERIES.size - 8:
+            raise ValueError(f"Metric series key too long: {key!r}")
+
+        if self._mm is None:
+            if key not in self._local_series:
+                if self._local_used + width > self.max_slots:
+                    raise RuntimeError("Metrics registry is full")
+                self._local_series[key] = (self._local_used, width)
+                self._local_used += width
+            return self._local_series[key][0]
+
+        with self._locked():
+            for stored, start, _ in self._series():
+                if stored == key:
+                    return start
+            _, _, _, _, count, used, _ = _HEADER.unpack_from(self._mm, 0)
+            if count >= self.max_series or used + width > self.max_slots:
+                raise RuntimeError("Metrics registry is full")
+            _SERIES.pack_into(self._mm, self._series_offset + count * _SERIES.size, encoded, used, width)
+            struct.pack_into("<II", self._mm, _SERIES_COUNT_OFFSET, count + 1, used + width)
+            return used
+
+    def _series(self) -> Iterable[Tuple[str, int, int]]:
+        if self._mm is None:
+            for key, (start, width) in self._local_series.items():
+                yield key, start, width
+            return
+        count = struct.unpack_from("<I", self._mm, _SERIES_COUNT_OFFSET)[0]
+        for index in range(count):
+            encoded, start, width = _SERIES.unpack_from(self._mm, self._series_offset + index * _SERIES.size)
+            yield encoded.rstrip(b"\0").decode("utf-8"), start, width
+
+    def _rows(self) -> List[memoryview]:
+        if self._mm is None:
+            return [self._values]
+        rows = []
+        for index in self._stats_store.used_worker_rows():
+            offset = self._values_offset + index * self.max_slots * 8
+            rows.append(memoryview(self._mm)[offset:offset + self.max_slots * 8].cast("d"))
+        return rows
+
+    # Xuất text
+
+    def render(self) -> str:
+        """Xuất toàn bộ metric (tổng mọi worker) theo Prometheus text format 0.0.4"""
+        rows = self._rows()
+        by_family: Dict[str, List[Tuple[Tuple[str, ...], List[float]]]] = {}
+        for key, start, width in self._series():
+            name, *values = key.split(_LABEL_SEP)
+            totals = [sum(row[start + i] for row in rows) for i in range(width)]
+            by_family.setdefault(name, []).append((tuple(values), totals))
+
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for values, totals in sorted(by_family.get(metric.name, [])):
+                labels = [f'{name}="{_escape(value)}"' for name, value in zip(metric.labelnames, values)]
+                if metric.kind == "counter":
+                    lines.append(f"{metric.name}{_labels(labels)} {_format_value(totals[0])}")
+                    continue
+                cumulative = 0.0
+                for bound, count in zip(metric.bounds + (float("inf"),), totals):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_labels = _labels(labels + ['le="%s"' % le])
+                    lines.append(f"{metric.name}_bucket{bucket_labels} {_format_value(cumulative)}")
+                lines.append(f"{metric.name}_sum{_labels(labels)} {repr(totals[-1])}")
+                lines.append(f"{metric.name}_count{_labels(labels)} {_format_value(cumulative)}")
+        return "\n".join(lines) + "\n"
+
+
+# Registry dùng chung của ứng dụng
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "zalo_webhook_stage_duration_seconds",
+    "Thời gian xử lý theo giai đoạn (ack, queue_wait, route, message_handler, "
+    "user_action_handler, generic_handler, batch_enqueue = chờ chỗ trong buffer của batch "
+    "writer, không gồm thời gian ghi DB)",
+    ("event_name", "stage"),
+)
+ERRORS = registry.counter(
+    "zalo_webhook_errors_total",
+    "Số lỗi theo giai đoạn (ack = webhook trả về mã khác 2xx)",
+    ("event_name", "stage"),
+)
+DB_COMMIT_SECONDS = registry.histogram(
+    "zalo_db_commit_seconds",
+    "Thời gian ghi một lô của một bảng xuống database (một transaction), theo bảng",
+    ("table",),
+)
+DB_ROWS = registry.counter(
+    "zalo_db_rows_total",
+    "Số row ghi theo lô, theo bảng và kết quả",
+    ("table", "result"),
+)
+OUTBOUND_SECONDS = registry.histogram(
+    "zalo_outbound_request_seconds",
+    "Thời gian một lần gọi Zalo API (mỗi lần thử lại tính riêng), theo endpoint và kết quả",
+    ("endpoint", "outcome"),
+)
+SEND_QUEUE_WAIT_SECONDS = registry.histogram(
+    "zalo_send_queue_wait_seconds",
+    "Thời gian tin nhắn chờ trong hàng đợi gửi (theo quota OA) trước khi được gửi, theo độ ưu tiên",
+    ("priority",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+PROFILE_CACHE_LOOKUPS = registry.counter(
+    "zalo_profile_cache_lookups_total",
+    "Số lần tra cache profile người dùng, theo kết quả (hit, stale, negative_hit, miss, coalesced)",
+    ("result",),
+)
+ATTACHMENT_DOWNLOADS = registry.counter(
+    "zalo_attachment_downloads_total",
+    "Số attachment tải về, theo kết quả (stored, duplicate = nội dung đã có, failed, too_large, rejected = URL không được phép)",
+    ("outcome",),
+)
@@ -0,0 +1,163 @@
+import json
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+
+from monitoring.shared_stats import SharedStatsStore
+
+# Vị trí tag trong slot của ring
+_TAG_EVENT_NAME = 0
+_TAG_USER_ID = 1
+
+
+def readable_timestamp(value) -> Optional[str]:
+    """
+    Chuyển timestamp của Zalo (giây hoặc mili giây, dạng str hoặc int) sang ISO 8601
+
+    Returns:
+        Optional[str]: None nếu không đọc được
+    """
+    try:
+        seconds = int(value)
+        # Zalo gửi timestamp theo mili giây
+        if seconds > 10 ** 11:
+            seconds /= 1000
+        return datetime.fromtimestamp(seconds).isoformat()
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+def encode_event(envelope) -> bytes:
+    """
+    Mã hóa event một lần thành JSON bytes để phục vụ trực tiếp qua /events
+
+    Raw payload được nhúng nguyên vào field "data" (không parse/serialize lại).
+    """
+    meta = json.dumps(
+        {
+            "timestamp": datetime.now().isoformat(),
+            "event_name": envelope.event_name,
+            "user_id": envelope.user_id_by_app,
+            "app_id": envelope.app_id,
+            "timestamp_readable": readable_timestamp(envelope.timestamp),
+        },
+        ensure_ascii=False,
+    ).encode("utf-8")
+    return meta[:-1] + b', "data": ' + envelope.raw + b"}"
+
+
+def _truncated(record: bytes) -> bytes:
+    """Bản thay thế khi event lớn hơn một slot: giữ metadata, bỏ payload"""
+    meta, _, _ = record.partition(b', "data": ')
+    return meta + b', "data": null, "truncated": true}'
+
+
+class RecentEventsRing:
+    """
+    Events gần đây trên ring chung của SharedStatsStore (thấy được event của mọi worker)
+
+    Mỗi event được lưu một lần dưới dạng JSON bytes đã mã hóa sẵn, kèm tag event_name và
+    user_id trong header slot. Mỗi process giữ một index nhỏ (tag -> các seq còn trong
+    ring), cập nhật dần bằng cách chỉ đọc tag của các slot mới, nên lọc theo event_name /
+    user_id không phải decode payload. Phân trang theo cursor = seq: trang tiếp theo gồm
+    các event có seq nhỏ hơn cursor.
+    """
+
+    def __init__(self, store: SharedStatsStore):
+        self.store = store
+        # (vị trí tag, giá trị) -> các seq tăng dần
+        self._index: Dict[Tuple[int, str], Deque[int]] = {}
+        # seq -> tags, theo thứ tự seq tăng dần (để dọn index khi slot bị ghi đè)
+        self._tags: Dict[int, Tuple[str, ...]] = {}
+        self._indexed_seq = 0
+
+    def add(self, envelope) -> int:
+        """Lưu event vào ring; trả về seq của event"""
+        record = encode_event(envelope)
+        if len(record) > self.store.max_record_size:
+            record = _truncated(record)
+        return self.store.append(record, (envelope.event_name, envelope.user_id_by_app))
+
+    def _refresh_index(self):
+        """Đưa các slot mới (của mọi worker) vào index và bỏ các seq đã bị ghi đè"""
+        head = self.store.head
+        oldest = self.store.oldest
+
+        while self._tags:
+            seq = next(iter(self._tags))
+            if seq >= oldest:
+                break
+            for position, tag in enumerate(self._tags.pop(seq)):
+                key = (position, tag)
+                seqs = self._index[key]
+                seqs.popleft()
+                if not seqs:
+                    del self._index[key]
+
+        for seq in range(max(self._indexed_seq + 1, oldest), head + 1):
+            tags = self.store.read_tags(seq)
+            if tags is None:
+                continue
+            self._tags[seq] = tags
+            for position, tag in enumerate(tags):
+                self._index.setdefault((position, tag), deque()).append(seq)
+        self._indexed_seq = max(self._indexed_seq, head)
+
+    def _candidates(self, upper: int, event_name: Optional[str], user_id: Optional[str]):
+        """Các seq <= upper khớp bộ lọc, từ mới tới cũ"""
+        filters = []
+        if event_name is not None:
+            filters.append((_TAG_EVENT_NAME, event_name.encode("utf-8")[:64].decode("utf-8", "ignore")))
+        if user_id is not None:
+            filters.append((_TAG_USER_ID, user_id.encode("utf-8")[:64].decode("utf-8", "ignore")))
+        if not filters:
+            return range(upper, self.store.oldest - 1, -1)
+
+        # Duyệt danh sách ngắn nhất, kiểm tra các bộ lọc còn lại qua tag đã index
+        lists = [self._index.get(key, ()) for key in filters]
+        shortest = min(range(len(lists)), key=lambda i: len(lists[i]))
+        others = [key for i, key in enumerate(filters) if i != shortest]
+        return (
+            seq for seq in reversed(lists[shortest])
+            if seq <= upper and all(self._tags[seq][position] == tag for position, tag in others)
+        )
+
+    def query(
+        self,
+        limit: int = 10,
+        cursor: Optional[int] = None,
+        event_name: Optional[str] = None,
+        user_id: Optional[str] = None,
+    ) -> Tuple[List[bytes], Optional[int]]:
+        """
+        Lấy tối đa `limit` event mới nhất có seq < cursor và khớp bộ lọc
+
+        Returns:
+            (records, next_cursor): records theo thứ tự cũ -> mới, mỗi record là JSON bytes
+            đã có field "seq"; next_cursor là None nếu không còn trang tiếp theo
+        """
+        self._refresh_index()
+        upper = self.store.head if cursor is None else min(cursor - 1, self.store.head)
+
+        records: List[bytes] = []
+        last_seq = None
+        has_more = False
+        for seq in self._candidates(upper, event_name, user_id):
+            record = self.store.read(seq)
+            if record is None:
+                continue
+            if len(records) == limit:
+                has_more = True
+                break
+            records.append(b'{"seq": %d, ' % seq + record[1][1:])
+            last_seq = seq
+        records.reverse()
+        return records, (last_seq if has_more else None)
+
+    def query_json(self, *args, **kwargs) -> bytes:
+        """Như `query` nhưng trả về body JSON hoàn chỉnh: {"events": [...], "next_cursor": ...}"""
+        records, next_cursor = self.query(*args, **kwargs)
+        return (
+            b'{"events": [' + b", ".join(records) + b'], "next_cursor": '
+            + (b"null" if next_cursor is None else str(next_cursor).encode()) + b"}"
+        )
@@ -0,0 +1,328 @@
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"ZWSTAT02"
+# magic, max_workers, max_counters, ring_slots, slot_size, created_at, ring_head, name_count
+_HEADER = struct.Struct("<8s4IdQI")
+_HEADER_SIZE = 64
+_RING_HEAD_OFFSET = 32
+_NAME_COUNT_OFFSET = 40
+_NAME_SIZE = 64
+_PID = struct.Struct("<q")
+# count, last_updated (epoch giây)
+_COUNTER = struct.Struct("<Qd")
+# seq (0 = trống / đang ghi), created_at, length
+_SLOT_HEADER = struct.Struct("<QdI")
+# Mỗi slot có thêm 2 tag (ví dụ event_name, user_id) để lọc mà không phải đọc data
+_SLOT_TAGS = 2
+_TAG_SIZE = 64
+_SLOT_TAGS_OFFSET = 24
+_SLOT_HEADER_SIZE = _SLOT_TAGS_OFFSET + _SLOT_TAGS * _TAG_SIZE
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedStatsStore:
+    """
+    Bộ đếm + ring buffer dùng chung giữa các worker process (mmap trên một file,
+    mặc định trong /dev/shm)
+
+    Bố cục file:
+    - bảng tên counter (ví dụ tên event), cấp phát dưới flock
+    - mỗi worker một hàng counter riêng: chỉ worker đó ghi nên không cần lock;
+      đọc thống kê = cộng các hàng lại
+    - ring buffer chung gồm `ring_slots` slot kích thước cố định, mỗi slot kèm tối đa
+      2 tag ngắn; ghi dưới flock (chỉ vài µs memcpy), đọc không lock theo kiểu seqlock
+      (slot đang ghi có seq = 0)
+
+    Mỗi process nhận một `worker_index` cố định khi mở store. Hàng của worker đã chết
+    được worker mới dùng lại (giữ nguyên giá trị counter), nên index này cũng dùng được
+    để tách journal/log theo worker. Khi không còn worker nào sống (deploy mới), store
+    được khởi tạo lại từ đầu.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_workers: int = 64,
+        max_counters: int = 256,
+        ring_slots: int = 256,
+        slot_size: int = 8192,
+    ):
+        self.path = path
+        self.max_workers = max(1, max_workers)
+        self.max_counters = max(1, max_counters)
+        self.ring_slots = max(1, ring_slots)
+        self.slot_size = max(_SLOT_HEADER_SIZE + 64, slot_size)
+
+        self._names_offset = _HEADER_SIZE
+        self._workers_offset = self._names_offset + self.max_counters * _NAME_SIZE
+        self._row_size = _PID.size + self.max_counters * _COUNTER.size
+        self._ring_offset = self._workers_offset + self.max_workers * self._row_size
+        self.size = self._ring_offset + self.ring_slots * self.slot_size
+
+        self._fd: Optional[int] = None
+        self._mm: Optional[mmap.mmap] = None
+        # Tên counter theo index (bản sao cục bộ của bảng tên trong file)
+        self._names: List[str] = []
+        self._name_index: Dict[str, int] = {}
+        self.worker_index = -1
+        self.created_at = 0.0
+
+    @classmethod
+    def from_settings(cls) -> "SharedStatsStore":
+        """Tạo store theo cấu hình SHARED_STATS_*"""
+        from config import settings
+        return cls(
+            settings.SHARED_STATS_PATH,
+            ring_slots=settings.SHARED_STATS_RING_SLOTS,
+            slot_size=settings.SHARED_STATS_SLOT_SIZE,
+        )
+
+    def open(self) -> "SharedStatsStore":
+        """Mở (hoặc tạo) file store và nhận một hàng worker"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked():
+            if not self._layout_matches():
+                self._initialize()
+            self._mm = mmap.mmap(self._fd, self.size)
+            if not any(_pid_alive(pid) for pid in self._worker_pids()):
+                # Không còn worker nào của lần chạy trước: bắt đầu thống kê mới
+                self._mm[:] = bytes(self.size)
+                self._write_header()
+            self.created_at = _HEADER.unpack_from(self._mm, 0)[5]
+            self.worker_index = self._claim_worker_row()
+        return self
+
+    def close(self):
+        """Đóng store (hàng worker được giữ lại cho worker thay thế)"""
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @contextmanager
+    def _locked(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _layout_matches(self) -> bool:
+        if os.fstat(self._fd).st_size != self.size:
+            return False
+        header = os.pread(self._fd, _HEADER.size, 0)
+        magic, workers, counters, slots, slot_size = _HEADER.unpack(header)[:5]
+        return (magic, workers, counters, slots, slot_size) == (
+            _MAGIC, self.max_workers, self.max_counters, self.ring_slots, self.slot_size
+        )
+
+    def _initialize(self):
+        os.ftruncate(self._fd, 0)
+        os.ftruncate(self._fd, self.size)
+        os.pwrite(self._fd, self._header_bytes(), 0)
+
+    def _header_bytes(self) -> bytes:
+        return _HEADER.pack(
+            _MAGIC, self.max_workers, self.max_counters, self.ring_slots, self.slot_size,
+            time.time(), 0, 0,
+        )
+
+    def _write_header(self):
+        self._mm[0:_HEADER.size] = self._header_bytes()
+
+    def _worker_pids(self) -> List[int]:
+        return [
+            _PID.unpack_from(self._mm, self._workers_offset + i * self._row_size)[0]
+            for i in range(self.max_workers)
+        ]
+
+    def _claim_worker_row(self) -> int:
+        pid = os.getpid()
+        pids = self._worker_pids()
+        # Ưu tiên hàng trống hoặc của worker đã chết có index nhỏ nhất
+        for index, owner in enumerate(pids):
+            if owner == pid or not _pid_alive(owner):
+                _PID.pack_into(self._mm, self._workers_offset + index * self._row_size, pid)
+                return index
+        raise RuntimeError(f"Shared stats store is full ({self.max_workers} workers)")
+
+    # Counters
+
+    def _counter_index(self, name: str) -> Optional[int]:
+        index = self._name_index.get(name)
+        if index is not None:
+            return index
+        encoded = name.encode("utf-8")[:_NAME_SIZE]
+        stored_name = encoded.decode("utf-8", "ignore")
+        with self._locked():
+            self._load_names()
+            index = self._name_index.get(stored_name)
+            if index is None:
+                count = struct.unpack_from("<I", self._mm, _NAME_COUNT_OFFSET)[0]
+                if count >= self.max_counters:
+                    logger.warning("Shared stats counter table full, dropping counter %s", name)
+                    return None
+                offset = self._names_offset + count * _NAME_SIZE
+                self._mm[offset:offset + _NAME_SIZE] = encoded.ljust(_NAME_SIZE, b"\0")
+                struct.pack_into("<I", self._mm, _NAME_COUNT_OFFSET, count + 1)
+                self._load_names()
+                index = count
+        # Tên dài hơn _NAME_SIZE được lưu bị cắt; nhớ cả tên gốc để lần sau không phải tra lại
+        self._name_index[name] = index
+        return index
+
+    def _load_names(self):
+        count = struct.unpack_from("<I", self._mm, _NAME_COUNT_OFFSET)[0]
+        for index in range(len(self._names), count):
+            offset = self._names_offset + index * _NAME_SIZE
+            name = bytes(self._mm[offset:offset + _NAME_SIZE]).rstrip(b"\0").decode("utf-8", "ignore")
+            self._names.append(name)
+            self._name_index.setdefault(name, index)
+
+    def increment(self, name: str, amount: int = 1):
+        """Tăng counter `name` trong hàng của worker hiện tại (không lock)"""
+        index = self._counter_index(name)
+        if index is None:
+            return
+        offset = self._workers_offset + self.worker_index * self._row_size + _PID.size + index * _COUNTER.size
+        count, _ = _COUNTER.unpack_from(self._mm, offset)
+        _COUNTER.pack_into(self._mm, offset, count + amount, time.time())
+
+    def counters(self) -> Dict[str, Tuple[int, float]]:
+        """Tổng hợp counter của mọi worker: {name: (count, last_updated)}"""
+        self._load_names()
+        row_offsets = [
+            self._workers_offset + worker * self._row_size + _PID.size for worker in range(self.max_workers)
+        ]
+        totals: Dict[str, Tuple[int, float]] = {}
+        for index, name in enumerate(self._names):
+            count, last = 0, 0.0
+            for row_offset in row_offsets:
+                worker_count, worker_last = _COUNTER.unpack_from(self._mm, row_offset + index * _COUNTER.size)
+                count += worker_count
+                last = max(last, worker_last)
+            if count:
+                totals[name] = (count, last)
+        return totals
+
+    def used_worker_rows(self) -> List[int]:
+        """Index các hàng worker đã từng được dùng (kể cả worker đã chết)"""
+        return [index for index, pid in enumerate(self._worker_pids()) if pid]
+
+    def live_workers(self) -> int:
+        """Số worker đang sống"""
+        return sum(1 for pid in self._worker_pids() if _pid_alive(pid))
+
+    # Ring buffer
+
+    @property
+    def max_record_size(self) -> int:
+        return self.slot_size - _SLOT_HEADER_SIZE
+
+    def append(self, data: bytes, tags: Tuple[str, ...] = ()) -> int:
+        """
+        Ghi một record vào ring chung
+
+        Args:
+            data: nội dung record
+            tags: tối đa 2 chuỗi ngắn (cắt ở 64 byte) dùng để lọc qua `read_tags`
+
+        Returns:
+            int: seq của record (tăng dần trên toàn bộ worker), 0 nếu record quá lớn
+        """
+        if len(data) > self.max_record_size:
+            return 0
+        encoded_tags = b"".join(
+            tag.encode("utf-8")[:_TAG_SIZE].ljust(_TAG_SIZE, b"\0") for tag in tags[:_SLOT_TAGS]
+        ).ljust(_SLOT_TAGS * _TAG_SIZE, b"\0")
+        with self._locked():
+            seq = struct.unpack_from("<Q", self._mm, _RING_HEAD_OFFSET)[0] + 1
+            offset = self._ring_offset + (seq - 1) % self.ring_slots * self.slot_size
+            # seq = 0 trong lúc ghi để reader bỏ qua slot chưa hoàn chỉnh
+            _SLOT_HEADER.pack_into(self._mm, offset, 0, time.time(), len(data))
+            self._mm[offset + _SLOT_TAGS_OFFSET:offset + _SLOT_HEADER_SIZE] = encoded_tags
+            start = offset + _SLOT_HEADER_SIZE
+            self._mm[start:start + len(data)] = data
+            struct.pack_into("<Q", self._mm, offset, seq)
+            struct.pack_into("<Q", self._mm, _RING_HEAD_OFFSET, seq)
+        return seq
+
+    @property
+    def head(self) -> int:
+        """Seq của record mới nhất"""
+        return struct.unpack_from("<Q", self._mm, _RING_HEAD_OFFSET)[0]
+
+    @property
+    def oldest(self) -> int:
+        """Seq nhỏ nhất còn có thể nằm trong ring"""
+        return max(1, self.head - self.ring_slots + 1)
+
+    def _slot_offset(self, seq: int) -> int:
+        return self._ring_offset + (seq - 1) % self.ring_slots * self.slot_size
+
+    def read(self, seq: int) -> Optional[Tuple[float, bytes]]:
+        """Đọc record theo seq; None nếu đã bị ghi đè hoặc đang được ghi"""
+        if seq <= 0:
+            return None
+        offset = self._slot_offset(seq)
+        slot_seq, created_at, length = _SLOT_HEADER.unpack_from(self._mm, offset)
+        if slot_seq != seq:
+            return None
+        start = offset + _SLOT_HEADER_SIZE
+        data = bytes(self._mm[start:start + length])
+        # Kiểm tra lại: nếu slot bị ghi trong lúc copy thì bỏ
+        if struct.unpack_from("<Q", self._mm, offset)[0] != seq:
+            return None
+        return created_at, data
+
+    def read_tags(self, seq: int) -> Optional[Tuple[str, ...]]:
+        """Đọc tag của record theo seq (không đọc data); None nếu slot không còn là seq này"""
+        if seq <= 0:
+            return None
+        offset = self._slot_offset(seq)
+        if struct.unpack_from("<Q", self._mm, offset)[0] != seq:
+            return None
+        raw = bytes(self._mm[offset + _SLOT_TAGS_OFFSET:offset + _SLOT_HEADER_SIZE])
+        if struct.unpack_from("<Q", self._mm, offset)[0] != seq:
+            return None
+        return tuple(
+            raw[i:i + _TAG_SIZE].rstrip(b"\0").decode("utf-8", "ignore")
+            for i in range(0, len(raw), _TAG_SIZE)
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thông tin store"""
+        return {
+            "path": self.path,
+            "worker_index": self.worker_index,
+            "pid": os.getpid(),
+            "live_workers": self.live_workers(),
+            "ring_head": self.head,
+            "ring_slots": self.ring_slots,
+            "started_at": self.created_at,
+        }
@@ -0,0 +1,66 @@
+import contextvars
+from typing import Callable, Optional
+
+
+class EventCompletion:
+    """
+    Đếm các phần việc còn dở của một event: handler đang chạy + các row đã đưa vào batch
+    writer nhưng chưa commit
+
+    `on_done` (ví dụ `journal.mark_done(seq)`) chỉ được gọi khi mọi phần việc đã xong,
+    nên watermark của journal không vượt qua event có row chưa thực sự nằm trong database.
+    Khởi tạo với một phần việc (chính handler), handler xong thì gọi `release()`.
+    """
+
+    __slots__ = ("_pending", "_on_done")
+
+    def __init__(self, on_done: Optional[Callable[[], None]]):
+        self._pending = 1
+        self._on_done = on_done
+
+    @property
+    def done(self) -> bool:
+        return self._pending <= 0
+
+    def hold(self) -> Optional[Callable[[], None]]:
+        """
+        Giữ event chưa hoàn tất cho tới khi callback trả về được gọi (gọi nhiều lần không
+        sao); None nếu event đã hoàn tất
+        """
+        if self.done:
+            return None
+        self._pending += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.release()
+
+        return release
+
+    def release(self):
+        self._pending -= 1
+        if self._pending == 0 and self._on_done is not None:
+            self._on_done()
+
+
+# Event đang được xử lý trong task hiện tại (đặt bởi EventHandler)
+_current: contextvars.ContextVar[Optional[EventCompletion]] = contextvars.ContextVar(
+    "event_completion", default=None
+)
+
+
+def set_current(completion: Optional[EventCompletion]) -> contextvars.Token:
+    return _current.set(completion)
+
+
+def reset_current(token: contextvars.Token):
+    _current.reset(token)
+
+
+def hold_current() -> Optional[Callable[[], None]]:
+    """Giữ event đang xử lý (nếu có) cho tới khi callback trả về được gọi"""
+    completion = _current.get()
+    return completion.hold() if completion is not None else None
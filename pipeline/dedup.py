@@ -0,0 +1,349 @@
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+logger = logging.getLogger(__name__)
+
+# Chu kỳ (giây) kiểm tra lại số worker đang sống
+_WORKER_CHECK_SECONDS = 1.0
+
+
+def make_dedup_key(event) -> str:
+    """
+    Tạo khóa dedup cho một EventEnvelope (hoặc model đầy đủ của event)
+
+    Dùng `message.msg_id` nếu có, nếu không thì ghép app_id + event_name + timestamp + user.
+    """
+    msg_id = getattr(event, "msg_id", None)
+    if msg_id is None and getattr(event, "message", None) is not None:
+        msg_id = event.message.msg_id
+    if msg_id:
+        return f"{event.event_name}:{msg_id}"
+    return f"{event.app_id}:{event.event_name}:{event.timestamp}:{event.user_id_by_app}"
+
+
+class BloomFilter:
+    """Bloom filter kích thước cố định (double hashing trên blake2b)"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(1, capacity)
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class DedupIndex:
+    """
+    Chỉ mục chống trùng event theo 3 lớp:
+
+    1. Bloom filter (bộ nhớ cố định): trả lời "chắc chắn chưa thấy" cho đa số event mới.
+       Gồm hai thế hệ luân phiên để bộ nhớ và tỉ lệ false positive không tăng mãi.
+    2. LRU chính xác cho các khóa gần đây.
+    3. Bảng `event_dedup_keys` với unique constraint: chỉ được truy vấn khi Bloom báo
+       "có thể đã thấy" mà LRU không có; khóa mới được ghi theo lô qua batch writer.
+
+    Luồng dùng: `claim(key)` trước khi nhận event, rồi `confirm(key)` khi event đã được
+    đưa vào hàng đợi xử lý, hoặc `release(key)` nếu event bị từ chối (để Zalo retry).
+
+    Bloom/LRU là của từng process: khi có nhiều worker (`worker_count` > 1), bản retry có
+    thể tới worker chưa từng thấy khóa, nên khóa không có trong LRU được giữ chỗ ngay trong
+    DB bằng `INSERT ... ON CONFLICT DO NOTHING RETURNING` (chỉ một worker thắng).
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        batch_writer,
+        table,
+        bloom_capacity: int = 1_000_000,
+        lru_size: int = 100_000,
+        retention_hours: float = 72,
+        purge_interval: float = 3600,
+    ):
+        self.session_factory = session_factory
+        self.batch_writer = batch_writer
+        self.table = table
+        self.bloom_capacity = bloom_capacity
+        self.lru_size = lru_size
+        self.retention_seconds = retention_hours * 3600
+        self.purge_interval = purge_interval
+        # Số worker đang sống (gắn từ app); None khi chỉ có một process
+        self.worker_count: Optional[Callable[[], int]] = None
+        self._shared = False
+        self._workers_checked = 0.0
+        self._task: Optional[asyncio.Task] = None
+        # Khóa trong DB tạo trước thời điểm này là của lần chạy trước (ms)
+        self._started_at = int(time.time() * 1000)
+
+        self._bloom = BloomFilter(bloom_capacity)
+        self._previous_bloom: Optional[BloomFilter] = None
+        self._lru: "OrderedDict[str, None]" = OrderedDict()
+        self._inflight: set = set()
+        # Khóa đã được giữ chỗ trực tiếp trong DB (chế độ nhiều worker)
+        self._db_claimed: set = set()
+
+        # Statistics
+        self._lru_hits = 0
+        self._db_hits = 0
+        self._bloom_negatives = 0
+        self._bloom_false_positives = 0
+        self._inflight_hits = 0
+        self._db_errors = 0
+        self._db_claims = 0
+        self._purged = 0
+
+    async def start(self):
+        """Dọn khóa hết hạn trong DB, nạp lại các khóa gần đây vào Bloom/LRU rồi dọn định kỳ"""
+        self._started_at = int(time.time() * 1000)
+        await self._purge_expired()
+        self._task = asyncio.create_task(self._purge_loop())
+        try:
+            async with self.session_factory() as session:
+                result = await session.execute(
+                    select(self.table.c.dedup_key)
+                    .order_by(self.table.c.created_at.desc())
+                    .limit(self.bloom_capacity)
+                )
+                keys = result.scalars().all()
+        except Exception as e:
+            logger.error("Failed to warm dedup index: %s", e)
+            return
+
+        # Khóa mới nhất nằm cuối LRU
+        for key in reversed(keys):
+            self._remember(key)
+        logger.info("Dedup index warmed with %s keys", len(keys))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _purge_expired(self):
+        cutoff = int((time.time() - self.retention_seconds) * 1000)
+        try:
+            async with self.session_factory() as session:
+                result = await session.execute(delete(self.table).where(self.table.c.created_at < cutoff))
+                await session.commit()
+            self._purged += result.rowcount or 0
+        except Exception as e:
+            logger.error("Failed to purge expired dedup keys: %s", e)
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            await self._purge_expired()
+
+    def _is_shared(self) -> bool:
+        """Có nhiều worker đang sống không (kiểm tra tối đa mỗi _WORKER_CHECK_SECONDS)"""
+        now = time.monotonic()
+        if self.worker_count is not None and now - self._workers_checked >= _WORKER_CHECK_SECONDS:
+            self._workers_checked = now
+            try:
+                self._shared = self.worker_count() > 1
+            except Exception as e:
+                logger.error("Failed to count workers for dedup: %s", e)
+        return self._shared
+
+    async def claim(self, key: str) -> bool:
+        """
+        Giữ chỗ một khóa
+
+        Returns:
+            bool: True nếu là event mới, False nếu là bản trùng
+        """
+        if key in self._inflight:
+            self._inflight_hits += 1
+            return False
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            self._lru_hits += 1
+            return False
+
+        if self._is_shared():
+            return await self._claim_in_db(key)
+
+        if key in self._bloom or (self._previous_bloom is not None and key in self._previous_bloom):
+            # Có thể đã thấy: hỏi lớp cuối cùng là database
+            self._inflight.add(key)
+            try:
+                exists = await self._exists_in_db(key)
+            finally:
+                self._inflight.discard(key)
+            if exists:
+                self._db_hits += 1
+                self._touch_lru(key)
+                return False
+            self._bloom_false_positives += 1
+        else:
+            self._bloom_negatives += 1
+
+        self._inflight.add(key)
+        return True
+
+    async def _claim_in_db(self, key: str) -> bool:
+        """Giữ chỗ khóa trong DB; chỉ một worker insert được khóa chưa có"""
+        self._inflight.add(key)
+        try:
+            async with self.session_factory() as session:
+                result = await session.execute(
+                    pg_insert(self.table)
+                    .values(dedup_key=key, created_at=int(time.time() * 1000))
+                    .on_conflict_do_nothing(index_elements=["dedup_key"])
+                    .returning(self.table.c.dedup_key)
+                )
+                claimed = result.first() is not None
+                await session.commit()
+        except Exception as e:
+            # Không chặn event khi DB lỗi (ưu tiên at-least-once)
+            self._db_errors += 1
+            logger.error("Dedup claim failed: %s", e)
+            return True
+        except BaseException:
+            self._inflight.discard(key)
+            raise
+        if not claimed:
+            # Không đưa vào LRU: worker đang giữ khóa có thể release nếu không nhận event
+            self._inflight.discard(key)
+            self._db_hits += 1
+            return False
+        self._db_claims += 1
+        self._db_claimed.add(key)
+        return True
+
+    async def claim_replayed(self, key: str) -> bool:
+        """
+        Giữ chỗ khóa của một event replay từ journal
+
+        Event trong journal đã được nhận (và khóa đã confirm) trước khi restart, nên khóa
+        có sẵn từ lần chạy trước không tính là trùng. Chỉ trả về False khi khóa đang được
+        giữ bởi request khác hoặc đã được nhận lại sau khi khởi động (bản Zalo retry do
+        crash xảy ra trước khi kịp ack). Khóa được đưa vào Bloom/LRU để bỏ qua retry tới sau.
+
+        Returns:
+            bool: True nếu cần xử lý lại event
+        """
+        if key in self._inflight:
+            self._inflight_hits += 1
+            return False
+        try:
+            async with self.session_factory() as session:
+                result = await session.execute(
+                    pg_insert(self.table)
+                    .values(dedup_key=key, created_at=int(time.time() * 1000))
+                    .on_conflict_do_nothing(index_elements=["dedup_key"])
+                    .returning(self.table.c.dedup_key)
+                )
+                claimed = result.first() is not None
+                if not claimed:
+                    created_at = await session.scalar(
+                        select(self.table.c.created_at).where(self.table.c.dedup_key == key)
+                    )
+                    claimed = created_at is None or created_at < self._started_at
+                await session.commit()
+        except Exception as e:
+            # Không chặn replay khi DB lỗi (ưu tiên at-least-once)
+            self._db_errors += 1
+            logger.error("Dedup claim for journal replay failed: %s", e)
+            claimed = True
+        if not claimed:
+            self._db_hits += 1
+            return False
+        self._remember(key)
+        return True
+
+    async def release(self, key: str):
+        """Bỏ giữ chỗ khi event không được nhận (Zalo sẽ gửi lại)"""
+        self._inflight.discard(key)
+        if key not in self._db_claimed:
+            return
+        self._db_claimed.discard(key)
+        try:
+            async with self.session_factory() as session:
+                await session.execute(delete(self.table).where(self.table.c.dedup_key == key))
+                await session.commit()
+        except Exception as e:
+            # Khóa còn lại trong DB: bản retry của Zalo sẽ bị coi là trùng
+            self._db_errors += 1
+            logger.error("Failed to release dedup key %s: %s", key, e)
+
+    async def confirm(self, key: str):
+        """Ghi nhận khóa là đã nhận: thêm vào Bloom/LRU và lưu xuống DB theo lô"""
+        self._inflight.discard(key)
+        self._remember(key)
+        if key in self._db_claimed:
+            # Đã nằm trong DB từ lúc claim
+            self._db_claimed.discard(key)
+            return
+        await self.batch_writer.add(
+            self.table, {"dedup_key": key, "created_at": int(time.time() * 1000)}
+        )
+
+    def _remember(self, key: str):
+        if self._bloom.count >= self.bloom_capacity:
+            self._previous_bloom = self._bloom
+            self._bloom = BloomFilter(self.bloom_capacity)
+        self._bloom.add(key)
+        self._touch_lru(key)
+
+    def _touch_lru(self, key: str):
+        self._lru[key] = None
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    async def _exists_in_db(self, key: str) -> bool:
+        try:
+            async with self.session_factory() as session:
+                result = await session.execute(
+                    select(self.table.c.dedup_key).where(self.table.c.dedup_key == key)
+                )
+                return result.first() is not None
+        except Exception as e:
+            # Không chặn event khi DB lỗi (ưu tiên at-least-once)
+            self._db_errors += 1
+            logger.error("Dedup lookup failed: %s", e)
+            return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê hiệu quả các lớp dedup"""
+        return {
+            "lru_size": len(self._lru),
+            "inflight": len(self._inflight),
+            "bloom_keys": self._bloom.count,
+            "bloom_bytes": len(self._bloom.bits) * (2 if self._previous_bloom else 1),
+            "duplicates_dropped": self._lru_hits + self._db_hits + self._inflight_hits,
+            "lru_hits": self._lru_hits,
+            "db_hits": self._db_hits,
+            "inflight_hits": self._inflight_hits,
+            "bloom_negatives": self._bloom_negatives,
+            "bloom_false_positives": self._bloom_false_positives,
+            "db_errors": self._db_errors,
+            "shared_mode": self._shared,
+            "db_claims": self._db_claims,
+            "expired_keys_purged": self._purged,
+        }
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Lane:
+    """Một lane: hàng đợi có giới hạn + một worker duy nhất (giữ thứ tự)"""
+
+    def __init__(self, index: int, capacity: int):
+        self.index = index
+        self.capacity = capacity
+        # Giới hạn được tính trên job trong hàng đợi + chỗ đã giữ trước (reserve)
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.reserved = 0
+        self.space_freed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.busy = False
+
+        # Statistics
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+
+    def full(self) -> bool:
+        return self.queue.qsize() + self.reserved >= self.capacity
+
+    def free_slot(self):
+        self.space_freed.set()
+
+    def get_stats(self, elapsed: float) -> Dict[str, Any]:
+        started = self.processed + self.failed + int(self.busy)
+        return {
+            "lane": self.index,
+            "queue_depth": self.queue.qsize(),
+            "reserved": self.reserved,
+            "busy": self.busy,
+            "utilisation": round(self.busy_time / elapsed, 4) if elapsed else 0.0,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_queue_wait_ms": round(self.wait_time / started * 1000, 3) if started else 0.0,
+        }
+
+
+class ShardedDispatcher:
+    """
+    Dispatcher chia job thành các lane theo key (ví dụ `user_id_by_app`).
+
+    Mỗi key luôn được hash vào cùng một lane, mỗi lane chỉ có một worker, nên các job
+    của cùng một key được xử lý tuần tự đúng thứ tự nhận; các key khác nhau chạy song
+    song trên các lane khác nhau. Mỗi lane có hàng đợi giới hạn: khi lane đầy, `submit`
+    trả về False để endpoint trả 503 (backpressure).
+
+    Caller cần làm việc chậm giữa lúc kiểm tra và lúc đưa job vào (ví dụ ghi journal) dùng
+    `reserve(key)` để giữ chỗ trước, rồi `submit(key, ..., reserved=True)` (luôn thành
+    công) hoặc `cancel_reservation(key)` nếu bỏ job.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[..., Awaitable[Any]],
+        lanes: int = 8,
+        lane_capacity: int = 200,
+        name: str = "lane",
+    ):
+        self.handler = handler
+        self.lane_count = max(1, lanes)
+        self.lane_capacity = max(1, lane_capacity)
+        self.name = name
+
+        self._lanes: List[_Lane] = []
+        self._started_at: Optional[float] = None
+
+    async def start(self):
+        """Khởi tạo các lane và worker tương ứng"""
+        self._lanes = [_Lane(i, self.lane_capacity) for i in range(self.lane_count)]
+        self._started_at = time.monotonic()
+        for lane in self._lanes:
+            lane.task = asyncio.create_task(self._lane_loop(lane), name=f"{self.name}-{lane.index}")
+        logger.info("Started %s %ss (capacity %s each)", self.lane_count, self.name, self.lane_capacity)
+
+    async def stop(self, timeout: float = 10.0):
+        """Chờ các lane xử lý hết (tối đa `timeout` giây) rồi dừng worker"""
+        if not self._lanes:
+            return
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(lane.queue.join() for lane in self._lanes)), timeout
+            )
+        except asyncio.TimeoutError:
+            remaining = sum(lane.queue.qsize() for lane in self._lanes)
+            logger.warning("%s dispatcher stopped with %s items still queued", self.name, remaining)
+        for lane in self._lanes:
+            lane.task.cancel()
+        await asyncio.gather(*(lane.task for lane in self._lanes), return_exceptions=True)
+        self._lanes = []
+
+    def lane_for(self, key: str) -> int:
+        """Hash key vào một lane cố định (ổn định giữa các process, khác với hash())"""
+        return zlib.crc32(key.encode("utf-8")) % self.lane_count
+
+    def is_full(self, key: str) -> bool:
+        """Kiểm tra lane của key đã đầy chưa"""
+        return not self._lanes or self._lanes[self.lane_for(key)].full()
+
+    def reserve(self, key: str) -> bool:
+        """
+        Giữ trước một chỗ trong lane của key
+
+        Returns:
+            bool: False nếu lane đã đầy (không giữ được chỗ)
+        """
+        if self.is_full(key):
+            return False
+        self._lanes[self.lane_for(key)].reserved += 1
+        return True
+
+    def cancel_reservation(self, key: str):
+        """Trả lại chỗ đã giữ bằng `reserve` khi job không được đưa vào"""
+        if not self._lanes:
+            return
+        lane = self._lanes[self.lane_for(key)]
+        if lane.reserved:
+            lane.reserved -= 1
+            lane.free_slot()
+
+    def submit(self, key: str, *args, reserved: bool = False) -> bool:
+        """
+        Đưa job vào lane của key, không chờ
+
+        Args:
+            reserved: job dùng chỗ đã giữ bằng `reserve` (không bao giờ bị từ chối)
+
+        Returns:
+            bool: False nếu lane đã đầy (job bị từ chối)
+        """
+        if not self._lanes:
+            return False
+        lane = self._lanes[self.lane_for(key)]
+        if reserved and lane.reserved:
+            lane.reserved -= 1
+        elif lane.full():
+            lane.rejected += 1
+            return False
+        lane.queue.put_nowait((time.monotonic(), args))
+        return True
+
+    def record_rejection(self, key: str):
+        """Ghi nhận một job của key bị từ chối do lane đầy"""
+        if self._lanes:
+            self._lanes[self.lane_for(key)].rejected += 1
+
+    async def put(self, key: str, *args):
+        """Đưa job vào lane của key, chờ nếu lane đầy (dùng cho replay)"""
+        lane = self._lanes[self.lane_for(key)]
+        while lane.full():
+            lane.space_freed.clear()
+            await lane.space_freed.wait()
+        lane.queue.put_nowait((time.monotonic(), args))
+
+    async def _lane_loop(self, lane: _Lane):
+        while True:
+            enqueued_at, args = await lane.queue.get()
+            lane.free_slot()
+            started = time.monotonic()
+            lane.wait_time += started - enqueued_at
+            lane.busy = True
+            try:
+                await self.handler(*args)
+                lane.processed += 1
+            except Exception as e:
+                lane.failed += 1
+                logger.error("%s %s job failed: %s", self.name, lane.index, e)
+            finally:
+                lane.busy = False
+                lane.busy_time += time.monotonic() - started
+                lane.queue.task_done()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê tổng hợp và theo từng lane"""
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        lanes = [lane.get_stats(elapsed) for lane in self._lanes]
+        busy_time = sum(lane.busy_time for lane in self._lanes)
+        return {
+            "lanes": self.lane_count,
+            "lane_capacity": self.lane_capacity,
+            "busy_lanes": sum(1 for lane in self._lanes if lane.busy),
+            "utilisation": round(busy_time / (elapsed * self.lane_count), 4) if elapsed else 0.0,
+            "queue_depth": sum(stats["queue_depth"] for stats in lanes),
+            "processed": sum(stats["processed"] for stats in lanes),
+            "failed": sum(stats["failed"] for stats in lanes),
+            "rejected": sum(stats["rejected"] for stats in lanes),
+            "per_lane": lanes,
+        }
@@ -0,0 +1,427 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Header mỗi record: độ dài payload, crc32 của payload, sequence number
+_RECORD_HEADER = struct.Struct(">IIQ")
+_SEGMENT_SUFFIX = ".log"
+_CHECKPOINT_FILE = "checkpoint"
+_DEAD_LETTER_FILE = "dead_letter.jsonl"
+_LOCK_FILE = "lock"
+
+_fdatasync = getattr(os, "fdatasync", os.fsync)
+
+
+class JournalLocked(Exception):
+    """Thư mục journal đang được một journal khác (process khác) giữ"""
+
+
+class IngestionJournal:
+    """
+    Write-ahead journal dạng append-only, chia segment trên đĩa.
+
+    Mỗi payload webhook đã xác thực được ghi vào journal trước khi trả 200 cho Zalo.
+    Các lần append đồng thời được gom lại (group commit) và fsync một lần mỗi vài ms,
+    nên không phải trả giá một fsync cho mỗi request.
+
+    Sau khi xử lý xong, caller gọi `mark_done(seq)`. Journal giữ low-watermark (mọi seq
+    <= watermark đều đã xử lý), ghi định kỳ vào file checkpoint. Khi khởi động lại, các
+    entry có seq > checkpoint được trả về để replay (at-least-once).
+
+    Journal giữ flock trên file `lock` trong thư mục suốt thời gian mở, nên mỗi thư mục
+    chỉ có một process ghi/replay tại một thời điểm.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_max_bytes: int = 64 * 1024 * 1024,
+        flush_interval_ms: float = 2.0,
+        max_batch: int = 512,
+        checkpoint_interval: float = 1.0,
+    ):
+        self.directory = Path(directory)
+        self.segment_max_bytes = segment_max_bytes
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_batch = max_batch
+        self.checkpoint_interval = checkpoint_interval
+
+        self._file = None
+        self._lock_fd: Optional[int] = None
+        self._segment_size = 0
+        # Danh sách (first_seq, path) của các segment, theo thứ tự
+        self._segments: List[Tuple[int, Path]] = []
+        # Writer và checkpoint chạy trên các thread khác nhau của executor
+        self._segments_lock = threading.Lock()
+
+        self._next_seq = 1
+        self._watermark = 0
+        self._checkpointed = 0
+        self._done_out_of_order: set = set()
+
+        self._pending: List[Tuple[int, bytes, asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._checkpoint_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # Statistics
+        self._appended = 0
+        self._flushes = 0
+        self._dead_letters = 0
+
+    # ------------------------------------------------------------------ lifecycle
+
+    async def start(self, blocking: bool = True) -> List[Tuple[int, bytes]]:
+        """
+        Mở journal, khôi phục trạng thái từ đĩa và bắt đầu flusher.
+
+        Args:
+            blocking: chờ nếu thư mục đang bị process khác giữ; False thì raise JournalLocked
+
+        Returns:
+            Danh sách (seq, payload) chưa được xử lý, cần replay
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._acquire_lock, blocking)
+        try:
+            unprocessed = await loop.run_in_executor(None, self._recover)
+        except BaseException:
+            self._release_lock()
+            raise
+
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        self._checkpoint_task = asyncio.create_task(self._checkpoint_loop())
+
+        logger.info(
+            "Journal opened at %s: %s segments, next_seq=%s, %s entries to replay",
+            self.directory, len(self._segments), self._next_seq, len(unprocessed),
+        )
+        return unprocessed
+
+    async def close(self):
+        """Flush các entry còn lại, ghi checkpoint và đóng file"""
+        self._closing = True
+        if self._wakeup:
+            self._wakeup.set()
+        if self._flush_task:
+            await self._flush_task
+            self._flush_task = None
+        if self._checkpoint_task:
+            self._checkpoint_task.cancel()
+            try:
+                await self._checkpoint_task
+            except asyncio.CancelledError:
+                pass
+            self._checkpoint_task = None
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_checkpoint)
+        if self._file:
+            self._file.close()
+            self._file = None
+        self._release_lock()
+
+    def _acquire_lock(self, blocking: bool):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.directory / _LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if not blocking:
+                    raise JournalLocked(f"Journal {self.directory} is in use")
+                logger.warning("Journal %s is in use, waiting for its lock", self.directory)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._lock_fd = fd
+
+    def _release_lock(self):
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    # ------------------------------------------------------------------ public API
+
+    async def append(self, payload: bytes) -> int:
+        """
+        Ghi payload vào journal và chờ tới khi đã fsync xuống đĩa
+
+        Returns:
+            int: sequence number của entry
+        """
+        if self._closing or self._wakeup is None:
+            raise RuntimeError("Journal is not running")
+
+        seq = self._next_seq
+        self._next_seq += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((seq, payload, future))
+        self._wakeup.set()
+        return await future
+
+    def mark_done(self, seq: int):
+        """Đánh dấu entry đã được xử lý xong (có thể gọi không theo thứ tự)"""
+        if seq <= self._watermark:
+            return
+        self._done_out_of_order.add(seq)
+        while self._watermark + 1 in self._done_out_of_order:
+            self._watermark += 1
+            self._done_out_of_order.discard(self._watermark)
+
+    async def dead_letter(self, payload: bytes, reason: str):
+        """
+        Lưu payload của event xử lý lỗi vào `dead_letter.jsonl` (mỗi dòng một JSON)
+
+        Event trong dead-letter không được replay tự động; có thể gửi lại thủ công vào
+        /webhook sau khi sửa lỗi.
+        """
+        line = json.dumps(
+            {"failed_at": time.time(), "reason": reason, "payload": payload.decode("utf-8", "replace")},
+            ensure_ascii=False,
+        ) + "\n"
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._append_dead_letter, line.encode("utf-8"))
+        self._dead_letters += 1
+
+    def _append_dead_letter(self, data: bytes):
+        with open(self.directory / _DEAD_LETTER_FILE, "ab") as f:
+            f.write(data)
+            f.flush()
+            _fdatasync(f.fileno())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê journal"""
+        return {
+            "segments": len(self._segments),
+            "next_seq": self._next_seq,
+            "watermark": self._watermark,
+            "in_flight": self._next_seq - 1 - self._watermark,
+            "pending_flush": len(self._pending),
+            "appended": self._appended,
+            "flushes": self._flushes,
+            "avg_batch": round(self._appended / self._flushes, 2) if self._flushes else 0,
+            "dead_letters": self._dead_letters,
+        }
+
+    # ------------------------------------------------------------------ group commit
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            # Chờ thêm một chút để gom các append đến cùng lúc
+            if self.flush_interval and not self._closing and len(self._pending) < self.max_batch:
+                await asyncio.sleep(self.flush_interval)
+
+            batch, self._pending = self._pending, []
+            if batch:
+                try:
+                    await loop.run_in_executor(None, self._write_batch, batch)
+                except Exception as e:
+                    logger.error("Journal write failed: %s", e)
+                    for seq, _, future in batch:
+                        # Batch đã bị cắt khỏi segment (không replay, caller nhận lỗi nên
+                        # không ack); sau restart recovery cũng bỏ qua các seq thiếu này
+                        self.mark_done(seq)
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    self._appended += len(batch)
+                    self._flushes += 1
+                    for seq, _, future in batch:
+                        if not future.done():
+                            future.set_result(seq)
+
+            if self._closing and not self._pending:
+                break
+
+    def _write_batch(self, batch: List[Tuple[int, bytes, asyncio.Future]]):
+        """
+        Chạy trong thread pool: ghi cả batch vào một segment rồi fsync một lần
+
+        Batch không bị chia qua hai segment (segment có thể vượt `segment_max_bytes` một
+        batch), nên khi ghi lỗi chỉ cần cắt segment về offset đã fsync cuối cùng.
+        """
+        if self._file is None or self._segment_size >= self.segment_max_bytes:
+            self._roll_segment(batch[0][0])
+        data = b"".join(
+            _RECORD_HEADER.pack(len(payload), zlib.crc32(payload), seq) + payload
+            for seq, payload, _ in batch
+        )
+        try:
+            self._write_and_sync(data)
+        except Exception:
+            self._discard_unsynced()
+            raise
+        self._segment_size += len(data)
+
+    def _write_and_sync(self, data: bytes):
+        self._file.write(data)
+        self._file.flush()
+        _fdatasync(self._file.fileno())
+
+    def _discard_unsynced(self):
+        """
+        Cắt phần ghi dở của batch lỗi khỏi segment hiện tại
+
+        Nếu để lại, recovery dừng ở record hỏng và cắt mất mọi record ghi sau nó. Không cắt
+        được thì bỏ segment này: batch sau mở segment mới, phần hỏng nằm ở cuối segment cũ.
+        """
+        path = self._segments[-1][1]
+        try:
+            self._file.close()
+        except OSError:
+            pass
+        self._file = None
+        try:
+            os.truncate(path, self._segment_size)
+            self._file = open(path, "ab")
+        except OSError as e:
+            logger.error("Cannot truncate journal segment %s: %s", path.name, e)
+
+    def _roll_segment(self, first_seq: int):
+        if self._file:
+            self._file.close()
+        path = self.directory / f"{first_seq:020d}{_SEGMENT_SUFFIX}"
+        self._file = open(path, "ab")
+        self._segment_size = 0
+        with self._segments_lock:
+            self._segments.append((first_seq, path))
+        # fsync thư mục để tên file mới bền vững sau crash
+        self._sync_directory()
+
+    def _sync_directory(self):
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    # ------------------------------------------------------------------ checkpoint
+
+    async def _checkpoint_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            if self._watermark != self._checkpointed:
+                try:
+                    await loop.run_in_executor(None, self._write_checkpoint)
+                except Exception as e:
+                    logger.error("Journal checkpoint failed: %s", e)
+
+    def _write_checkpoint(self):
+        watermark = self._watermark
+        if watermark == self._checkpointed:
+            return
+        tmp_path = self.directory / f"{_CHECKPOINT_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(watermark))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.directory / _CHECKPOINT_FILE)
+        self._checkpointed = watermark
+        self._drop_processed_segments(watermark)
+
+    def _drop_processed_segments(self, watermark: int):
+        """Xóa các segment mà mọi entry đều đã được xử lý (trừ segment đang ghi)"""
+        with self._segments_lock:
+            dropped = []
+            while len(self._segments) > 1 and self._segments[1][0] - 1 <= watermark:
+                dropped.append(self._segments.pop(0)[1])
+        for path in dropped:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    # ------------------------------------------------------------------ recovery
+
+    def _recover(self) -> List[Tuple[int, bytes]]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        checkpoint_path = self.directory / _CHECKPOINT_FILE
+        if checkpoint_path.exists():
+            try:
+                self._watermark = int(checkpoint_path.read_text().strip() or 0)
+            except ValueError:
+                logger.warning("Corrupted journal checkpoint, replaying everything")
+                self._watermark = 0
+        self._checkpointed = self._watermark
+
+        paths = sorted(self.directory.glob(f"*{_SEGMENT_SUFFIX}"))
+        unprocessed: List[Tuple[int, bytes]] = []
+        last_seq = self._watermark
+
+        for index, path in enumerate(paths):
+            try:
+                first_seq = int(path.stem)
+            except ValueError:
+                continue
+            self._segments.append((first_seq, path))
+            is_last = index == len(paths) - 1
+            good_offset = 0
+            with open(path, "rb") as f:
+                data = f.read()
+            while good_offset + _RECORD_HEADER.size <= len(data):
+                length, crc, seq = _RECORD_HEADER.unpack_from(data, good_offset)
+                start = good_offset + _RECORD_HEADER.size
+                payload = data[start:start + length]
+                if len(payload) != length or zlib.crc32(payload) != crc:
+                    break
+                good_offset = start + length
+                last_seq = max(last_seq, seq)
+                if seq > self._watermark:
+                    unprocessed.append((seq, payload))
+
+            if good_offset != len(data):
+                # Record cuối bị ghi dở do crash: cắt bỏ phần hỏng
+                logger.warning("Truncating torn journal tail in %s at offset %s", path.name, good_offset)
+                if is_last:
+                    with open(path, "r+b") as f:
+                        f.truncate(good_offset)
+            if is_last:
+                self._file = open(path, "ab")
+                self._segment_size = good_offset
+
+        self._next_seq = last_seq + 1
+        self._skip_missing(unprocessed)
+        self._drop_processed_segments(self._watermark)
+        return unprocessed
+
+    def _skip_missing(self, unprocessed: List[Tuple[int, bytes]]):
+        """
+        Coi các seq không có trên đĩa là đã xong
+
+        Đó là các batch ghi lỗi (đã cắt khỏi segment, caller không ack): không có gì để
+        replay, và nếu chờ chúng thì watermark kẹt vĩnh viễn ở chỗ trống.
+        """
+        if not unprocessed:
+            return
+        self._watermark = max(self._watermark, unprocessed[0][0] - 1)
+        missing_from = self._watermark + 1
+        for seq, _ in unprocessed:
+            if seq > missing_from:
+                self._done_out_of_order.update(range(missing_from, seq))
+            missing_from = seq + 1
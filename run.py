@@ -3,6 +3,7 @@
 Script khởi chạy Zalo Webhook Server
 """
 
+import argparse
 import os
 import sys
 import subprocess
@@ -43,8 +44,20 @@ def check_environment():
     
     return True
 
+def parse_args():
+    """Đọc tham số dòng lệnh"""
+    parser = argparse.ArgumentParser(description="Zalo Webhook Server")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Số worker process (mặc định: WORKERS trong .env, hoặc 1)",
+    )
+    return parser.parse_args()
+
 def main():
     """Main function"""
+    args = parse_args()
     print("🚀 Starting Zalo Webhook Server...")
     
     if not check_environment():
@@ -62,8 +75,15 @@ def main():
         from config import settings
         import uvicorn
         
+        workers = max(1, args.workers or settings.WORKERS)
+        # uvicorn không hỗ trợ reload khi chạy nhiều worker
+        reload = settings.DEBUG and workers == 1
+        
         print(f"🌐 Server will run on: http://0.0.0.0:{settings.PORT}")
         print(f"📊 Debug mode: {settings.DEBUG}")
+        print(f"👷 Workers: {workers} (shared stats: {settings.SHARED_STATS_PATH})")
+        if settings.DEBUG and not reload:
+            print("⚠️  Auto-reload disabled when running multiple workers")
         print(f"🔗 Webhook domain: {settings.WEBHOOK_DOMAIN}")
         print(f"📝 API docs will be available at: http://localhost:{settings.PORT}/docs")
         print("\n🎯 Webhook URL for Zalo: https://{}/webhook".format(settings.WEBHOOK_DOMAIN))
@@ -74,7 +94,8 @@ def main():
             "app:app",
             host="0.0.0.0",
             port=settings.PORT,
-            reload=settings.DEBUG,
+            reload=reload,
+            workers=workers,
             log_level=settings.LOG_LEVEL.lower()
         )
         
@@ -0,0 +1,310 @@
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+
+import httpx
+from sqlalchemy import update
+
+from config import settings
+from monitoring.metrics import ATTACHMENT_DOWNLOADS
+from pipeline.dedup import make_dedup_key
+from storage.database import AsyncSessionLocal, RawEvent
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 64 * 1024
+# Row của event có thể còn trong batch writer khi tải xong: thử ghi đường dẫn lại vài lần
+_RECORD_ATTEMPTS = 5
+_RECORD_RETRY_SECONDS = 1.0
+# Redirect được tự đi theo (kiểm tra lại host ở mỗi bước)
+_MAX_REDIRECTS = 3
+
+
+class AttachmentTooLarge(Exception):
+    """File vượt quá ATTACHMENT_MAX_BYTES"""
+
+
+class AttachmentURLRejected(Exception):
+    """URL (hoặc đích redirect) không phải https tới host được phép"""
+
+
+def host_allowed(host: str, allowed_hosts: Sequence[str]) -> bool:
+    """Host trùng một mục trong danh sách hoặc là subdomain của nó"""
+    host = host.lower().rstrip(".")
+    return any(host == allowed or host.endswith("." + allowed) for allowed in allowed_hosts)
+
+
+def attachment_urls(attachments: Optional[List[Dict[str, Any]]]) -> List[str]:
+    """URL tải về của các attachment (payload.url) trong tin nhắn"""
+    urls = []
+    for attachment in attachments or []:
+        url = (attachment.get("payload") or {}).get("url")
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+def _remove_if_exists(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class _FetchJob:
+    __slots__ = ("timestamp", "event_key", "urls")
+
+    def __init__(self, timestamp: int, event_key: str, urls: List[str]):
+        self.timestamp = timestamp
+        self.event_key = event_key
+        self.urls = urls
+
+
+class AttachmentFetcher:
+    """
+    Tải attachment (ảnh, file) của tin nhắn về đĩa, chạy nền
+
+    - Handler chỉ đưa job vào hàng đợi có giới hạn (`submit`, không chờ); `max_concurrency`
+      task tải song song qua một connection pool dùng chung
+    - File được stream xuống đĩa từng chunk (không giữ cả file trong bộ nhớ) và băm
+      SHA-256 trong lúc ghi; file lưu theo nội dung tại `<dir>/<sha[:2]>/<sha>`, nên cùng
+      một nội dung chỉ được ghi một lần dù được gửi nhiều lần
+    - Đường dẫn file được ghi vào cột `local_paths` của row event trong bảng events
+      (`/images` trả về qua join với row đó)
+    - URL lấy từ payload nên không được tin: chỉ tải qua https từ host trong
+      `allowed_hosts` (CDN của Zalo), redirect được đi theo thủ công và kiểm tra lại ở
+      mỗi bước
+    """
+
+    def __init__(
+        self,
+        storage_dir: str,
+        session_factory=AsyncSessionLocal,
+        max_concurrency: int = 4,
+        queue_size: int = 1000,
+        max_bytes: int = 50 * 1024 * 1024,
+        timeout: float = 60.0,
+        allowed_hosts: Sequence[str] = (),
+        require_https: bool = True,
+    ):
+        self.storage_dir = storage_dir
+        self.allowed_hosts = tuple(host.strip().lower() for host in allowed_hosts if host.strip())
+        self.require_https = require_https
+        self.session_factory = session_factory
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self._workers: List[asyncio.Task] = []
+        self._client: Optional[httpx.AsyncClient] = None
+        # URL đang tải: các job trùng URL chờ chung một lần tải
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        # Statistics
+        self._stored = 0
+        self._duplicates = 0
+        self._failed = 0
+        self._dropped = 0
+        self._rejected = 0
+        self._bytes = 0
+
+    @classmethod
+    def from_settings(cls) -> "AttachmentFetcher":
+        """Tạo fetcher theo cấu hình ATTACHMENT_*"""
+        return cls(
+            settings.ATTACHMENT_DIR,
+            max_concurrency=settings.ATTACHMENT_MAX_CONCURRENCY,
+            queue_size=settings.ATTACHMENT_QUEUE_SIZE,
+            max_bytes=settings.ATTACHMENT_MAX_BYTES,
+            timeout=settings.ATTACHMENT_TIMEOUT_SECONDS,
+            allowed_hosts=settings.ATTACHMENT_ALLOWED_HOSTS.split(","),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.storage_dir)
+
+    async def start(self):
+        if not self.enabled or self._workers:
+            return
+        os.makedirs(os.path.join(self.storage_dir, "tmp"), exist_ok=True)
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+            follow_redirects=False,
+        )
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrency)]
+
+    async def close(self):
+        """Dừng tải; job còn trong hàng đợi bị bỏ (payload vẫn còn trong bảng events)"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def submit(self, event) -> bool:
+        """
+        Đưa attachment của một event tin nhắn vào hàng đợi tải
+
+        Returns:
+            bool: False nếu hàng đợi đầy (job bị bỏ) hoặc fetcher đang tắt
+        """
+        urls = attachment_urls(event.message.attachments if event.message else None)
+        if not urls or not self._workers:
+            return False
+        job = _FetchJob(int(event.timestamp), make_dedup_key(event), urls)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self._dropped += 1
+            logger.warning("Attachment queue full, skipping download for %s", job.event_key)
+            return False
+        return True
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                paths = {}
+                for url in job.urls:
+                    path = await self.fetch(url)
+                    if path is not None:
+                        paths[url] = path
+                if paths:
+                    await self._record(job, paths)
+            except Exception as e:
+                logger.error("Attachment job for %s failed: %s", job.event_key, e)
+            finally:
+                self._queue.task_done()
+
+    async def fetch(self, url: str) -> Optional[str]:
+        """Tải một URL (các lần tải trùng URL đồng thời dùng chung một lần), trả về đường dẫn file"""
+        future = self._inflight.get(url)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[url] = future
+        try:
+            path = await self._download(url)
+        except Exception as e:
+            if isinstance(e, AttachmentURLRejected):
+                self._rejected += 1
+                ATTACHMENT_DOWNLOADS.inc("rejected")
+                logger.warning("Attachment URL %s rejected: %s", url, e)
+            else:
+                self._failed += 1
+                ATTACHMENT_DOWNLOADS.inc("too_large" if isinstance(e, AttachmentTooLarge) else "failed")
+                logger.error("Failed to download attachment %s: %s", url, e)
+            path = None
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._inflight.pop(url, None)
+        future.set_result(path)
+        return path
+
+    def _check_url(self, url: httpx.URL):
+        if self.require_https and url.scheme != "https":
+            raise AttachmentURLRejected(f"scheme {url.scheme!r} not allowed")
+        if url.scheme not in ("https", "http"):
+            raise AttachmentURLRejected(f"scheme {url.scheme!r} not allowed")
+        if not host_allowed(url.host, self.allowed_hosts):
+            raise AttachmentURLRejected(f"host {url.host!r} not allowed")
+
+    async def _open(self, url: str) -> httpx.Response:
+        """Gửi GET (stream), tự đi theo redirect sau khi kiểm tra đích của từng bước"""
+        target = httpx.URL(url)
+        for _ in range(_MAX_REDIRECTS + 1):
+            self._check_url(target)
+            response = await self._client.send(self._client.build_request("GET", target), stream=True)
+            if not response.has_redirect_location:
+                return response
+            await response.aclose()
+            target = response.url.join(response.headers["location"])
+        raise AttachmentURLRejected(f"more than {_MAX_REDIRECTS} redirects")
+
+    async def _download(self, url: str) -> str:
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.storage_dir, "tmp", f"{os.getpid()}-{uuid.uuid4().hex}")
+        try:
+            response = await self._open(url)
+            try:
+                response.raise_for_status()
+                declared = int(response.headers.get("content-length") or 0)
+                if declared > self.max_bytes:
+                    raise AttachmentTooLarge(f"{declared} bytes")
+                # Thao tác file chạy trong thread: đĩa chậm không chặn event loop
+                f = await asyncio.to_thread(open, tmp_path, "wb")
+                try:
+                    async for chunk in response.aiter_bytes(_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise AttachmentTooLarge(f"more than {self.max_bytes} bytes")
+                        digest.update(chunk)
+                        await asyncio.to_thread(f.write, chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+            finally:
+                await response.aclose()
+            sha = digest.hexdigest()
+            path = os.path.join(self.storage_dir, sha[:2], sha)
+            if await asyncio.to_thread(self._store, tmp_path, path):
+                self._stored += 1
+                self._bytes += size
+                ATTACHMENT_DOWNLOADS.inc("stored")
+            else:
+                self._duplicates += 1
+                ATTACHMENT_DOWNLOADS.inc("duplicate")
+            return path
+        finally:
+            await asyncio.to_thread(_remove_if_exists, tmp_path)
+
+    @staticmethod
+    def _store(tmp_path: str, path: str) -> bool:
+        """Chuyển file tạm vào chỗ theo nội dung; False nếu nội dung này đã có"""
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Đổi tên nguyên tử: không bao giờ có file nội dung dở dang tại `path`
+        os.replace(tmp_path, path)
+        return True
+
+    async def _record(self, job: _FetchJob, paths: Dict[str, str]):
+        """Ghi đường dẫn vào row event (theo khóa chính, chỉ chạm đúng một partition)"""
+        table = RawEvent.__table__
+        statement = (
+            update(table)
+            .where(table.c.timestamp == job.timestamp, table.c.event_key == job.event_key)
+            .values(local_paths=paths)
+        )
+        for attempt in range(_RECORD_ATTEMPTS):
+            async with self.session_factory() as session:
+                result = await session.execute(statement)
+                await session.commit()
+            if result.rowcount:
+                return
+            await asyncio.sleep(_RECORD_RETRY_SECONDS)
+        logger.warning("Event row %s not found, attachment paths not recorded", job.event_key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "queued": self._queue.qsize(),
+            "downloading": len(self._inflight),
+            "stored": self._stored,
+            "duplicates": self._duplicates,
+            "failed": self._failed,
+            "dropped": self._dropped,
+            "rejected": self._rejected,
+            "bytes_stored": self._bytes,
+        }
+
+
+# Fetcher dùng chung (MessageHandler đưa job vào, app start/close)
+attachment_fetcher = AttachmentFetcher.from_settings()
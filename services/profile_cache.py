@@ -0,0 +1,225 @@
+import asyncio
+import functools
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import settings
+from monitoring.metrics import PROFILE_CACHE_LOOKUPS
+from services.zalo_client import ZaloAPIError, zalo_client
+
+logger = logging.getLogger(__name__)
+
+Profile = Dict[str, Any]
+# loader(user_id_by_app, zalo_user_id) -> profile, None nếu chắc chắn không có profile
+Loader = Callable[[str, Optional[str]], Awaitable[Optional[Profile]]]
+
+
+class _Entry:
+    __slots__ = ("profile", "loaded_at", "expires_at")
+
+    def __init__(self, profile: Optional[Profile], loaded_at: float, expires_at: float):
+        self.profile = profile
+        self.loaded_at = loaded_at
+        self.expires_at = expires_at
+
+
+class ProfileCache:
+    """
+    Cache profile người dùng (LRU có giới hạn + TTL) theo `user_id_by_app`
+
+    - Kết quả "không có profile" cũng được cache (TTL riêng, ngắn hơn)
+    - Entry đã qua `refresh_after` (tỉ lệ của TTL) vẫn được trả về ngay, đồng thời làm
+      mới nền; chỉ entry đã hết hạn hẳn mới phải chờ loader
+    - Single flight: các lookup đồng thời cùng một user chỉ gọi loader một lần
+    - Lỗi tạm thời của loader (mạng, quota) không được cache
+    """
+
+    def __init__(
+        self,
+        loader: Loader,
+        max_size: int = 10000,
+        ttl_seconds: float = 600,
+        negative_ttl_seconds: float = 60,
+        refresh_after: float = 0.8,
+    ):
+        self.loader = loader
+        self.max_size = max(1, max_size)
+        self.ttl = ttl_seconds
+        self.negative_ttl = negative_ttl_seconds
+        self.refresh_after = refresh_after
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+        # Statistics
+        self._counts = {"hit": 0, "negative_hit": 0, "stale": 0, "miss": 0, "coalesced": 0}
+        self._load_errors = 0
+        self._evictions = 0
+
+    @classmethod
+    def from_settings(cls, loader: Loader) -> "ProfileCache":
+        """Tạo cache theo cấu hình PROFILE_CACHE_*"""
+        return cls(
+            loader,
+            max_size=settings.PROFILE_CACHE_SIZE,
+            ttl_seconds=settings.PROFILE_CACHE_TTL_SECONDS,
+            negative_ttl_seconds=settings.PROFILE_CACHE_NEGATIVE_TTL_SECONDS,
+        )
+
+    def _count(self, result: str):
+        self._counts[result] += 1
+        PROFILE_CACHE_LOOKUPS.inc(result)
+
+    async def get(self, user_id: str, zalo_user_id: Optional[str] = None) -> Optional[Profile]:
+        """
+        Profile của người dùng; None nếu không có hoặc không lấy được
+
+        `zalo_user_id` là id của người dùng trong OA (sender.id / follower.id), được
+        loader dùng để gọi API của Zalo.
+        """
+        now = time.monotonic()
+        entry = self._entries.get(user_id)
+        if entry is not None and now < entry.expires_at:
+            self._entries.move_to_end(user_id)
+            if entry.profile is None:
+                self._count("negative_hit")
+            elif now - entry.loaded_at >= (entry.expires_at - entry.loaded_at) * self.refresh_after:
+                # Sắp hết hạn: trả về ngay, làm mới nền
+                self._count("stale")
+                self._load(user_id, zalo_user_id)
+            else:
+                self._count("hit")
+            return entry.profile
+
+        if user_id in self._inflight:
+            self._count("coalesced")
+        else:
+            self._count("miss")
+        # shield: caller bị hủy không làm hủy lần tải của các caller khác
+        return await asyncio.shield(self._load(user_id, zalo_user_id))
+
+    def _load(self, user_id: str, zalo_user_id: Optional[str]) -> asyncio.Task:
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._fetch(user_id, zalo_user_id))
+            self._inflight[user_id] = task
+            task.add_done_callback(functools.partial(self._load_done, user_id))
+        return task
+
+    def _load_done(self, user_id: str, task: asyncio.Task):
+        # Chỉ gỡ đúng task vừa xong: sau invalidate có thể đã có lần tải mới cho user này
+        if self._inflight.get(user_id) is task:
+            del self._inflight[user_id]
+
+    async def _fetch(self, user_id: str, zalo_user_id: Optional[str]) -> Optional[Profile]:
+        try:
+            profile = await self.loader(user_id, zalo_user_id)
+        except Exception as e:
+            # Lỗi tạm thời: không cache, giữ entry cũ (nếu có) cho tới khi hết hạn
+            self._load_errors += 1
+            logger.warning("Profile lookup for %s failed: %s", user_id, e)
+            entry = self._entries.get(user_id)
+            return entry.profile if entry is not None else None
+        # Lần tải bắt đầu trước invalidate không ghi đè cache bằng kết quả cũ
+        if self._inflight.get(user_id) is asyncio.current_task():
+            self.put(user_id, profile)
+        return profile
+
+    def put(self, user_id: str, profile: Optional[Profile]):
+        """Ghi profile vào cache (None = không có profile, cache với TTL ngắn)"""
+        now = time.monotonic()
+        ttl = self.ttl if profile is not None else self.negative_ttl
+        self._entries[user_id] = _Entry(profile, now, now + ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def invalidate(self, user_id: str):
+        """Bỏ entry của user; lần tải đang chạy (nếu có) không được ghi vào cache nữa"""
+        self._entries.pop(user_id, None)
+        self._inflight.pop(user_id, None)
+
+    async def display_name(self, user_id: str, zalo_user_id: Optional[str] = None,
+                           fallback: Optional[str] = None) -> Optional[str]:
+        """Tên hiển thị của người dùng từ profile; dùng `fallback` (tên trong payload) nếu không có"""
+        profile = await self.get(user_id, zalo_user_id)
+        return (profile or {}).get("display_name") or fallback
+
+    def peek_display_name(self, user_id: str, zalo_user_id: Optional[str] = None,
+                          fallback: Optional[str] = None) -> Optional[str]:
+        """
+        Như `display_name` nhưng không bao giờ chờ loader (dùng trong lane xử lý event)
+
+        Entry hết hạn vẫn được dùng tạm, không có entry thì dùng `fallback`; profile được
+        tải lại ở nền cho các lần sau.
+        """
+        now = time.monotonic()
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self._count("miss")
+            self._load(user_id, zalo_user_id)
+        elif now >= entry.expires_at or (
+            entry.profile is not None
+            and now - entry.loaded_at >= (entry.expires_at - entry.loaded_at) * self.refresh_after
+        ):
+            self._count("stale")
+            self._load(user_id, zalo_user_id)
+        else:
+            self._entries.move_to_end(user_id)
+            self._count("hit" if entry.profile is not None else "negative_hit")
+        profile = entry.profile if entry is not None else None
+        return (profile or {}).get("display_name") or fallback
+
+    async def close(self):
+        tasks = list(self._inflight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê cache của worker này"""
+        lookups = sum(self._counts.values())
+        served = self._counts["hit"] + self._counts["negative_hit"] + self._counts["stale"]
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hit_ratio": round(served / lookups, 4) if lookups else 0.0,
+            **self._counts,
+            "load_errors": self._load_errors,
+            "evictions": self._evictions,
+        }
+
+
+# Mã lỗi Zalo khi người dùng không tồn tại / chưa tương tác với OA: kết quả chắc chắn
+_PROFILE_NOT_FOUND_CODES = {-213, -201}
+
+
+async def load_zalo_profile(user_id: str, zalo_user_id: Optional[str]) -> Optional[Profile]:
+    """Loader mặc định: API thông tin người dùng của OA (cần access token)"""
+    if not zalo_client.enabled:
+        return None
+    try:
+        body = await zalo_client.request(
+            "GET",
+            "/v3.0/oa/user/detail",
+            params={"data": json.dumps({"user_id": zalo_user_id or user_id})},
+        )
+    except ZaloAPIError as e:
+        if e.error_code in _PROFILE_NOT_FOUND_CODES:
+            return None
+        raise
+    data = body.get("data") or {}
+    return {
+        "user_id": data.get("user_id"),
+        "display_name": data.get("display_name"),
+        "avatar": data.get("avatar"),
+        "is_follower": data.get("user_is_follower"),
+    }
+
+
+# Cache dùng chung cho MessageHandler và UserActionHandler
+profile_cache = ProfileCache.from_settings(load_zalo_profile)
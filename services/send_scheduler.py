@@ -0,0 +1,307 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from config import settings
+from monitoring.metrics import SEND_QUEUE_WAIT_SECONDS
+from services.zalo_client import ZaloAPIError, ZaloClient, zalo_client
+
+logger = logging.getLogger(__name__)
+
+# Lớp ưu tiên (số nhỏ được gửi trước)
+PRIORITY_INTERACTIVE = 0    # trả lời người dùng vừa nhắn tin
+PRIORITY_TRANSACTIONAL = 1  # chào mừng khi follow, xác nhận form / đơn hàng
+PRIORITY_BULK = 2           # thông báo hàng loạt
+PRIORITY_NAMES = ("interactive", "transactional", "bulk")
+
+# Số lần gửi lại tối đa một tin khi bị Zalo báo vượt quota
+_MAX_THROTTLE_RETRIES = 5
+# Chu kỳ (giây) cập nhật phần quota của worker theo số worker đang sống
+_SHARE_REFRESH_SECONDS = 5.0
+
+
+class _SendItem:
+    __slots__ = ("user_id", "text", "priority", "enqueued_at", "future", "throttled")
+
+    def __init__(self, user_id: str, text: str, priority: int, future: asyncio.Future):
+        self.user_id = user_id
+        self.text = text
+        self.priority = priority
+        self.enqueued_at = time.perf_counter()
+        self.future = future
+        self.throttled = 0
+
+
+class _QuotaBucket:
+    """
+    Token bucket của một OA với tốc độ tự điều chỉnh (AIMD)
+
+    Bắt đầu ở tốc độ cấu hình; mỗi lần Zalo báo vượt quota thì giảm một nửa và tạm dừng
+    theo Retry-After, mỗi lần gửi thành công thì tăng dần trở lại tới tốc độ cấu hình.
+    Nhờ vậy scheduler bám sát quota thực tế mà không liên tục nhận 429.
+    """
+
+    def __init__(self, key: str, rate: float, burst: int, queue_size: int):
+        self.key = key
+        self.max_rate = rate
+        self.min_rate = rate / 16
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+        self.queue_size = queue_size
+        self.queues: Tuple[Deque[_SendItem], ...] = tuple(deque() for _ in PRIORITY_NAMES)
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+        # Statistics
+        self.throttled = 0
+
+    def pending(self) -> int:
+        return sum(len(queue) for queue in self.queues)
+
+    def pop(self) -> _SendItem:
+        for queue in self.queues:
+            if queue:
+                return queue.popleft()
+        raise IndexError("bucket is empty")
+
+    def wait_time(self) -> float:
+        """Thời gian (giây) tới khi có token; 0 nếu lấy được ngay"""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1.0
+
+    def set_max_rate(self, rate: float):
+        """Đổi tốc độ tối đa (số worker thay đổi), giữ nguyên mức giảm hiện tại"""
+        if rate != self.max_rate:
+            self.rate = self.rate * rate / self.max_rate
+            self.max_rate = rate
+            self.min_rate = rate / 16
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            # Tăng tuyến tính: từ một nửa trở về tốc độ tối đa sau 16 lần gửi thành công
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 32)
+
+    def on_throttled(self, retry_after: Optional[float]):
+        self.throttled += 1
+        now = time.monotonic()
+        # Các request đang bay cùng lúc bị từ chối chỉ tính là một lần vượt quota
+        if now >= self.paused_until:
+            self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, now + (retry_after or 1.0 / self.rate))
+
+
+class SendScheduler:
+    """
+    Hàng đợi gửi tin ra Zalo theo quota của từng OA và theo độ ưu tiên
+
+    Mỗi OA có một token bucket và ba hàng đợi (interactive, transactional, bulk) có giới
+    hạn; một task riêng của OA lấy token rồi gửi tin có độ ưu tiên cao nhất đang chờ, nên
+    tin trả lời người dùng luôn đi trước tin chào mừng và thông báo hàng loạt. Tin bị
+    Zalo từ chối vì vượt quota được đưa lại đầu hàng đợi của nó.
+
+    Quota là của OA chứ không phải của process: khi có `worker_count`, mỗi worker chỉ
+    dùng phần `rate_per_second / số worker đang sống`.
+    """
+
+    def __init__(
+        self,
+        client: ZaloClient,
+        rate_per_second: float = 10,
+        burst: int = 10,
+        queue_size: int = 1000,
+        default_key: str = "default",
+    ):
+        self.client = client
+        self.rate = max(0.001, rate_per_second)
+        self.burst = burst or max(1, int(self.rate))
+        self.queue_size = max(1, queue_size)
+        self.default_key = default_key
+        self._buckets: Dict[str, _QuotaBucket] = {}
+        self._sends: set = set()
+        self._closing = False
+        self.worker_count: Optional[Callable[[], int]] = None
+        self._share_checked = 0.0
+
+        # Statistics (theo độ ưu tiên)
+        self._sent = [0] * len(PRIORITY_NAMES)
+        self._failed = [0] * len(PRIORITY_NAMES)
+        self._rejected = [0] * len(PRIORITY_NAMES)
+        self._dispatched = [0] * len(PRIORITY_NAMES)
+        self._wait_time = [0.0] * len(PRIORITY_NAMES)
+
+    @classmethod
+    def from_settings(cls, client: ZaloClient) -> "SendScheduler":
+        """Tạo scheduler theo cấu hình OUTBOUND_QUOTA_* / OUTBOUND_SEND_QUEUE_SIZE"""
+        return cls(
+            client,
+            rate_per_second=settings.OUTBOUND_QUOTA_PER_SECOND,
+            burst=settings.OUTBOUND_QUOTA_BURST,
+            queue_size=settings.OUTBOUND_SEND_QUEUE_SIZE,
+            default_key=settings.ZALO_OA_ID or settings.ZALO_APP_ID or "default",
+        )
+
+    def _bucket(self, key: str) -> _QuotaBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = _QuotaBucket(key, self.rate, self.burst, self.queue_size)
+            self._buckets[key] = bucket
+        if bucket.task is None or bucket.task.done():
+            bucket.task = asyncio.create_task(self._run(bucket))
+        return bucket
+
+    def enqueue(
+        self,
+        user_id: str,
+        text: str,
+        priority: int = PRIORITY_INTERACTIVE,
+        oa_key: Optional[str] = None,
+    ) -> Optional[asyncio.Future]:
+        """
+        Đưa tin nhắn vào hàng đợi của OA `oa_key` (mặc định là OA đã cấu hình)
+
+        Returns:
+            Optional[asyncio.Future]: kết quả gửi (True/False) khi tin được gửi xong;
+            None nếu hàng đợi của độ ưu tiên này đã đầy hoặc scheduler đang dừng
+        """
+        if self._closing:
+            self._rejected[priority] += 1
+            return None
+        bucket = self._bucket(oa_key or self.default_key)
+        queue = bucket.queues[priority]
+        if len(queue) >= bucket.queue_size:
+            self._rejected[priority] += 1
+            logger.warning("Send queue '%s' full for %s, dropping message to %s",
+                           PRIORITY_NAMES[priority], bucket.key, user_id)
+            return None
+        future = asyncio.get_running_loop().create_future()
+        queue.append(_SendItem(user_id, text, priority, future))
+        bucket.wakeup.set()
+        return future
+
+    def _refresh_share(self):
+        """Chia quota cho số worker đang sống (kiểm tra tối đa mỗi _SHARE_REFRESH_SECONDS)"""
+        now = time.monotonic()
+        if self.worker_count is None or now - self._share_checked < _SHARE_REFRESH_SECONDS:
+            return
+        self._share_checked = now
+        try:
+            workers = max(1, self.worker_count())
+        except Exception as e:
+            logger.error("Failed to count workers for send quota: %s", e)
+            return
+        for bucket in self._buckets.values():
+            bucket.set_max_rate(self.rate / workers)
+
+    async def _run(self, bucket: _QuotaBucket):
+        """Vòng gửi của một OA: chờ token rồi mới chọn tin ưu tiên cao nhất"""
+        while True:
+            if not bucket.pending():
+                bucket.wakeup.clear()
+                await bucket.wakeup.wait()
+                continue
+            self._refresh_share()
+            delay = bucket.wait_time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            bucket.take()
+            item = bucket.pop()
+            wait = time.perf_counter() - item.enqueued_at
+            self._dispatched[item.priority] += 1
+            self._wait_time[item.priority] += wait
+            SEND_QUEUE_WAIT_SECONDS.observe(wait, PRIORITY_NAMES[item.priority])
+            task = asyncio.create_task(self._send(bucket, item))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    async def _send(self, bucket: _QuotaBucket, item: _SendItem):
+        try:
+            await self.client.send_text(item.user_id, item.text, retry_throttled=False)
+        except ZaloAPIError as e:
+            if e.throttled and item.throttled < _MAX_THROTTLE_RETRIES and not self._closing:
+                item.throttled += 1
+                bucket.on_throttled(e.retry_after)
+                bucket.queues[item.priority].appendleft(item)
+                bucket.wakeup.set()
+                logger.warning("OA %s throttled by Zalo, send rate lowered to %.2f/s", bucket.key, bucket.rate)
+                return
+            self._complete(item, False, e)
+            return
+        except Exception as e:
+            self._complete(item, False, e)
+            return
+        bucket.on_success()
+        self._complete(item, True)
+
+    def _complete(self, item: _SendItem, ok: bool, error: Optional[Exception] = None):
+        if ok:
+            self._sent[item.priority] += 1
+        else:
+            self._failed[item.priority] += 1
+            logger.error("Error sending message to %s: %s", item.user_id, error)
+        if not item.future.done():
+            item.future.set_result(ok)
+
+    async def close(self, timeout: float = 5.0):
+        """Chờ gửi nốt hàng đợi trong tối đa `timeout` giây rồi dừng; tin còn lại bị bỏ"""
+        self._closing = True
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and (
+            self._sends or any(bucket.pending() for bucket in self._buckets.values())
+        ):
+            await asyncio.sleep(0.05)
+
+        for bucket in self._buckets.values():
+            if bucket.task is not None:
+                bucket.task.cancel()
+            for queue in bucket.queues:
+                while queue:
+                    self._complete(queue.popleft(), False, RuntimeError("send scheduler stopped"))
+        tasks = [bucket.task for bucket in self._buckets.values() if bucket.task is not None]
+        tasks.extend(self._sends)
+        for task in self._sends:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê hàng đợi gửi tin theo độ ưu tiên và theo OA"""
+        priorities: Dict[str, Any] = {}
+        for index, name in enumerate(PRIORITY_NAMES):
+            dispatched = self._dispatched[index]
+            priorities[name] = {
+                "queued": sum(len(bucket.queues[index]) for bucket in self._buckets.values()),
+                "sent": self._sent[index],
+                "failed": self._failed[index],
+                "rejected": self._rejected[index],
+                "avg_queue_wait_ms": round(self._wait_time[index] / dispatched * 1000, 3) if dispatched else 0.0,
+            }
+        buckets: List[Dict[str, Any]] = [
+            {
+                "oa": bucket.key,
+                "rate_per_second": round(bucket.rate, 3),
+                "max_rate_per_second": bucket.max_rate,
+                "throttled": bucket.throttled,
+            }
+            for bucket in self._buckets.values()
+        ]
+        return {"in_flight": len(self._sends), "priorities": priorities, "quota": buckets}
+
+
+# Scheduler dùng chung cho toàn bộ ứng dụng
+send_scheduler = SendScheduler.from_settings(zalo_client)
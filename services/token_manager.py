@@ -0,0 +1,304 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from config import settings
+from services.zalo_client import ZaloClient, zalo_client
+
+logger = logging.getLogger(__name__)
+
+# Refresh token của Zalo chỉ dùng được một lần; khi làm mới thất bại thì thử lại sau
+_RETRY_SECONDS = 30.0
+# Khoảng cách tối thiểu giữa hai lần làm mới chủ động (token sống ngắn hơn refresh_margin)
+_MIN_REFRESH_SECONDS = 60.0
+
+
+class TokenRefreshError(Exception):
+    """Không làm mới được access token của OA"""
+
+
+class OATokenManager:
+    """
+    Quản lý access token của OA (OAuth v4: đổi refresh token lấy access token mới)
+
+    - Token được cache trong bộ nhớ; một task nền làm mới trước khi hết hạn
+      (`refresh_margin` giây), nên request thường không phải chờ làm mới
+    - Single flight: mọi caller cần token mới cùng chờ một lần làm mới duy nhất
+    - Khi có `store_path`, token được lưu ra file (ghi nguyên tử, quyền 0600) và việc
+      làm mới được khóa bằng flock trên file đó: refresh token chỉ dùng được một lần,
+      nên chỉ một worker được đổi token, các worker khác đọc lại token từ file
+    """
+
+    def __init__(
+        self,
+        client: ZaloClient,
+        app_id: Optional[str],
+        secret_key: Optional[str],
+        refresh_token: Optional[str] = None,
+        access_token: Optional[str] = None,
+        oauth_url: str = "https://oauth.zaloapp.com/v4/oa/access_token",
+        store_path: Optional[str] = None,
+        refresh_margin: float = 300,
+    ):
+        self.client = client
+        self.app_id = app_id
+        self.secret_key = secret_key
+        self.oauth_url = oauth_url
+        self.store_path = store_path or None
+        self.refresh_margin = refresh_margin
+
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        # Token cấu hình sẵn không rõ hạn: dùng cho tới khi Zalo báo không hợp lệ
+        self.expires_at = float("inf") if access_token else 0.0
+        self._rejected_token: Optional[str] = None
+        self._refreshed_at = 0.0
+
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._background: Optional[asyncio.Task] = None
+
+        # Statistics
+        self._refreshes = 0
+        self._refresh_failures = 0
+        self._coalesced = 0
+
+        self._load()
+
+    @classmethod
+    def from_settings(cls, client: ZaloClient) -> "OATokenManager":
+        """Tạo token manager theo cấu hình ZALO_APP_* / ZALO_OA_* / ZALO_TOKEN_*"""
+        return cls(
+            client,
+            app_id=settings.ZALO_APP_ID,
+            secret_key=settings.ZALO_APP_SECRET_KEY,
+            refresh_token=settings.ZALO_OA_REFRESH_TOKEN,
+            access_token=settings.ZALO_OA_ACCESS_TOKEN,
+            oauth_url=settings.ZALO_OAUTH_URL,
+            store_path=settings.ZALO_TOKEN_STORE_PATH,
+            refresh_margin=settings.ZALO_TOKEN_REFRESH_MARGIN_SECONDS,
+        )
+
+    @property
+    def can_refresh(self) -> bool:
+        return bool(self.app_id and self.secret_key and self.refresh_token)
+
+    @property
+    def enabled(self) -> bool:
+        """Có access token hoặc có thể lấy access token"""
+        return bool(self.access_token) or self.can_refresh
+
+    # Lưu trữ
+
+    def _load(self) -> bool:
+        """
+        Đọc token từ file
+
+        Refresh token trong file luôn được dùng (token cũ đã bị Zalo thu hồi khi đổi);
+        access token chỉ được nhận nếu còn hạn lâu hơn token đang có, hoặc token đang có
+        là token cấu hình sẵn không rõ hạn.
+        """
+        if not self.store_path:
+            return False
+        try:
+            with open(self.store_path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.error("Failed to read token store %s: %s", self.store_path, e)
+            return False
+        self.refresh_token = stored.get("refresh_token") or self.refresh_token
+        expires_at = float(stored.get("expires_at") or 0)
+        if (
+            not stored.get("access_token")
+            or stored["access_token"] == self._rejected_token
+            or (self.access_token and self.expires_at != float("inf") and expires_at <= self.expires_at)
+        ):
+            return False
+        self.access_token = stored["access_token"]
+        self.expires_at = expires_at
+        return True
+
+    def _save(self):
+        if not self.store_path:
+            return
+        tmp_path = f"{self.store_path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "access_token": self.access_token,
+                    "refresh_token": self.refresh_token,
+                    "expires_at": self.expires_at,
+                },
+                f,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.store_path)
+
+    async def _lock_store(self) -> Optional[int]:
+        """Khóa flock file `<store_path>.lock` mà không block event loop"""
+        if not self.store_path:
+            return None
+        fd = os.open(self.store_path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                await asyncio.sleep(0.05)
+
+    # Làm mới
+
+    def _next_refresh_at(self) -> float:
+        """Thời điểm nên làm mới chủ động (không sớm hơn _MIN_REFRESH_SECONDS sau lần trước)"""
+        return max(self.expires_at - self.refresh_margin, self._refreshed_at + _MIN_REFRESH_SECONDS)
+
+    def _needs_refresh(self) -> bool:
+        return not self.access_token or time.time() >= self._next_refresh_at()
+
+    async def get_token(self) -> Optional[str]:
+        """
+        Access token còn hạn; chỉ chờ làm mới khi token đã hết hạn (hoặc chưa có)
+
+        Raises:
+            TokenRefreshError: không có token còn hạn và làm mới thất bại
+        """
+        if self.access_token and time.time() < self.expires_at:
+            if self._needs_refresh() and self.can_refresh:
+                # Sắp hết hạn: làm mới nền, vẫn dùng token hiện tại
+                self._start_refresh()
+            return self.access_token
+        if not self.can_refresh:
+            return self.access_token
+        return await self.refresh()
+
+    def invalidate(self, token: Optional[str]):
+        """Zalo báo `token` không hợp lệ: lần lấy token sau sẽ làm mới"""
+        if token and token == self.access_token:
+            self._rejected_token = token
+            self.access_token = None
+            self.expires_at = 0.0
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._do_refresh())
+            self._refresh_task.add_done_callback(self._log_refresh_result)
+        else:
+            self._coalesced += 1
+        return self._refresh_task
+
+    @staticmethod
+    def _log_refresh_result(task: asyncio.Task):
+        # Lần làm mới nền có thể không có ai chờ kết quả
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("%s", task.exception())
+
+    async def refresh(self) -> str:
+        """Làm mới access token (các caller đồng thời dùng chung một lần làm mới)"""
+        # shield: một caller bị hủy không làm hủy lần làm mới của các caller khác
+        return await asyncio.shield(self._start_refresh())
+
+    async def _do_refresh(self) -> str:
+        lock_fd = await self._lock_store()
+        try:
+            # Worker khác có thể vừa làm mới xong trong lúc chờ khóa
+            if self._load() and not self._needs_refresh():
+                return self.access_token
+            if not self.can_refresh:
+                raise TokenRefreshError("ZALO_APP_ID, ZALO_APP_SECRET_KEY and ZALO_OA_REFRESH_TOKEN are required")
+            try:
+                body = await self.client.request(
+                    "POST",
+                    self.oauth_url,
+                    data={
+                        "refresh_token": self.refresh_token,
+                        "app_id": self.app_id,
+                        "grant_type": "refresh_token",
+                    },
+                    headers={"secret_key": self.secret_key},
+                    authenticated=False,
+                    # Refresh token chỉ dùng được một lần: không tự gửi lại khi chưa rõ
+                    # Zalo đã đổi token hay chưa (vòng làm mới sẽ thử lại sau)
+                    max_retries=0,
+                )
+                access_token = body["access_token"]
+                expires_in = float(body.get("expires_in") or 0)
+            except Exception as e:
+                self._refresh_failures += 1
+                raise TokenRefreshError(f"Failed to refresh OA access token: {e}") from e
+
+            if expires_in <= 0:
+                # Refresh token cũ đã bị thu hồi: vẫn giữ refresh token mới, nhưng không
+                # dùng access token không rõ hạn (vòng làm mới sẽ thử lại sau)
+                self._refresh_failures += 1
+                self.refresh_token = body.get("refresh_token") or self.refresh_token
+                try:
+                    self._save()
+                except OSError as e:
+                    logger.error("Failed to persist OA token to %s: %s", self.store_path, e)
+                raise TokenRefreshError(f"Zalo returned invalid expires_in {body.get('expires_in')!r}")
+
+            self.access_token = access_token
+            self.refresh_token = body.get("refresh_token") or self.refresh_token
+            self.expires_at = time.time() + expires_in
+            self._refreshed_at = time.time()
+            self._refreshes += 1
+            try:
+                self._save()
+            except OSError as e:
+                logger.error("Failed to persist OA token to %s: %s", self.store_path, e)
+            logger.info("OA access token refreshed, expires in %.0fs", expires_in)
+            return self.access_token
+        finally:
+            if lock_fd is not None:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+                os.close(lock_fd)
+
+    async def _refresh_loop(self):
+        """Làm mới token trước khi hết hạn `refresh_margin` giây"""
+        while True:
+            delay = self._next_refresh_at() - time.time()
+            if delay > 0:
+                await asyncio.sleep(min(delay, 3600))
+                continue
+            try:
+                await self.refresh()
+            except TokenRefreshError:
+                # Lỗi đã được log trong _log_refresh_result
+                await asyncio.sleep(_RETRY_SECONDS)
+
+    async def start(self):
+        """Bắt đầu task làm mới nền (chỉ khi có refresh token)"""
+        if self.can_refresh and self._background is None:
+            self._background = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        tasks = [task for task in (self._background, self._refresh_task) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._background = None
+        self._refresh_task = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê token (không bao giờ trả về token)"""
+        return {
+            "has_token": bool(self.access_token),
+            "expires_in": (
+                None if self.expires_at == float("inf") or not self.access_token
+                else round(self.expires_at - time.time())
+            ),
+            "refreshes": self._refreshes,
+            "refresh_failures": self._refresh_failures,
+            "coalesced_waiters": self._coalesced,
+        }
+
+
+# Token manager dùng chung (được gắn vào zalo_client khi có refresh token)
+token_manager = OATokenManager.from_settings(zalo_client)
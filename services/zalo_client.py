@@ -0,0 +1,310 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from config import settings
+from monitoring.metrics import OUTBOUND_SECONDS
+
+try:
+    import h2  # noqa: F401  (httpx cần gói h2 để dùng HTTP/2)
+except ImportError:  # h2 là optional
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+# Mã HTTP nên thử lại (Zalo quá tải / giới hạn tốc độ)
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+# Request không idempotent (POST): chỉ thử lại khi chắc chắn Zalo chưa xử lý
+_UNSAFE_RETRY_STATUS = {429, 503}
+_UNSAFE_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# Mã lỗi Zalo khi vượt quota gọi API của OA/app
+_QUOTA_ERROR_CODES = {-32}
+# Mã lỗi Zalo khi access token không hợp lệ / đã hết hạn
+_TOKEN_ERROR_CODES = {-124, -216}
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Header Retry-After dạng số giây (dạng HTTP date không được Zalo dùng)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class ZaloAPIError(Exception):
+    """Zalo trả về lỗi (HTTP lỗi hoặc field `error` khác 0)"""
+
+    def __init__(self, message: str, status_code: int = 0, error_code: int = 0,
+                 retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_code = error_code
+        self.retry_after = retry_after
+
+    @property
+    def throttled(self) -> bool:
+        """Lỗi do vượt quota / giới hạn tốc độ (nên gửi lại sau)"""
+        return self.status_code == 429 or self.error_code in _QUOTA_ERROR_CODES
+
+
+class ZaloClient:
+    """
+    Client gọi ra ngoài (Zalo OpenAPI) dùng chung cho mọi handler
+
+    - Một `httpx.AsyncClient` duy nhất: giữ kết nối keep-alive trong pool, HTTP/2 khi
+      có gói `h2` (nhiều request trên một kết nối)
+    - Giới hạn số request đồng thời toàn cục (semaphore)
+    - Timeout cho từng request; thử lại lỗi mạng / 429 / 5xx với backoff lũy thừa có
+      jitter ngẫu nhiên (tôn trọng header Retry-After). Request không idempotent (POST
+      gửi tin) chỉ được thử lại khi chưa tới được Zalo (lỗi kết nối) hoặc bị 429 / 503,
+      để timeout / 5xx không làm tin nhắn bị gửi hai lần
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        access_token: Optional[str] = None,
+        http2: bool = False,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+        keepalive_expiry: float = 30.0,
+        max_concurrency: int = 50,
+        timeout: float = 10.0,
+        connect_timeout: float = 5.0,
+        max_retries: int = 3,
+        backoff_base_ms: float = 200,
+        backoff_max_ms: float = 5000,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.http2 = http2 and h2 is not None
+        if http2 and h2 is None:
+            logger.warning("HTTP/2 requested but h2 is not installed, using HTTP/1.1")
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base_ms / 1000.0
+        self.backoff_max = backoff_max_ms / 1000.0
+
+        # Access token cố định, hoặc token manager (get_token/invalidate) nếu được gắn vào
+        self._static_token = access_token
+        self.token_manager = None
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # Statistics
+        self._requests = 0
+        self._retries = 0
+        self._failures = 0
+        self._in_flight = 0
+        self._total_time = 0.0
+
+    @classmethod
+    def from_settings(cls) -> "ZaloClient":
+        """Tạo client theo cấu hình ZALO_API_* / OUTBOUND_*"""
+        return cls(
+            settings.ZALO_API_BASE_URL,
+            access_token=settings.ZALO_OA_ACCESS_TOKEN,
+            http2=settings.OUTBOUND_HTTP2,
+            max_connections=settings.OUTBOUND_MAX_CONNECTIONS,
+            max_keepalive=settings.OUTBOUND_MAX_KEEPALIVE,
+            keepalive_expiry=settings.OUTBOUND_KEEPALIVE_EXPIRY,
+            max_concurrency=settings.OUTBOUND_MAX_CONCURRENCY,
+            timeout=settings.OUTBOUND_TIMEOUT_SECONDS,
+            connect_timeout=settings.OUTBOUND_CONNECT_TIMEOUT_SECONDS,
+            max_retries=settings.OUTBOUND_MAX_RETRIES,
+            backoff_base_ms=settings.OUTBOUND_BACKOFF_BASE_MS,
+            backoff_max_ms=settings.OUTBOUND_BACKOFF_MAX_MS,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        """Có thông tin xác thực để gọi Zalo API không"""
+        return bool(self._static_token) or self.token_manager is not None
+
+    async def start(self):
+        """Tạo connection pool"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=self.http2,
+                limits=self.limits,
+                timeout=self.timeout,
+            )
+
+    async def close(self):
+        """Đóng các kết nối trong pool"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _access_token(self) -> Optional[str]:
+        if self.token_manager is not None:
+            return await self.token_manager.get_token()
+        return self._static_token
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Thời gian chờ trước lần thử lại thứ `attempt` (full jitter)"""
+        delay = _parse_retry_after(retry_after)
+        if delay is not None:
+            return min(self.backoff_max, delay)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        json: Any = None,
+        data: Optional[Dict[str, Any]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        authenticated: bool = True,
+        retry_throttled: bool = True,
+        max_retries: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Gửi request tới Zalo API và trả về JSON response
+
+        `path` có thể là URL tuyệt đối (ví dụ endpoint OAuth). `retry_throttled=False`:
+        không tự thử lại khi bị 429 mà ném ZaloAPIError ngay (kèm retry_after) để bên
+        gọi (send scheduler) tự điều chỉnh tốc độ. Khi Zalo báo access token không hợp
+        lệ và có token manager, token được làm mới và request được gửi lại một lần.
+        `max_retries` ghi đè số lần thử lại mặc định của client (0 = không thử lại).
+
+        Raises:
+            ZaloAPIError: HTTP lỗi (sau khi hết lượt thử lại) hoặc `error` khác 0
+            httpx.HTTPError: lỗi mạng / timeout sau khi hết lượt thử lại
+        """
+        if self._client is None:
+            await self.start()
+        request_headers = dict(headers or {})
+        token = None
+        if authenticated:
+            token = await self._access_token()
+            if token:
+                request_headers["access_token"] = token
+        kwargs = {"json": json, "data": data, "params": params}
+        retries = self.max_retries if max_retries is None else max(0, max_retries)
+
+        try:
+            return await self._send(method, path, request_headers, retry_throttled, retries, kwargs)
+        except ZaloAPIError as e:
+            if not (token and self.token_manager is not None and e.error_code in _TOKEN_ERROR_CODES):
+                raise
+            logger.warning("Access token rejected by Zalo (%s), refreshing", e.error_code)
+            self.token_manager.invalidate(token)
+            request_headers["access_token"] = await self._access_token()
+            return await self._send(method, path, request_headers, retry_throttled, retries, kwargs)
+
+    async def _send(
+        self,
+        method: str,
+        path: str,
+        request_headers: Dict[str, str],
+        retry_throttled: bool,
+        max_retries: int,
+        kwargs: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """Gửi một request (kèm các lần thử lại) và kiểm tra kết quả"""
+        idempotent = method.upper() in _IDEMPOTENT_METHODS
+        retry_status = _RETRY_STATUS if idempotent else _UNSAFE_RETRY_STATUS
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            outcome = "error"
+            retry_after = None
+            try:
+                async with self._semaphore:
+                    self._in_flight += 1
+                    try:
+                        response = await self._client.request(
+                            method, path, headers=request_headers, **kwargs
+                        )
+                    finally:
+                        self._in_flight -= 1
+                outcome = str(response.status_code)
+                if response.status_code not in retry_status:
+                    break
+                retry_after = response.headers.get("retry-after")
+                error: Exception = ZaloAPIError(
+                    f"Zalo API returned HTTP {response.status_code}",
+                    status_code=response.status_code,
+                    retry_after=_parse_retry_after(retry_after),
+                )
+                if response.status_code == 429 and not retry_throttled:
+                    self._failures += 1
+                    raise error
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                if not idempotent and not isinstance(e, _UNSAFE_RETRY_ERRORS):
+                    # Request có thể đã tới Zalo: không gửi lại
+                    self._failures += 1
+                    raise
+                error = e
+            finally:
+                elapsed = time.perf_counter() - started
+                self._requests += 1
+                self._total_time += elapsed
+                OUTBOUND_SECONDS.observe(elapsed, path, outcome)
+
+            if attempt >= max_retries:
+                self._failures += 1
+                raise error
+            delay = self._backoff(attempt, retry_after)
+            attempt += 1
+            self._retries += 1
+            logger.warning("Retrying %s %s in %.2fs (attempt %d): %s", method, path, delay, attempt, error)
+            await asyncio.sleep(delay)
+
+        if response.status_code >= 400:
+            self._failures += 1
+            raise ZaloAPIError(
+                f"Zalo API returned HTTP {response.status_code}: {response.text[:200]}",
+                status_code=response.status_code,
+            )
+        body = response.json()
+        if isinstance(body, dict) and body.get("error", 0) != 0:
+            self._failures += 1
+            raise ZaloAPIError(
+                f"Zalo API error {body.get('error')}: "
+                f"{body.get('message') or body.get('error_description') or body.get('error_name')}",
+                status_code=response.status_code,
+                error_code=body.get("error"),
+            )
+        return body
+
+    async def send_text(self, user_id: str, text: str, retry_throttled: bool = True) -> Dict[str, Any]:
+        """Gửi tin nhắn văn bản (tin tư vấn) tới người dùng"""
+        return await self.request(
+            "POST",
+            "/v3.0/oa/message/cs",
+            json={"recipient": {"user_id": user_id}, "message": {"text": text}},
+            retry_throttled=retry_throttled,
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê request ra ngoài của worker này"""
+        return {
+            "http2": self.http2,
+            "requests": self._requests,
+            "retries": self._retries,
+            "failures": self._failures,
+            "in_flight": self._in_flight,
+            "avg_request_ms": round(self._total_time / self._requests * 1000, 3) if self._requests else 0.0,
+        }
+
+
+# Client dùng chung cho toàn bộ ứng dụng
+zalo_client = ZaloClient.from_settings()
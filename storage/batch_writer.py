@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Table, insert
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.sql import Executable
+
+from monitoring.metrics import DB_COMMIT_SECONDS, DB_ROWS
+from pipeline.completion import hold_current
+
+logger = logging.getLogger(__name__)
+
+# Row đang chờ ghi + callback gọi sau khi row đã commit
+_Entry = Tuple[Dict[str, Any], Optional[Callable[[], None]]]
+
+_RETRY_BASE_SECONDS = 0.2
+_RETRY_MAX_SECONDS = 10.0
+# Khi đang tắt: số lần thử tối đa với lỗi tạm thời (row còn lại được replay từ journal)
+_CLOSE_ATTEMPTS = 3
+# SQLSTATE của lỗi tạm thời: kết nối (08), serialization/deadlock (40),
+# thiếu tài nguyên (53), server đang tắt (57P)
+_TRANSIENT_SQLSTATES = ("08", "40", "53", "57P")
+
+
+def _is_transient(error: Exception) -> bool:
+    """Lỗi có thể hết khi thử lại (khác với row không hợp lệ)"""
+    if isinstance(error, (PoolTimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, DBAPIError):
+        if error.connection_invalidated:
+            return True
+        sqlstate = getattr(error.orig, "sqlstate", None) or getattr(error.orig, "pgcode", None)
+        if sqlstate:
+            return str(sqlstate).startswith(_TRANSIENT_SQLSTATES)
+        return isinstance(error, (OperationalError, InterfaceError))
+    return isinstance(error, OSError)
+
+
+def _run_callbacks(entries: List[Tuple[Dict[str, Any], List[Callable[[], None]]]]):
+    for _, callbacks in entries:
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error("Batch commit callback failed: %s", e)
+
+
+class BatchWriter:
+    """
+    Background writer gom các row cần insert rồi ghi theo lô (group commit).
+
+    Row được gom tối đa `max_delay_ms` hoặc tới khi đủ `max_rows`, sau đó mỗi bảng được
+    ghi bằng một câu INSERT nhiều row (executemany -> insertmanyvalues) trong một
+    transaction, thay vì một session + một commit cho mỗi row. Callback `on_commit` của
+    row chỉ chạy sau khi transaction chứa row đó đã commit.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        max_rows: int = 500,
+        max_delay_ms: float = 50.0,
+        max_pending: int = 10000,
+    ):
+        self.session_factory = session_factory
+        self.max_rows = max(1, max_rows)
+        self.max_delay = max_delay_ms / 1000.0
+        self.max_pending = max(self.max_rows, max_pending)
+
+        # Các row đang chờ ghi, theo từng bảng
+        self._buffers: Dict[Table, List[_Entry]] = {}
+        # Câu lệnh insert riêng cho từng bảng (ví dụ ON CONFLICT), mặc định là insert(table)
+        self._statements: Dict[Table, Executable] = {}
+        # Cột khóa của bảng upsert: trong một lô chỉ giữ row cuối cùng của mỗi khóa
+        self._coalesce_keys: Dict[Table, Tuple[str, ...]] = {}
+        self._pending = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # Statistics
+        self._batches = 0
+        self._rows_written = 0
+        self._rows_failed = 0
+        self._rows_rejected = 0
+        self._retries = 0
+        self._max_batch = 0
+        self._flush_time = 0.0
+        self._last_flush_ms = 0.0
+
+    async def start(self):
+        """Bắt đầu background flusher"""
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Condition()
+        self._closing = False
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Ghi nốt các row còn trong buffer rồi dừng flusher"""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    def register_statement(self, table: Table, statement: Executable, key: Optional[Sequence[str]] = None):
+        """
+        Dùng câu lệnh riêng (ví dụ INSERT ... ON CONFLICT) khi ghi lô cho bảng này
+
+        Với `ON CONFLICT DO UPDATE`, truyền `key` (các cột của unique constraint): một câu
+        lệnh không được cập nhật cùng một row hai lần, nên các row trùng khóa trong lô
+        được gộp lại, row thêm vào sau cùng thắng.
+        """
+        self._statements[table] = statement
+        if key:
+            self._coalesce_keys[table] = tuple(key)
+
+    async def add(self, table: Table, row: Dict[str, Any], on_commit: Optional[Callable[[], None]] = None):
+        """
+        Đưa một row vào buffer để ghi theo lô
+
+        Chờ nếu buffer đã đầy (backpressure khi database chậm hơn tốc độ nhận event).
+        Nếu writer chưa chạy thì ghi trực tiếp.
+
+        `on_commit` được gọi sau khi row đã commit (hoặc bị database từ chối hẳn); mặc định
+        giữ event đang xử lý (pipeline.completion) chưa hoàn tất cho tới lúc đó.
+        """
+        if on_commit is None:
+            on_commit = hold_current()
+        if self._task is None or self._closing:
+            await self._write({table: [(row, on_commit)]})
+            return
+
+        if self._pending >= self.max_pending:
+            async with self._space:
+                await self._space.wait_for(lambda: self._pending < self.max_pending)
+
+        self._buffers.setdefault(table, []).append((row, on_commit))
+        self._pending += 1
+        self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            # Gom thêm row cho tới khi đủ lô hoặc hết thời gian chờ
+            deadline = time.monotonic() + self.max_delay
+            while not self._closing and self._pending < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                    self._wakeup.clear()
+                except asyncio.TimeoutError:
+                    break
+
+            while self._pending:
+                await self._write(self._take_batch())
+
+            if self._closing:
+                break
+
+    def _take_batch(self) -> Dict[Table, List[_Entry]]:
+        """Lấy tối đa `max_rows` row từ buffer"""
+        batch: Dict[Table, List[_Entry]] = {}
+        budget = self.max_rows
+        for table in list(self._buffers):
+            rows = self._buffers[table]
+            taken, self._buffers[table] = rows[:budget], rows[budget:]
+            if not self._buffers[table]:
+                del self._buffers[table]
+            batch[table] = taken
+            budget -= len(taken)
+            if budget <= 0:
+                break
+        self._pending -= sum(len(rows) for rows in batch.values())
+        return batch
+
+    async def _write(self, batch: Dict[Table, List[_Entry]]):
+        try:
+            # Mỗi bảng một transaction: lỗi ở bảng này không kéo theo row của bảng khác
+            for table, entries in batch.items():
+                await self._write_table(table, self._coalesce(table, entries))
+        finally:
+            if self._space is not None:
+                async with self._space:
+                    self._space.notify_all()
+
+    def _coalesce(self, table: Table, entries: List[_Entry]) -> List[Tuple[Dict[str, Any], List[Callable[[], None]]]]:
+        """Gộp các row trùng khóa (row sau cùng thắng), giữ callback của mọi row đã gộp"""
+        key = self._coalesce_keys.get(table)
+        if not key:
+            return [(row, [callback] if callback else []) for row, callback in entries]
+        merged: Dict[Tuple[Any, ...], Tuple[Dict[str, Any], List[Callable[[], None]]]] = {}
+        for row, callback in entries:
+            row_key = tuple(row[column] for column in key)
+            callbacks = merged[row_key][1] if row_key in merged else []
+            if callback:
+                callbacks.append(callback)
+            merged[row_key] = (row, callbacks)
+        return list(merged.values())
+
+    async def _write_table(self, table: Table, entries: List[Tuple[Dict[str, Any], List[Callable[[], None]]]]):
+        """
+        Ghi các row của một bảng trong một transaction
+
+        - Lỗi tạm thời (mất kết nối, deadlock, hết connection): thử lại với backoff; khi
+          đang tắt chỉ thử `_CLOSE_ATTEMPTS` lần rồi bỏ, không gọi callback để event còn
+          trong journal và được replay khi khởi động lại
+        - Lỗi khác (dữ liệu không hợp lệ): chia đôi lô để các row tốt vẫn được ghi; row bị
+          database từ chối được log đầy đủ rồi bỏ qua
+        """
+        size = len(entries)
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                async with self.session_factory() as session:
+                    statement = self._statements.get(table)
+                    await session.execute(
+                        statement if statement is not None else insert(table), [row for row, _ in entries]
+                    )
+                    await session.commit()
+                break
+            except Exception as e:
+                if not _is_transient(e):
+                    if size > 1:
+                        middle = size // 2
+                        await self._write_table(table, entries[:middle])
+                        await self._write_table(table, entries[middle:])
+                        return
+                    self._rows_rejected += 1
+                    DB_ROWS.inc(table.name, "rejected")
+                    logger.error("Row rejected by %s, dropping it: %s; row: %r", table.name, e, entries[0][0])
+                    _run_callbacks(entries)
+                    return
+                attempt += 1
+                if self._closing and attempt >= _CLOSE_ATTEMPTS:
+                    self._rows_failed += size
+                    DB_ROWS.inc(table.name, "failed", amount=size)
+                    logger.error(
+                        "Batch insert of %d rows into %s failed during shutdown, left for journal replay: %s",
+                        size, table.name, e,
+                    )
+                    return
+                self._retries += 1
+                delay = min(_RETRY_MAX_SECONDS, _RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+                logger.warning(
+                    "Batch insert of %d rows into %s failed (attempt %d), retrying in %.2fs: %s",
+                    size, table.name, attempt, delay, e,
+                )
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+        elapsed = time.perf_counter() - started
+        DB_COMMIT_SECONDS.observe(elapsed, table.name)
+        DB_ROWS.inc(table.name, "written", amount=size)
+        self._batches += 1
+        self._rows_written += size
+        self._max_batch = max(self._max_batch, size)
+        self._flush_time += elapsed
+        self._last_flush_ms = elapsed * 1000
+        _run_callbacks(entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê kích thước lô và độ trễ flush"""
+        return {
+            "pending_rows": self._pending,
+            "batches": self._batches,
+            "rows_written": self._rows_written,
+            "rows_failed": self._rows_failed,
+            "rows_rejected": self._rows_rejected,
+            "retries": self._retries,
+            "avg_batch_size": round(self._rows_written / self._batches, 2) if self._batches else 0,
+            "max_batch_size": self._max_batch,
+            "avg_flush_ms": round(self._flush_time / self._batches * 1000, 3) if self._batches else 0.0,
+            "last_flush_ms": round(self._last_flush_ms, 3),
+        }
@@ -0,0 +1,166 @@
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy import String, Integer, BigInteger, Boolean, JSON, Index, func
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+
+from config import settings
+from storage.batch_writer import BatchWriter
+from storage.follower_store import FollowerStore
+from storage.partitions import PartitionManager
+
+# ===================== Database setup (SQLAlchemy Async) =====================
+class Base(DeclarativeBase):
+    pass
+
+class ImageMessageEvent(Base):
+    __tablename__ = "image_message_events"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    app_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    user_id_by_app: Mapped[str] = mapped_column(String(64), nullable=False, index=True)
+    sender_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    recipient_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    event_name: Mapped[str] = mapped_column(String(64), nullable=False)
+    timestamp: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
+    msg_id: Mapped[str] = mapped_column(String(128), nullable=True)
+    text: Mapped[str] = mapped_column(String(2048), nullable=True)
+    attachments: Mapped[dict] = mapped_column(JSON, nullable=True)
+
+    __table_args__ = (
+        Index("idx_image_msg_user_time", "user_id_by_app", "timestamp"),
+    )
+
+class EventDedupKey(Base):
+    """Khóa dedup của các event đã nhận (unique constraint là lớp chống trùng cuối cùng)"""
+    __tablename__ = "event_dedup_keys"
+
+    dedup_key: Mapped[str] = mapped_column(String(256), primary_key=True)
+    created_at: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
+
+class Follower(Base):
+    """Trạng thái follow OA hiện tại của mỗi người dùng (một row / user, ghi kiểu upsert)"""
+    __tablename__ = "followers"
+
+    user_id_by_app: Mapped[str] = mapped_column(String(64), primary_key=True)
+    app_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    oa_id: Mapped[str] = mapped_column(String(64), nullable=True)
+    follower_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    name: Mapped[str] = mapped_column(String(255), nullable=True)
+    avatar: Mapped[str] = mapped_column(String(1024), nullable=True)
+    is_following: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    followed_at: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    unfollowed_at: Mapped[int] = mapped_column(BigInteger, nullable=True)
+    # Timestamp (ms) của event mới nhất đã áp dụng; event cũ hơn không ghi đè
+    updated_at: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
+
+class UserSubmission(Base):
+    """Thông tin người dùng submit qua form (user_submit_info), lưu nguyên dạng JSONB"""
+    __tablename__ = "user_submissions"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    app_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    user_id_by_app: Mapped[str] = mapped_column(String(64), nullable=False)
+    sender_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    timestamp: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    info: Mapped[dict] = mapped_column(JSON().with_variant(JSONB(), "postgresql"), nullable=False)
+    # Khóa dedup của event (make_dedup_key): event replay từ journal không tạo row trùng
+    event_key: Mapped[str] = mapped_column(String(256), nullable=False, unique=True)
+
+    __table_args__ = (
+        # id là cột phụ để phân trang keyset theo (timestamp, id) của từng user
+        Index("idx_user_submission_user_time", "user_id_by_app", "timestamp", "id"),
+    )
+
+class RawEvent(Base):
+    """
+    Payload gốc của mọi event nhận được
+
+    Bảng được partition theo `timestamp` (PostgreSQL declarative partitioning, xem
+    `event_partitions`): truy vấn theo khoảng thời gian chỉ đọc các partition liên quan
+    và retention là DROP partition. Khóa chính phải chứa cột partition nên gồm
+    (timestamp, event_key), với event_key là khóa dedup của event.
+    """
+    __tablename__ = "events"
+
+    timestamp: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    event_key: Mapped[str] = mapped_column(String(256), primary_key=True)
+    app_id: Mapped[str] = mapped_column(String(64), nullable=False)
+    event_name: Mapped[str] = mapped_column(String(64), nullable=False)
+    user_id_by_app: Mapped[str] = mapped_column(String(64), nullable=False)
+    msg_id: Mapped[str] = mapped_column(String(128), nullable=True)
+    payload: Mapped[dict] = mapped_column(JSON().with_variant(JSONB(), "postgresql"), nullable=False)
+    # URL attachment -> file đã tải về (content-addressed), ghi sau bởi attachment fetcher
+    local_paths: Mapped[dict] = mapped_column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)
+
+    __table_args__ = (
+        Index("idx_events_user_time", "user_id_by_app", "timestamp"),
+        Index("idx_events_name_time", "event_name", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+
+engine = create_async_engine(settings.DATABASE_URL, echo=False, pool_pre_ping=True)
+AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+async def init_models():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+# Writer dùng chung để ghi các row theo lô (group commit)
+batch_writer = BatchWriter(
+    AsyncSessionLocal,
+    max_rows=settings.DB_BATCH_MAX_ROWS,
+    max_delay_ms=settings.DB_BATCH_MAX_DELAY_MS,
+)
+batch_writer.register_statement(
+    EventDedupKey.__table__,
+    pg_insert(EventDedupKey.__table__).on_conflict_do_nothing(index_elements=["dedup_key"]),
+)
+
+_follower_upsert = pg_insert(Follower.__table__)
+batch_writer.register_statement(
+    Follower.__table__,
+    _follower_upsert.on_conflict_do_update(
+        index_elements=["user_id_by_app"],
+        set_={
+            "app_id": _follower_upsert.excluded.app_id,
+            "oa_id": func.coalesce(_follower_upsert.excluded.oa_id, Follower.__table__.c.oa_id),
+            "follower_id": _follower_upsert.excluded.follower_id,
+            "name": func.coalesce(_follower_upsert.excluded.name, Follower.__table__.c.name),
+            "avatar": func.coalesce(_follower_upsert.excluded.avatar, Follower.__table__.c.avatar),
+            "is_following": _follower_upsert.excluded.is_following,
+            "followed_at": func.coalesce(_follower_upsert.excluded.followed_at, Follower.__table__.c.followed_at),
+            "unfollowed_at": func.coalesce(_follower_upsert.excluded.unfollowed_at, Follower.__table__.c.unfollowed_at),
+            "updated_at": _follower_upsert.excluded.updated_at,
+        },
+        where=Follower.__table__.c.updated_at <= _follower_upsert.excluded.updated_at,
+    ),
+    key=("user_id_by_app",),
+)
+
+# Event replay từ journal có thể đã được ghi trước khi restart
+batch_writer.register_statement(
+    UserSubmission.__table__,
+    pg_insert(UserSubmission.__table__).on_conflict_do_nothing(index_elements=["event_key"]),
+)
+batch_writer.register_statement(
+    RawEvent.__table__,
+    pg_insert(RawEvent.__table__).on_conflict_do_nothing(index_elements=["timestamp", "event_key"]),
+)
+
+# Tạo trước partition của bảng events và xóa partition quá hạn
+event_partitions = PartitionManager(
+    engine,
+    RawEvent.__tablename__,
+    interval=settings.EVENT_PARTITION_INTERVAL,
+    ahead=settings.EVENT_PARTITIONS_AHEAD,
+    retention_days=settings.EVENT_RETENTION_DAYS,
+)
+
+# Trạng thái follow: cache trong bộ nhớ, ghi xuống bảng followers kiểu write-behind
+follower_store = FollowerStore(
+    AsyncSessionLocal,
+    batch_writer,
+    Follower.__table__,
+    flush_interval_ms=settings.FOLLOWER_FLUSH_INTERVAL_MS,
+    cache_size=settings.FOLLOWER_CACHE_SIZE,
+)
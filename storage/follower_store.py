@@ -0,0 +1,284 @@
+import asyncio
+import functools
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from pipeline.completion import hold_current
+
+logger = logging.getLogger(__name__)
+
+# Chu kỳ (giây) đọc ring chung: ring 256 slot đủ cho ~2500 event/giây không bị sót
+_SHARED_SYNC_SECONDS = 0.1
+
+# Các field chỉ ghi đè khi event mới có giá trị (unfollow không kèm tên/avatar)
+_KEEP_IF_MISSING = ("oa_id", "name", "avatar", "followed_at", "unfollowed_at")
+
+
+def _release_all(callbacks: List[Callable[[], None]]):
+    for callback in callbacks:
+        callback()
+
+
+def _event_timestamp(record: Optional[Tuple[float, bytes]]) -> Optional[int]:
+    """Timestamp của event trong một record của ring chung (payload gốc nằm ở field "data")"""
+    if record is None:
+        return None
+    try:
+        return int(json.loads(record[1])["data"]["timestamp"])
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+class FollowerStore:
+    """
+    Trạng thái follow của người dùng: cache trong bộ nhớ + ghi xuống DB kiểu write-behind
+
+    - `record()` cập nhật cache ngay và đánh dấu user là "dirty"; nhiều lần follow /
+      unfollow của cùng một user trong một chu kỳ flush được gộp thành một row
+    - Mỗi `flush_interval_ms`, các row dirty được đưa vào batch writer và ghi bằng
+      `INSERT ... ON CONFLICT DO UPDATE` theo lô (chỉ ghi đè khi event mới hơn row trong DB)
+    - `is_following()` trả lời từ cache, không truy vấn DB; cache là LRU có giới hạn,
+      được nạp sẵn các follower cập nhật gần nhất khi khởi động
+
+    Khi chạy nhiều worker, mỗi worker định kỳ đọc thêm các event follow/unfollow mà worker
+    khác đã ghi vào ring chung (`shared_stats`), nên cache của mọi worker đều cập nhật.
+    Cache giữ timestamp của event đã biết gần nhất, event cũ hơn (đến trễ) bị bỏ qua.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        batch_writer,
+        table,
+        flush_interval_ms: float = 1000,
+        cache_size: int = 200_000,
+    ):
+        self.session_factory = session_factory
+        self.batch_writer = batch_writer
+        self.table = table
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.cache_size = max(1, cache_size)
+        # Ring chung giữa các worker (gắn từ app), None khi chỉ có một process
+        self.shared_stats = None
+
+        # user -> (đang follow, timestamp event đã biết gần nhất)
+        self._cache: "OrderedDict[str, Tuple[bool, int]]" = OrderedDict()
+        self._dirty: Dict[str, Dict[str, Any]] = {}
+        # Event đã ghi vào row dirty: chỉ hoàn tất (journal mark_done) khi row đã commit
+        self._holds: Dict[str, List[Callable[[], None]]] = {}
+        self._synced_seq = 0
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._closing = False
+
+        # Statistics
+        self._changes = 0
+        self._coalesced = 0
+        self._rows_flushed = 0
+        self._hits = 0
+        self._misses = 0
+        self._shared_applied = 0
+        self._shared_stale = 0
+        self._shared_gaps = 0
+
+    async def start(self):
+        """Nạp cache từ DB rồi bắt đầu vòng flush"""
+        if self.shared_stats is not None:
+            self._synced_seq = self.shared_stats.head
+        try:
+            async with self.session_factory() as session:
+                result = await session.execute(
+                    select(self.table.c.user_id_by_app, self.table.c.is_following, self.table.c.updated_at)
+                    .order_by(self.table.c.updated_at.desc())
+                    .limit(self.cache_size)
+                )
+                rows = result.all()
+        except Exception as e:
+            logger.error("Failed to warm follower cache: %s", e)
+            rows = []
+        # Follower cập nhật gần nhất nằm cuối LRU
+        for user_id, following, updated_at in reversed(rows):
+            self._cache_put(user_id, bool(following), updated_at or 0)
+        logger.info("Follower cache warmed with %s users", len(rows))
+
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Flush nốt các thay đổi còn trong bộ nhớ (gọi trước khi đóng batch writer)"""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    def record(
+        self,
+        user_id: str,
+        following: bool,
+        timestamp: int,
+        app_id: str,
+        oa_id: Optional[str] = None,
+        follower_id: Optional[str] = None,
+        name: Optional[str] = None,
+        avatar: Optional[str] = None,
+    ):
+        """
+        Ghi nhận một event follow (following=True) / unfollow của người dùng
+
+        Event đang xử lý (pipeline.completion) được giữ chưa hoàn tất cho tới khi row
+        của user được flush và commit, để trạng thái follow không bị mất nếu process
+        dừng trong chu kỳ flush.
+        """
+        hold = hold_current()
+        if hold is not None:
+            self._holds.setdefault(user_id, []).append(hold)
+        row = {
+            "user_id_by_app": user_id,
+            "app_id": app_id,
+            "oa_id": oa_id,
+            "follower_id": follower_id or user_id,
+            "name": name,
+            "avatar": avatar,
+            "is_following": following,
+            "followed_at": timestamp if following else None,
+            "unfollowed_at": None if following else timestamp,
+            "updated_at": timestamp,
+        }
+        previous = self._dirty.get(user_id)
+        if previous is not None:
+            self._coalesced += 1
+            if previous["updated_at"] > timestamp:
+                # Event đến trễ: chỉ bổ sung field còn thiếu, không đổi trạng thái
+                for field in _KEEP_IF_MISSING:
+                    if previous[field] is None:
+                        previous[field] = row[field]
+                return
+            for field in _KEEP_IF_MISSING:
+                if row[field] is None:
+                    row[field] = previous[field]
+        self._dirty[user_id] = row
+        self._changes += 1
+        cached = self._cache.get(user_id)
+        if cached is None or cached[1] <= timestamp:
+            self._cache_put(user_id, following, timestamp)
+
+    def is_following(self, user_id: str) -> Optional[bool]:
+        """Trạng thái follow từ bộ nhớ; None nếu user không có trong cache"""
+        self._sync_shared()
+        cached = self._cache.get(user_id)
+        if cached is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._cache.move_to_end(user_id)
+        return cached[0]
+
+    async def check_following(self, user_id: str) -> bool:
+        """Như `is_following` nhưng hỏi DB khi cache không có (và cache lại kết quả)"""
+        following = self.is_following(user_id)
+        if following is not None:
+            return following
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(self.table.c.is_following, self.table.c.updated_at)
+                .where(self.table.c.user_id_by_app == user_id)
+            )
+            row = result.first()
+        following, updated_at = (bool(row[0]), row[1] or 0) if row else (False, 0)
+        # Có thể đã có event mới trong lúc chờ DB
+        if user_id not in self._cache:
+            self._cache_put(user_id, following, updated_at)
+        return self._cache[user_id][0]
+
+    def _cache_put(self, user_id: str, following: bool, timestamp: int):
+        self._cache[user_id] = (following, timestamp)
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _sync_shared(self):
+        """Áp dụng các event follow/unfollow mới trong ring chung (của mọi worker)"""
+        store = self.shared_stats
+        if store is None:
+            return
+        head = store.head
+        if head <= self._synced_seq:
+            return
+        oldest = store.oldest
+        if oldest > self._synced_seq + 1:
+            # Ring đã quay vòng trước khi kịp đọc (tăng SHARED_STATS_RING_SLOTS nếu hay xảy ra)
+            self._shared_gaps += 1
+            logger.warning("Follower cache missed %s shared events", oldest - self._synced_seq - 1)
+        for seq in range(max(self._synced_seq + 1, oldest), head + 1):
+            tags = store.read_tags(seq)
+            if tags and tags[0] in ("follow", "unfollow") and len(tags) > 1:
+                self._apply_shared(tags[1], tags[0] == "follow", _event_timestamp(store.read(seq)))
+        self._synced_seq = head
+
+    def _apply_shared(self, user_id: str, following: bool, timestamp: Optional[int]):
+        """Áp dụng event của ring chung nếu không cũ hơn trạng thái đang cache"""
+        if timestamp is None:
+            # Không đọc được timestamp (slot vừa bị ghi đè): bỏ cache, lần sau hỏi DB
+            self._cache.pop(user_id, None)
+            return
+        cached = self._cache.get(user_id)
+        if cached is not None and cached[1] > timestamp:
+            self._shared_stale += 1
+            return
+        self._cache_put(user_id, following, timestamp)
+        self._shared_applied += 1
+
+    async def _flush_loop(self):
+        interval = self.flush_interval
+        if self.shared_stats is not None:
+            interval = min(interval, _SHARED_SYNC_SECONDS)
+        next_flush = time.monotonic() + self.flush_interval
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                self._sync_shared()
+            except Exception as e:
+                logger.error("Follower cache sync failed: %s", e)
+            if not self._closing and time.monotonic() >= next_flush:
+                next_flush = time.monotonic() + self.flush_interval
+                await self.flush()
+        # Flush nốt khi đóng (kể cả khi close() được gọi trước vòng lặp đầu tiên)
+        await self.flush()
+
+    async def flush(self):
+        """Đưa các row dirty vào batch writer (mỗi user tối đa một row)"""
+        if not self._dirty:
+            return
+        rows, self._dirty = self._dirty, {}
+        holds, self._holds = self._holds, {}
+        for user_id, row in rows.items():
+            callbacks = holds.get(user_id)
+            on_commit = functools.partial(_release_all, callbacks) if callbacks else None
+            await self.batch_writer.add(self.table, row, on_commit=on_commit)
+        self._rows_flushed += len(rows)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Thống kê cache và write-behind của worker này"""
+        lookups = self._hits + self._misses
+        return {
+            "cached_users": len(self._cache),
+            "dirty_users": len(self._dirty),
+            "changes": self._changes,
+            "coalesced": self._coalesced,
+            "rows_flushed": self._rows_flushed,
+            "cache_hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+            "shared_events_applied": self._shared_applied,
+            "shared_stale_ignored": self._shared_stale,
+            "shared_gaps": self._shared_gaps,
+        }
@@ -0,0 +1,159 @@
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from storage.database import ImageMessageEvent, RawEvent, UserSubmission
+
+
+def encode_cursor(timestamp: int, row_id: int) -> str:
+    """Cursor keyset dạng "<timestamp>:<id>" của row cuối cùng trong trang"""
+    return f"{timestamp}:{row_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """
+    Raises:
+        ValueError: cursor không đúng định dạng
+    """
+    timestamp, _, row_id = cursor.partition(":")
+    return int(timestamp), int(row_id)
+
+
+async def list_user_submissions(
+    session: AsyncSession,
+    user_id: str,
+    limit: int,
+    cursor: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Các lần submit của một người dùng, mới nhất trước
+
+    Phân trang keyset trên index (user_id_by_app, timestamp, id): trang sau bắt đầu
+    ngay sau `(timestamp, id)` của row cuối trang trước, không dùng OFFSET, nên trang
+    sâu cũng chỉ đọc `limit` row.
+    """
+    table = UserSubmission.__table__
+    query = (
+        select(table.c.id, table.c.timestamp, table.c.sender_id, table.c.info)
+        .where(table.c.user_id_by_app == user_id)
+        .order_by(table.c.timestamp.desc(), table.c.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(tuple_(table.c.timestamp, table.c.id) < tuple_(*decode_cursor(cursor)))
+    rows = (await session.execute(query)).all()
+
+    items: List[Dict[str, Any]] = [
+        {"id": row.id, "timestamp": row.timestamp, "sender_id": row.sender_id, "info": row.info}
+        for row in rows[:limit]
+    ]
+    next_cursor = encode_cursor(rows[limit - 1].timestamp, rows[limit - 1].id) if len(rows) > limit else None
+    return {"user_id": user_id, "submissions": items, "next_cursor": next_cursor}
+
+
+async def list_submissions(
+    session: AsyncSession,
+    limit: int,
+    after_id: int = 0,
+) -> Dict[str, Any]:
+    """
+    Toàn bộ submissions theo thứ tự ghi (id tăng dần), để kéo dữ liệu ra theo lô
+
+    Trang sau bắt đầu từ `next_cursor` (id cuối trang trước) trên primary key.
+    """
+    table = UserSubmission.__table__
+    rows = (await session.execute(
+        select(table.c.id, table.c.app_id, table.c.user_id_by_app, table.c.timestamp, table.c.info)
+        .where(table.c.id > after_id)
+        .order_by(table.c.id)
+        .limit(limit + 1)
+    )).all()
+
+    items: List[Dict[str, Any]] = [
+        {
+            "id": row.id,
+            "app_id": row.app_id,
+            "user_id": row.user_id_by_app,
+            "timestamp": row.timestamp,
+            "info": row.info,
+        }
+        for row in rows[:limit]
+    ]
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return {"submissions": items, "next_cursor": next_cursor}
+
+
+async def stream_images(
+    session_factory,
+    limit: int,
+    cursor: Optional[Tuple[int, int]] = None,
+    user_id: Optional[str] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Sự kiện ảnh, mới nhất trước, stream dưới dạng JSON `{"images": [...], "next_cursor": ...}`
+
+    Phân trang keyset theo (timestamp, id) trên idx_image_msg_user_time (có `user_id`)
+    hoặc index timestamp (lọc theo khoảng [since, until)): mỗi trang seek thẳng tới vị
+    trí cursor nên trang sâu tốn như trang đầu. Chỉ đọc các cột cần trả về, row được
+    đọc bằng server-side cursor và ghi ra ngay, không gom cả trang trong bộ nhớ.
+
+    `local_paths` (URL -> file đã tải về) lấy từ row của cùng tin nhắn trong bảng events,
+    nơi attachment fetcher ghi lại sau khi tải; join theo (user, timestamp) dùng
+    idx_events_user_time và chỉ chạm partition chứa timestamp đó.
+    """
+    table = ImageMessageEvent.__table__
+    events = RawEvent.__table__
+    columns = [table.c.id, table.c.timestamp, table.c.msg_id, table.c.attachments, events.c.local_paths]
+    if user_id is None:
+        columns.append(table.c.user_id_by_app)
+    joined = table.outerjoin(events, and_(
+        events.c.user_id_by_app == table.c.user_id_by_app,
+        events.c.timestamp == table.c.timestamp,
+        events.c.msg_id == table.c.msg_id,
+    ))
+    query = (
+        select(*columns)
+        .select_from(joined)
+        .order_by(table.c.timestamp.desc(), table.c.id.desc())
+        .limit(limit + 1)
+    )
+    if user_id is not None:
+        query = query.where(table.c.user_id_by_app == user_id)
+    if since is not None:
+        query = query.where(table.c.timestamp >= since)
+    if until is not None:
+        query = query.where(table.c.timestamp < until)
+    if cursor is not None:
+        # Điều kiện timestamp riêng để planner seek trên index (id không nằm trong index)
+        query = query.where(
+            table.c.timestamp <= cursor[0],
+            tuple_(table.c.timestamp, table.c.id) < tuple_(*cursor),
+        )
+
+    yield b'{"images":['
+    count = 0
+    last = None
+    async with session_factory() as session:
+        result = await session.stream(query)
+        async for row in result:
+            count += 1
+            if count > limit:
+                break
+            item = {
+                "id": row.id,
+                "timestamp": row.timestamp,
+                "msg_id": row.msg_id,
+                "attachments": (row.attachments or {}).get("attachments", []),
+                "local_paths": row.local_paths or {},
+            }
+            if user_id is None:
+                item["user_id"] = row.user_id_by_app
+            yield (b"," if count > 1 else b"") + json.dumps(item, ensure_ascii=False).encode("utf-8")
+            last = row
+        await result.close()
+    next_cursor = encode_cursor(last.timestamp, last.id) if count > limit else None
+    yield b'],"next_cursor":' + json.dumps(next_cursor).encode("utf-8") + b"}"
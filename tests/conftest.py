@@ -0,0 +1,28 @@
+import contextlib
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from storage.database import Base
+
+
+@pytest.fixture
+def open_database(tmp_path):
+    """
+    Mở database SQLite tạm (đã tạo bảng), dùng trong coroutine của test:
+
+        async with open_database() as session_factory: ...
+    """
+    url = f"sqlite+aiosqlite:///{tmp_path / 'test.db'}"
+
+    @contextlib.asynccontextmanager
+    async def open_db():
+        engine = create_async_engine(url)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            yield async_sessionmaker(engine, expire_on_commit=False)
+        finally:
+            await engine.dispose()
+
+    return open_db
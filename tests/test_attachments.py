@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import json
+import os
+
+import httpx
+from sqlalchemy import insert, select
+
+from models.zalo_events import UserSendImageEvent
+from pipeline.dedup import make_dedup_key
+from services.attachment_fetcher import AttachmentFetcher, host_allowed
+from storage.database import ImageMessageEvent, RawEvent
+from storage.queries import stream_images
+
+CONTENT = {"/a.jpg": b"same image", "/b.jpg": b"same image", "/c.jpg": b"another image"}
+
+
+def _cdn(request: httpx.Request) -> httpx.Response:
+    """CDN giả: /a.jpg và /b.jpg có cùng nội dung"""
+    if request.url.path == "/redirect-internal":
+        return httpx.Response(302, headers={"location": "http://169.254.169.254/latest/meta-data"})
+    if request.url.path == "/redirect-cdn":
+        return httpx.Response(302, headers={"location": "https://s2.zdn.vn/c.jpg"})
+    if request.url.path == "/huge.bin":
+        return httpx.Response(200, content=b"x" * 4096)
+    content = CONTENT.get(request.url.path)
+    if content is None:
+        return httpx.Response(404)
+    return httpx.Response(200, content=content)
+
+
+async def _start(storage_dir, **kwargs) -> AttachmentFetcher:
+    fetcher = AttachmentFetcher(str(storage_dir), allowed_hosts=["zdn.vn"], **kwargs)
+    await fetcher.start()
+    # Thay connection pool thật bằng CDN giả (không cần mạng)
+    await fetcher._client.aclose()
+    fetcher._client = httpx.AsyncClient(transport=httpx.MockTransport(_cdn))
+    return fetcher
+
+
+def _stored_files(storage_dir):
+    return [
+        os.path.join(root, name)
+        for root, _, names in os.walk(storage_dir)
+        if os.path.basename(root) != "tmp"
+        for name in names
+    ]
+
+
+def test_host_allowlist_matches_domain_and_subdomains():
+    assert host_allowed("zdn.vn", ["zdn.vn"])
+    assert host_allowed("s120.ZDN.vn.", ["zdn.vn"])
+    assert not host_allowed("evilzdn.vn", ["zdn.vn"])
+    assert not host_allowed("zdn.vn.evil.com", ["zdn.vn"])
+
+
+def test_files_are_content_addressed_and_stored_once(tmp_path):
+    async def scenario():
+        fetcher = await _start(tmp_path)
+        paths = await asyncio.gather(*(
+            fetcher.fetch(f"https://s1.zdn.vn{path}") for path in ("/a.jpg", "/b.jpg", "/c.jpg", "/a.jpg")
+        ))
+        stats = fetcher.get_stats()
+        await fetcher.close()
+        return paths, stats
+
+    paths, stats = asyncio.run(scenario())
+    same = hashlib.sha256(b"same image").hexdigest()
+    assert paths[0] == paths[1] == paths[3] == os.path.join(str(tmp_path), same[:2], same)
+    assert os.path.basename(paths[2]) == hashlib.sha256(b"another image").hexdigest()
+    files = _stored_files(tmp_path)
+    assert sorted(files) == sorted({paths[0], paths[2]})
+    for path in files:
+        with open(path, "rb") as f:
+            assert hashlib.sha256(f.read()).hexdigest() == os.path.basename(path)
+    assert stats["stored"] == 2
+    assert os.listdir(tmp_path / "tmp") == []
+
+
+def test_unsafe_urls_are_rejected(tmp_path):
+    urls = [
+        "http://s1.zdn.vn/a.jpg",
+        "https://example.com/a.jpg",
+        "https://127.0.0.1/a.jpg",
+        "file:///etc/passwd",
+        "https://s1.zdn.vn/redirect-internal",
+    ]
+
+    async def scenario():
+        fetcher = await _start(tmp_path)
+        results = [await fetcher.fetch(url) for url in urls]
+        followed = await fetcher.fetch("https://s1.zdn.vn/redirect-cdn")
+        stats = fetcher.get_stats()
+        await fetcher.close()
+        return results, followed, stats
+
+    results, followed, stats = asyncio.run(scenario())
+    assert results == [None] * len(urls)
+    assert stats["rejected"] == len(urls)
+    assert os.path.basename(followed) == hashlib.sha256(b"another image").hexdigest()
+
+
+def test_oversized_download_leaves_no_files(tmp_path):
+    async def scenario():
+        fetcher = await _start(tmp_path, max_bytes=1024)
+        path = await fetcher.fetch("https://s1.zdn.vn/huge.bin")
+        stats = fetcher.get_stats()
+        await fetcher.close()
+        return path, stats
+
+    path, stats = asyncio.run(scenario())
+    assert path is None
+    assert stats["failed"] == 1
+    assert _stored_files(tmp_path) == []
+    assert os.listdir(tmp_path / "tmp") == []
+
+
+def test_submitted_event_records_local_paths(tmp_path, open_database):
+    event = UserSendImageEvent(
+        app_id="app",
+        event_name="user_send_image",
+        timestamp="1700000000000",
+        user_id_by_app="u1",
+        sender={"id": "s"},
+        recipient={"id": "oa"},
+        message={
+            "msg_id": "m1",
+            "attachments": [
+                {"type": "image", "payload": {"url": "https://s1.zdn.vn/a.jpg"}},
+                {"type": "image", "payload": {"url": "https://s1.zdn.vn/c.jpg"}},
+            ],
+        },
+    )
+    table = RawEvent.__table__
+
+    async def scenario():
+        async with open_database() as session_factory:
+            async with session_factory() as session:
+                await session.execute(insert(table), {
+                    "timestamp": 1700000000000,
+                    "event_key": make_dedup_key(event),
+                    "app_id": "app",
+                    "event_name": "user_send_image",
+                    "user_id_by_app": "u1",
+                    "msg_id": "m1",
+                    "payload": {},
+                })
+                await session.execute(insert(ImageMessageEvent.__table__), {
+                    "app_id": "app",
+                    "user_id_by_app": "u1",
+                    "sender_id": "s",
+                    "recipient_id": "oa",
+                    "event_name": "user_send_image",
+                    "timestamp": 1700000000000,
+                    "msg_id": "m1",
+                    "attachments": {"attachments": event.message.attachments},
+                })
+                await session.commit()
+            fetcher = await _start(tmp_path / "files", session_factory=session_factory)
+            assert fetcher.submit(event)
+            await fetcher._queue.join()
+            await fetcher.close()
+            async with session_factory() as session:
+                local_paths = await session.scalar(select(table.c.local_paths))
+            chunks = [chunk async for chunk in stream_images(session_factory, 10)]
+            return local_paths, json.loads(b"".join(chunks))
+
+    local_paths, images = asyncio.run(scenario())
+    # /images trả về đường dẫn đã tải cùng với ảnh
+    assert images["images"][0]["local_paths"] == local_paths
+    assert set(local_paths) == {"https://s1.zdn.vn/a.jpg", "https://s1.zdn.vn/c.jpg"}
+    assert os.path.basename(local_paths["https://s1.zdn.vn/a.jpg"]) == hashlib.sha256(b"same image").hexdigest()
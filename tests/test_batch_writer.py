@@ -0,0 +1,124 @@
+import asyncio
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from pipeline.completion import EventCompletion, reset_current, set_current
+from storage import batch_writer as batch_writer_module
+from storage.batch_writer import BatchWriter
+
+metadata = MetaData()
+items = Table("items", metadata, Column("id", Integer, primary_key=True), Column("name", String, nullable=False))
+notes = Table("notes", metadata, Column("id", Integer, primary_key=True))
+
+
+class FlakySessions:
+    """Session factory mà `failures` lần mở đầu tiên lỗi như mất kết nối DB"""
+
+    def __init__(self, session_factory, failures: int):
+        self.session_factory = session_factory
+        self.failures = failures
+
+    def __call__(self):
+        if self.failures:
+            self.failures -= 1
+            raise OperationalError("SELECT 1", {}, ConnectionError("connection lost"))
+        return self.session_factory()
+
+
+async def _open(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'writer.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    return engine, async_sessionmaker(engine, expire_on_commit=False)
+
+
+async def _count(session_factory, table) -> int:
+    async with session_factory() as session:
+        return await session.scalar(select(func.count()).select_from(table))
+
+
+def test_bad_row_does_not_drop_the_rest_of_the_batch(tmp_path):
+    async def scenario():
+        engine, session_factory = await _open(tmp_path)
+        writer = BatchWriter(session_factory, max_rows=100, max_delay_ms=10)
+        await writer.start()
+        committed = []
+        for index in range(10):
+            row = {"id": index, "name": None if index == 7 else f"item-{index}"}
+            await writer.add(items, row, on_commit=lambda index=index: committed.append(index))
+        await writer.add(notes, {"id": 1})
+        await writer.close()
+        counts = await _count(session_factory, items), await _count(session_factory, notes)
+        await engine.dispose()
+        return counts, committed, writer.get_stats()
+
+    (item_count, note_count), committed, stats = asyncio.run(scenario())
+    assert (item_count, note_count) == (9, 1)
+    # Row bị từ chối vẫn được báo xong để journal không kẹt watermark
+    assert sorted(committed) == list(range(10))
+    assert stats["rows_rejected"] == 1 and stats["rows_written"] == 10
+
+
+def test_transient_errors_are_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_writer_module, "_RETRY_BASE_SECONDS", 0.001)
+
+    async def scenario():
+        engine, session_factory = await _open(tmp_path)
+        writer = BatchWriter(FlakySessions(session_factory, failures=2), max_delay_ms=10)
+        await writer.start()
+        await writer.add(items, {"id": 1, "name": "one"})
+        await writer.close()
+        count = await _count(session_factory, items)
+        await engine.dispose()
+        return count, writer.get_stats()
+
+    count, stats = asyncio.run(scenario())
+    assert count == 1
+    assert stats["retries"] == 2 and stats["rows_failed"] == 0
+
+
+def test_event_completes_only_after_its_rows_commit(tmp_path):
+    async def scenario():
+        engine, session_factory = await _open(tmp_path)
+        writer = BatchWriter(session_factory, max_delay_ms=10)
+        await writer.start()
+        done = []
+        completion = EventCompletion(lambda: done.append(True))
+        token = set_current(completion)
+        try:
+            await writer.add(items, {"id": 1, "name": "one"})
+            await writer.add(notes, {"id": 1})
+        finally:
+            reset_current(token)
+        # Handler xong nhưng row còn trong buffer
+        completion.release()
+        before_commit = list(done)
+        await writer.close()
+        await engine.dispose()
+        return before_commit, done
+
+    before_commit, after_commit = asyncio.run(scenario())
+    assert before_commit == []
+    assert after_commit == [True]
+
+
+def test_coalesced_rows_keep_every_callback(tmp_path):
+    async def scenario():
+        engine, session_factory = await _open(tmp_path)
+        writer = BatchWriter(session_factory, max_delay_ms=10)
+        writer.register_statement(items, items.insert(), key=("id",))
+        await writer.start()
+        committed = []
+        await writer.add(items, {"id": 1, "name": "old"}, on_commit=lambda: committed.append("old"))
+        await writer.add(items, {"id": 1, "name": "new"}, on_commit=lambda: committed.append("new"))
+        await writer.close()
+        async with session_factory() as session:
+            name = await session.scalar(select(items.c.name))
+        await engine.dispose()
+        return name, committed
+
+    name, committed = asyncio.run(scenario())
+    assert name == "new"
+    assert sorted(committed) == ["new", "old"]
@@ -0,0 +1,151 @@
+import asyncio
+
+from sqlalchemy import func, select
+
+from models.zalo_events import parse_event_envelope
+from pipeline.dedup import BloomFilter, DedupIndex, make_dedup_key
+from storage.batch_writer import BatchWriter
+from storage.database import EventDedupKey
+
+TABLE = EventDedupKey.__table__
+
+
+def _index(session_factory) -> DedupIndex:
+    # Writer chưa start: confirm() ghi thẳng xuống DB
+    return DedupIndex(session_factory, BatchWriter(session_factory), TABLE, bloom_capacity=1000, lru_size=100)
+
+
+async def _stored_keys(session_factory) -> int:
+    async with session_factory() as session:
+        return await session.scalar(select(func.count()).select_from(TABLE))
+
+
+def test_make_dedup_key_prefers_msg_id():
+    with_msg = parse_event_envelope(
+        b'{"app_id":"a","event_name":"user_send_text","timestamp":"1","user_id_by_app":"u",'
+        b'"message":{"msg_id":"m1","text":"hi"}}'
+    )
+    without_msg = parse_event_envelope(
+        b'{"app_id":"a","event_name":"follow","timestamp":"1","user_id_by_app":"u"}'
+    )
+    assert make_dedup_key(with_msg) == "user_send_text:m1"
+    assert make_dedup_key(without_msg) == "a:follow:1:u"
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000)
+    keys = [f"key-{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 100
+
+
+def test_claim_confirm_and_duplicates(open_database):
+    async def scenario():
+        async with open_database() as session_factory:
+            index = _index(session_factory)
+            await index.start()
+            first = await index.claim("k1")
+            # Bản retry đến khi bản đầu còn đang xử lý
+            concurrent = await index.claim("k1")
+            await index.confirm("k1")
+            after_confirm = await index.claim("k1")
+            stored = await _stored_keys(session_factory)
+            await index.close()
+            return first, concurrent, after_confirm, stored, index.get_stats()
+
+    first, concurrent, after_confirm, stored, stats = asyncio.run(scenario())
+    assert (first, concurrent, after_confirm) == (True, False, False)
+    assert stored == 1
+    assert stats["inflight_hits"] == 1 and stats["lru_hits"] == 1
+
+
+def test_released_key_can_be_claimed_again(open_database):
+    async def scenario():
+        async with open_database() as session_factory:
+            index = _index(session_factory)
+            await index.start()
+            assert await index.claim("k1")
+            await index.release("k1")
+            claimed_again = await index.claim("k1")
+            await index.close()
+            return claimed_again
+
+    assert asyncio.run(scenario()) is True
+
+
+def test_confirmed_keys_survive_restart(open_database):
+    async def scenario():
+        async with open_database() as session_factory:
+            index = _index(session_factory)
+            await index.start()
+            assert await index.claim("k1")
+            await index.confirm("k1")
+            await index.close()
+
+            restarted = _index(session_factory)
+            await restarted.start()
+            duplicate = await restarted.claim("k1")
+            fresh = await restarted.claim("k2")
+            await restarted.close()
+            return duplicate, fresh
+
+    assert asyncio.run(scenario()) == (False, True)
+
+
+def test_only_one_worker_wins_a_shared_claim(open_database):
+    async def scenario():
+        async with open_database() as session_factory:
+            workers = [_index(session_factory) for _ in range(2)]
+            for index in workers:
+                index.worker_count = lambda: 2
+                await index.start()
+            results = [await index.claim("k1") for index in workers]
+            # Bản thắng bị từ chối (lane đầy): khóa được trả lại cho lần retry sau
+            await workers[0].release("k1")
+            retried = await workers[1].claim("k1")
+            await workers[1].confirm("k1")
+            stored = await _stored_keys(session_factory)
+            for index in workers:
+                await index.close()
+            return results, retried, stored
+
+    results, retried, stored = asyncio.run(scenario())
+    assert results == [True, False]
+    assert retried is True
+    assert stored == 1
+
+
+def test_journal_replay_claims_keys_from_before_restart(open_database):
+    async def scenario():
+        async with open_database() as session_factory:
+            before = _index(session_factory)
+            await before.start()
+            assert await before.claim("accepted")
+            await before.confirm("accepted")
+            await before.close()
+            await asyncio.sleep(0.01)
+
+            restarted = _index(session_factory)
+            await restarted.start()
+            # Bản Zalo retry tới worker khác sau khi restart, trước khi kịp replay
+            other_worker = _index(session_factory)
+            await other_worker.start()
+            assert await other_worker.claim("retried")
+            await other_worker.confirm("retried")
+
+            replayed = [
+                await restarted.claim_replayed(key)
+                for key in ("accepted", "retried", "unconfirmed")
+            ]
+            # Bản retry tới sau replay bị bỏ qua
+            live = [await restarted.claim(key) for key in ("accepted", "unconfirmed")]
+            await restarted.close()
+            await other_worker.close()
+            return replayed, live
+
+    replayed, live = asyncio.run(scenario())
+    assert replayed == [True, False, True]
+    assert live == [False, False]
@@ -0,0 +1,203 @@
+import asyncio
+
+from pipeline.dispatcher import ShardedDispatcher
+
+
+def test_reserved_slot_is_never_rejected():
+    async def scenario():
+        release = asyncio.Event()
+        handled = []
+
+        async def handler(item):
+            await release.wait()
+            handled.append(item)
+
+        dispatcher = ShardedDispatcher(handler, lanes=1, lane_capacity=2)
+        await dispatcher.start()
+        assert dispatcher.reserve("u")
+        # Chỗ đã giữ được tính vào sức chứa của lane
+        assert dispatcher.submit("u", "queued")
+        assert dispatcher.is_full("u")
+        assert not dispatcher.reserve("u")
+        assert not dispatcher.submit("u", "rejected")
+        assert dispatcher.submit("u", "reserved", reserved=True)
+        release.set()
+        await dispatcher.stop()
+        return handled
+
+    handled = asyncio.run(scenario())
+    assert handled == ["queued", "reserved"]
+
+
+def test_cancelled_reservation_frees_the_slot():
+    async def scenario():
+        dispatcher = ShardedDispatcher(asyncio.sleep, lanes=1, lane_capacity=1)
+        await dispatcher.start()
+        assert dispatcher.reserve("u")
+        assert dispatcher.is_full("u")
+        dispatcher.cancel_reservation("u")
+        free = not dispatcher.is_full("u")
+        await dispatcher.stop()
+        return free
+
+    assert asyncio.run(scenario())
+
+
+def test_put_waits_for_reserved_slots():
+    async def scenario():
+        dispatcher = ShardedDispatcher(asyncio.sleep, lanes=1, lane_capacity=1)
+        await dispatcher.start()
+        assert dispatcher.reserve("u")
+        waiter = asyncio.create_task(dispatcher.put("u", 0))
+        await asyncio.sleep(0.01)
+        blocked = not waiter.done()
+        dispatcher.cancel_reservation("u")
+        await asyncio.wait_for(waiter, 1)
+        await dispatcher.stop()
+        return blocked
+
+    assert asyncio.run(scenario())
+
+
+def test_same_key_keeps_order_and_other_keys_run_in_parallel():
+    async def scenario():
+        order = []
+        running = set()
+        overlaps = set()
+
+        async def handler(key, index):
+            running.add(key)
+            if len(running) > 1:
+                overlaps.add(frozenset(running))
+            # Job đầu chậm hơn: nếu lane không giữ thứ tự, job sau sẽ xong trước
+            await asyncio.sleep(0.02 if index == 0 else 0)
+            order.append((key, index))
+            running.discard(key)
+
+        dispatcher = ShardedDispatcher(handler, lanes=8, lane_capacity=10)
+        keys = ["a", "b"]
+        while dispatcher.lane_for(keys[0]) == dispatcher.lane_for(keys[1]):
+            keys[1] += "b"
+        await dispatcher.start()
+        for index in range(5):
+            for key in keys:
+                assert dispatcher.submit(key, key, index)
+        await dispatcher.stop()
+        return keys, order, overlaps
+
+    keys, order, overlaps = asyncio.run(scenario())
+    for key in keys:
+        assert [index for k, index in order if k == key] == list(range(5))
+    assert frozenset(keys) in overlaps
+
+
+def test_full_lane_rejects_and_counts():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def handler(item):
+            await release.wait()
+
+        dispatcher = ShardedDispatcher(handler, lanes=1, lane_capacity=2)
+        await dispatcher.start()
+        accepted = [dispatcher.submit("u", index) for index in range(4)]
+        await asyncio.sleep(0)
+        # Worker đã lấy job đầu: lane còn chỗ cho đúng một job
+        accepted.append(dispatcher.submit("u", 4))
+        accepted.append(dispatcher.submit("u", 5))
+        stats = dispatcher.get_stats()
+        release.set()
+        await dispatcher.stop()
+        return accepted, stats
+
+    accepted, stats = asyncio.run(scenario())
+    assert accepted == [True, True, False, False, True, False]
+    assert stats["rejected"] == 3 and stats["per_lane"][0]["rejected"] == 3
+
+
+def test_failed_job_does_not_stop_the_lane():
+    async def scenario():
+        handled = []
+
+        async def handler(item):
+            if item == "bad":
+                raise RuntimeError("boom")
+            handled.append(item)
+
+        dispatcher = ShardedDispatcher(handler, lanes=1)
+        await dispatcher.start()
+        for item in ("ok", "bad", "after"):
+            dispatcher.submit("u", item)
+        while len(handled) < 2:
+            await asyncio.sleep(0)
+        stats = dispatcher.get_stats()
+        await dispatcher.stop()
+        return handled, stats
+
+    handled, stats = asyncio.run(scenario())
+    assert handled == ["ok", "after"]
+    assert (stats["processed"], stats["failed"]) == (2, 1)
+
+
+def test_webhook_returns_503_when_the_lane_is_full(monkeypatch):
+    import httpx
+
+    import app as app_module
+
+    class FakeDedup:
+        def __init__(self):
+            self.released = []
+
+        async def claim(self, key):
+            return True
+
+        async def release(self, key):
+            self.released.append(key)
+
+        async def confirm(self, key):
+            pass
+
+    class FakeJournal:
+        def __init__(self):
+            self.appended = 0
+
+        async def append(self, body):
+            self.appended += 1
+            return self.appended
+
+        def mark_done(self, seq):
+            pass
+
+    body = b'{"app_id":"a","event_name":"follow","timestamp":"1","user_id_by_app":"u1","follower":{"id":"f"}}'
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def handler(*args):
+            await release.wait()
+
+        dispatcher = ShardedDispatcher(handler, lanes=1, lane_capacity=1)
+        dedup, journal = FakeDedup(), FakeJournal()
+        monkeypatch.setattr(app_module.event_handler, "dispatcher", dispatcher)
+        monkeypatch.setattr(app_module, "dedup_index", dedup)
+        monkeypatch.setattr(app_module, "journal", journal)
+        await dispatcher.start()
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            statuses = []
+            for _ in range(3):
+                response = await client.post(
+                    "/webhook", content=body, headers={"content-type": "application/json"}
+                )
+                statuses.append(response.status_code)
+                await asyncio.sleep(0)
+        release.set()
+        await dispatcher.stop()
+        return statuses, response.headers.get("retry-after"), dedup.released, journal.appended
+
+    statuses, retry_after, released, appended = asyncio.run(scenario())
+    # Một event đang xử lý, một trong hàng đợi, event thứ ba bị từ chối
+    assert statuses == [200, 200, 503]
+    assert retry_after is not None
+    # Event bị từ chối không được ghi journal và được nhả khỏi dedup để Zalo gửi lại
+    assert appended == 2 and len(released) == 1
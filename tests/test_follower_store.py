@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+from sqlalchemy import select
+
+from models.zalo_events import parse_event_envelope
+from monitoring.recent_events import RecentEventsRing
+from monitoring.shared_stats import SharedStatsStore
+from pipeline.completion import EventCompletion, reset_current, set_current
+from storage.batch_writer import BatchWriter
+from storage.database import Follower
+from storage.follower_store import FollowerStore
+
+TABLE = Follower.__table__
+
+
+def _event(event_name: str, user: str, timestamp: int):
+    return parse_event_envelope(json.dumps({
+        "app_id": "app",
+        "event_name": event_name,
+        "timestamp": str(timestamp),
+        "user_id_by_app": user,
+        "follower": {"id": f"f-{user}"},
+    }).encode())
+
+
+def test_changes_are_coalesced_into_one_row_per_user(open_database):
+    async def scenario():
+        async with open_database() as session_factory:
+            writer = BatchWriter(session_factory, max_delay_ms=10)
+            await writer.start()
+            store = FollowerStore(session_factory, writer, TABLE, flush_interval_ms=60_000)
+            await store.start()
+            store.record("u1", True, 1000, "app", name="An")
+            store.record("u1", False, 3000, "app")
+            # Event đến trễ: không đổi trạng thái, chỉ bổ sung field còn thiếu
+            store.record("u1", True, 2000, "app", avatar="a.png")
+            store.record("u2", True, 1000, "app")
+            following = store.is_following("u1"), store.is_following("u2"), store.is_following("u3")
+            await store.close()
+            await writer.close()
+            async with session_factory() as session:
+                rows = (await session.execute(select(TABLE).order_by(TABLE.c.user_id_by_app))).mappings().all()
+            return following, rows, store.get_stats()
+
+    following, rows, stats = asyncio.run(scenario())
+    assert following == (False, True, None)
+    assert [row["user_id_by_app"] for row in rows] == ["u1", "u2"]
+    u1 = rows[0]
+    assert (u1["is_following"], u1["updated_at"], u1["unfollowed_at"]) == (False, 3000, 3000)
+    assert (u1["name"], u1["avatar"], u1["followed_at"]) == ("An", "a.png", 1000)
+    assert stats["rows_flushed"] == 2 and stats["coalesced"] == 2
+
+
+def test_event_completes_after_its_follower_row_commits(open_database):
+    async def scenario():
+        async with open_database() as session_factory:
+            writer = BatchWriter(session_factory, max_delay_ms=10)
+            await writer.start()
+            store = FollowerStore(session_factory, writer, TABLE, flush_interval_ms=60_000)
+            await store.start()
+            done = []
+            completion = EventCompletion(lambda: done.append(True))
+            token = set_current(completion)
+            try:
+                store.record("u1", True, 1000, "app")
+            finally:
+                reset_current(token)
+            completion.release()
+            before_flush = list(done)
+            await store.close()
+            await writer.close()
+            return before_flush, done
+
+    before_flush, after_commit = asyncio.run(scenario())
+    assert before_flush == []
+    assert after_commit == [True]
+
+
+def test_stale_events_from_other_workers_are_ignored(tmp_path, open_database):
+    async def scenario():
+        shared = SharedStatsStore(str(tmp_path / "stats"), ring_slots=16).open()
+        ring = RecentEventsRing(shared)
+        async with open_database() as session_factory:
+            store = FollowerStore(session_factory, BatchWriter(session_factory), TABLE)
+            store.shared_stats = shared
+            await store.start()
+            store.record("u1", True, 2000, "app")
+
+            # Worker khác nhận muộn một unfollow cũ hơn follow đã biết
+            ring.add(_event("unfollow", "u1", 1000))
+            after_stale = store.is_following("u1")
+            ring.add(_event("unfollow", "u1", 3000))
+            after_newer = store.is_following("u1")
+            ring.add(_event("follow", "u2", 500))
+            other_user = store.is_following("u2")
+            stats = store.get_stats()
+            await store.close()
+        shared.close()
+        return after_stale, after_newer, other_user, stats
+
+    after_stale, after_newer, other_user, stats = asyncio.run(scenario())
+    assert after_stale is True
+    assert after_newer is False
+    assert other_user is True
+    assert stats["shared_stale_ignored"] == 1 and stats["shared_events_applied"] == 2
+
+
+def test_cache_miss_reads_the_database(open_database):
+    async def scenario():
+        async with open_database() as session_factory:
+            async with session_factory() as session:
+                await session.execute(TABLE.insert(), {
+                    "user_id_by_app": "u1", "app_id": "app", "follower_id": "f",
+                    "is_following": True, "updated_at": 5000,
+                })
+                await session.commit()
+            store = FollowerStore(session_factory, BatchWriter(session_factory), TABLE, cache_size=1)
+            await store.start()
+            store.record("u2", False, 100, "app")
+            # u1 bị đẩy khỏi cache (cache_size=1)
+            cached = store.is_following("u1")
+            from_db = await store.check_following("u1")
+            missing = await store.check_following("nobody")
+            await store.close()
+            return cached, from_db, missing
+
+    assert asyncio.run(scenario()) == (None, True, False)
@@ -0,0 +1,100 @@
+import json
+import os
+import unicodedata
+
+from handlers.intent_matcher import IntentMatcher, IntentRules, normalize_text
+
+
+def _rules(*intents, **spec) -> IntentRules:
+    return IntentRules({"intents": list(intents), **spec})
+
+
+def _match(rules: IntentRules, text: str):
+    index = rules.automaton.best_match(normalize_text(text))
+    return rules.intents[index]["name"] if index is not None else None
+
+
+def _write(path, spec):
+    path.write_text(json.dumps(spec, ensure_ascii=False), encoding="utf-8")
+
+
+def test_normalize_text_folds_vietnamese_marks():
+    assert normalize_text("Xin  CHÀO, Đức") == "xin chao, duc"
+    # Dấu tổ hợp rời (gõ dạng NFD)
+    assert normalize_text(unicodedata.normalize("NFD", "Cảm ơn")) == "cam on"
+    assert normalize_text("  nhiều   khoảng\ttrắng ") == "nhieu khoang trang"
+
+
+def test_keywords_match_whole_words_by_default():
+    rules = _rules({"name": "greeting", "keywords": ["hi"], "reply": "x"})
+    assert _match(rules, "hi shop") == "greeting"
+    assert _match(rules, "ok, hi!") == "greeting"
+    assert _match(rules, "this is it") is None
+
+
+def test_substring_keywords_match_inside_words():
+    rules = _rules({"name": "thanks", "keywords": ["thank"], "substring": True, "reply": "x"})
+    assert _match(rules, "thankyou so much") == "thanks"
+
+
+def test_earlier_intent_wins_and_overlapping_keywords_are_found():
+    rules = _rules(
+        {"name": "order", "keywords": ["đặt hàng"], "reply": "x"},
+        {"name": "price", "keywords": ["giá", "bảng giá"], "reply": "x"},
+        {"name": "suffix", "keywords": ["hang"], "substring": True, "reply": "x"},
+    )
+    assert _match(rules, "cho xin bang gia") == "price"
+    assert _match(rules, "bảng giá và đặt hàng") == "order"
+    # "hang" nằm trong "dat hang" (failure link) nhưng intent khai báo trước thắng
+    assert _match(rules, "toi muon dat hang") == "order"
+    assert _match(rules, "khach hang") == "suffix"
+
+
+def test_missing_rules_file_keeps_builtin_commands(tmp_path):
+    matcher = IntentMatcher(str(tmp_path / "missing.json"))
+    assert matcher.command("/start")["handler"] == "start"
+    assert matcher.command("/HELP")["handler"] == "help"
+    assert matcher.command("/info")["handler"] == "info"
+    assert matcher.match("hello shop")["name"] == "greeting"
+    assert "{text}" in matcher.rules.fallback
+
+
+def test_invalid_rules_file_keeps_builtin_commands(tmp_path):
+    path = tmp_path / "intents.json"
+    path.write_text("{not json", encoding="utf-8")
+    matcher = IntentMatcher(str(path))
+    assert matcher.command("/help")["handler"] == "help"
+
+
+def test_rules_file_is_merged_over_builtin_commands(tmp_path):
+    path = tmp_path / "intents.json"
+    _write(path, {
+        "commands": {"/start": {"reply": "Chào {name}"}, "/gio": {"reply": "8h-17h"}},
+        "intents": [{"name": "price", "keywords": ["giá"], "reply": "x"}],
+    })
+    matcher = IntentMatcher(str(path))
+    assert matcher.command("/start") == {"reply": "Chào {name}"}
+    assert matcher.command("/gio") == {"reply": "8h-17h"}
+    assert matcher.command("/help")["handler"] == "help"
+    # Intents trong file thay thế intents có sẵn
+    assert matcher.match("hello") is None
+    assert matcher.match("gia bao nhieu")["name"] == "price"
+
+
+def test_rules_are_reloaded_when_the_file_changes(tmp_path):
+    path = tmp_path / "intents.json"
+    _write(path, {"intents": [{"name": "a", "keywords": ["alpha"], "reply": "x"}]})
+    matcher = IntentMatcher(str(path), reload_interval=0)
+    assert matcher.match("alpha")["name"] == "a"
+
+    _write(path, {"intents": [{"name": "b", "keywords": ["beta"], "reply": "x"}]})
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert matcher.match("alpha") is None
+    assert matcher.match("beta")["name"] == "b"
+
+    # Rules mới bị lỗi: giữ rules cũ
+    _write(path, {"intents": [{"keywords": ["gamma"]}]})
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2_000_000))
+    assert matcher.match("beta")["name"] == "b"
+    assert matcher.reloads == 2
@@ -0,0 +1,159 @@
+import asyncio
+import json
+
+import pytest
+
+from pipeline.journal import IngestionJournal, JournalLocked
+
+
+async def _append_all(journal, payloads):
+    return [await journal.append(payload) for payload in payloads]
+
+
+def test_unfinished_entries_are_replayed_after_restart(tmp_path):
+    async def scenario():
+        journal = IngestionJournal(str(tmp_path))
+        assert await journal.start() == []
+        seqs = await _append_all(journal, [b"one", b"two", b"three"])
+        # Entry 2 chưa xong: watermark dừng ở 1 dù entry 3 đã xong
+        journal.mark_done(seqs[0])
+        journal.mark_done(seqs[2])
+        await journal.close()
+
+        reopened = IngestionJournal(str(tmp_path))
+        unprocessed = await reopened.start()
+        next_seq = await reopened.append(b"four")
+        await reopened.close()
+        return seqs, unprocessed, next_seq
+
+    seqs, unprocessed, next_seq = asyncio.run(scenario())
+    assert seqs == [1, 2, 3]
+    assert unprocessed == [(2, b"two"), (3, b"three")]
+    assert next_seq == 4
+
+
+def test_nothing_is_replayed_when_everything_is_done(tmp_path):
+    async def scenario():
+        journal = IngestionJournal(str(tmp_path))
+        await journal.start()
+        for seq in await _append_all(journal, [b"a", b"b"]):
+            journal.mark_done(seq)
+        await journal.close()
+
+        reopened = IngestionJournal(str(tmp_path))
+        unprocessed = await reopened.start()
+        await reopened.close()
+        return unprocessed
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_torn_tail_is_truncated_on_recovery(tmp_path):
+    async def scenario():
+        journal = IngestionJournal(str(tmp_path))
+        await journal.start()
+        await _append_all(journal, [b"first", b"second"])
+        await journal.close()
+
+        # Crash giữa lúc ghi record cuối: header có nhưng payload bị cắt
+        segment = sorted(tmp_path.glob("*.log"))[-1]
+        with open(segment, "ab") as f:
+            f.write(b"\x00\x00\x00\x10\x00\x00\x00\x00partial")
+
+        reopened = IngestionJournal(str(tmp_path))
+        unprocessed = await reopened.start()
+        next_seq = await reopened.append(b"third")
+        await reopened.close()
+
+        again = IngestionJournal(str(tmp_path))
+        replayed = await again.start()
+        await again.close()
+        return unprocessed, next_seq, replayed
+
+    unprocessed, next_seq, replayed = asyncio.run(scenario())
+    assert unprocessed == [(1, b"first"), (2, b"second")]
+    assert next_seq == 3
+    assert replayed == [(1, b"first"), (2, b"second"), (3, b"third")]
+
+
+def test_dead_letter_appends_payload_and_reason(tmp_path):
+    async def scenario():
+        journal = IngestionJournal(str(tmp_path))
+        await journal.start()
+        await journal.dead_letter(b'{"event_name": "x"}', "ValueError: boom")
+        stats = journal.get_stats()
+        await journal.close()
+        return stats
+
+    stats = asyncio.run(scenario())
+    lines = (tmp_path / "dead_letter.jsonl").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record["reason"] == "ValueError: boom"
+    assert json.loads(record["payload"]) == {"event_name": "x"}
+    assert stats["dead_letters"] == 1
+
+
+class FailingFile:
+    """File segment giả: ghi một phần dữ liệu xuống đĩa rồi báo lỗi (ví dụ đĩa đầy)"""
+
+    def __init__(self, real):
+        self.real = real
+
+    def write(self, data):
+        self.real.write(data[: len(data) // 2])
+        self.real.flush()
+        raise OSError(28, "No space left on device")
+
+    def __getattr__(self, name):
+        return getattr(self.real, name)
+
+
+def test_failed_write_leaves_no_garbage_and_no_gap(tmp_path):
+    async def scenario():
+        journal = IngestionJournal(str(tmp_path), flush_interval_ms=0)
+        await journal.start()
+        first = await journal.append(b"first")
+        journal._file = FailingFile(journal._file)
+        try:
+            await journal.append(b"lost")
+        except OSError:
+            pass
+        third = await journal.append(b"third")
+        # Crash trước khi checkpoint: chỉ còn dữ liệu trên đĩa
+        journal._checkpoint_task.cancel()
+        journal._file.close()
+        journal._release_lock()
+
+        reopened = IngestionJournal(str(tmp_path))
+        unprocessed = await reopened.start()
+        for seq, _ in unprocessed:
+            reopened.mark_done(seq)
+        stats = reopened.get_stats()
+        await reopened.close()
+        return first, third, unprocessed, stats
+
+    first, third, unprocessed, stats = asyncio.run(scenario())
+    assert (first, third) == (1, 3)
+    # Record ghi dở của batch lỗi đã bị cắt nên "third" phía sau vẫn được replay
+    assert unprocessed == [(1, b"first"), (3, b"third")]
+    # Seq 2 không có trên đĩa: không chặn watermark
+    assert stats["watermark"] == 3 and stats["in_flight"] == 0
+
+
+def test_directory_is_locked_while_a_journal_is_open(tmp_path):
+    async def scenario():
+        owner = IngestionJournal(str(tmp_path))
+        await owner.start()
+        await owner.append(b"orphaned")
+        with pytest.raises(JournalLocked):
+            await IngestionJournal(str(tmp_path)).start(blocking=False)
+        await owner.close()
+
+        # Worker đã dừng: worker khác mở được journal và replay
+        adopter = IngestionJournal(str(tmp_path))
+        unprocessed = await adopter.start(blocking=False)
+        await adopter.close()
+        return unprocessed
+
+    assert asyncio.run(scenario()) == [(1, b"orphaned")]
@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+from monitoring.live_stream import BroadcastHub, Subscriber, sse_frame
+from monitoring.shared_stats import SharedStatsStore
+
+
+def _frames(chunk: bytes):
+    """Tách chunk SSE thành [(event, id, data)]"""
+    frames = []
+    for block in chunk.decode().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line and not line.startswith(":"))
+        if "event" in fields:
+            frames.append((fields["event"], fields.get("id"), json.loads(fields["data"])))
+    return frames
+
+
+def _open(tmp_path) -> SharedStatsStore:
+    return SharedStatsStore(str(tmp_path / "stats"), ring_slots=16, slot_size=512).open()
+
+
+def test_sse_frame_format():
+    assert sse_frame("event", b'{\n "a": 1\r\n}', 7) == b'id: 7\nevent: event\ndata: { "a": 1}\n\n'
+    assert sse_frame("stats", b"{}") == b"event: stats\ndata: {}\n\n"
+
+
+def test_slow_subscriber_drops_oldest_events():
+    subscriber = Subscriber(buffer_size=2)
+    subscriber.push_events([b"a", b"b", b"c"])
+    subscriber.push_stats({"follow": (3, 0.0)}, 3)
+    chunk = subscriber.drain()
+    assert chunk.startswith(b"bc")
+    assert [(event, data) for event, _, data in _frames(chunk[2:])] == [
+        ("lagged", {"dropped": 1}),
+        ("stats", {"total_events": 3, "event_types": {"follow": {"count": 3, "last_received": None}}}),
+    ]
+    assert subscriber.drain() == b"" and not subscriber.wakeup.is_set()
+
+
+def test_stream_sends_snapshot_then_new_events_and_stats(tmp_path):
+    async def scenario():
+        store = _open(tmp_path)
+        store.increment("follow")
+        hub = BroadcastHub(store, poll_interval_ms=5, heartbeat_seconds=5)
+        stream = hub.stream()
+        snapshot = await stream.__anext__()
+        store.append(b'{"event_name": "follow"}')
+        store.increment("follow")
+        update = await asyncio.wait_for(stream.__anext__(), 1)
+        clients = hub.get_stats()["clients"]
+        await stream.aclose()
+        await hub.close()
+        store.close()
+        return snapshot, update, clients, hub.get_stats()
+
+    snapshot, update, clients, stats = asyncio.run(scenario())
+    assert snapshot.startswith(b"retry: 3000\n\n")
+    assert _frames(snapshot)[0][2]["event_types"]["follow"]["count"] == 1
+    frames = _frames(update)
+    assert frames[0] == ("event", "1", {"seq": 1, "event_name": "follow"})
+    assert frames[1][0] == "stats" and frames[1][2]["total_events"] == 2
+    assert clients == 1 and stats["clients"] == 0 and stats["chunks_sent"] == 1
+
+
+def test_reconnect_replays_events_after_last_event_id(tmp_path):
+    async def scenario():
+        store = _open(tmp_path)
+        hub = BroadcastHub(store, poll_interval_ms=5, heartbeat_seconds=5)
+        first = hub.stream()
+        await first.__anext__()
+        for index in range(3):
+            store.append(b'{"index": %d}' % index)
+        await asyncio.wait_for(first.__anext__(), 1)
+
+        second = hub.stream(last_event_id=1)
+        await second.__anext__()
+        missed = await second.__anext__()
+        await first.aclose()
+        await second.aclose()
+        await hub.close()
+        store.close()
+        return missed
+
+    frames = _frames(asyncio.run(scenario()))
+    assert [(event_id, data["index"]) for _, event_id, data in frames] == [("2", 1), ("3", 2)]
+
+
+def test_stream_ends_after_max_duration(tmp_path):
+    async def scenario():
+        store = _open(tmp_path)
+        hub = BroadcastHub(store, poll_interval_ms=5, heartbeat_seconds=0.01, max_stream_seconds=0.05)
+        chunks = [chunk async for chunk in hub.stream()]
+        await hub.close()
+        store.close()
+        return chunks, hub.get_stats()["clients"]
+
+    chunks, clients = asyncio.run(scenario())
+    assert b": ping\n\n" in chunks[1:]
+    assert clients == 0
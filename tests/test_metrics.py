@@ -0,0 +1,87 @@
+import multiprocessing
+
+import pytest
+
+from monitoring.metrics import MetricsRegistry
+from monitoring.shared_stats import SharedStatsStore
+
+
+def _registry():
+    registry = MetricsRegistry(max_slots=64, max_series=16)
+    errors = registry.counter("errors_total", "Số lỗi", ("stage",))
+    latency = registry.histogram("latency_seconds", "Độ trễ", ("stage",), buckets=(0.1, 1.0))
+    return registry, errors, latency
+
+
+def _samples(text: str):
+    return dict(line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#"))
+
+
+def test_render_counters_and_cumulative_histograms():
+    registry, errors, latency = _registry()
+    errors.inc("ack")
+    errors.inc("ack", amount=2)
+    errors.inc('say "hi"\n')
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, "route")
+
+    text = registry.render()
+    assert "# HELP errors_total Số lỗi\n# TYPE errors_total counter\n" in text
+    assert "# TYPE latency_seconds histogram" in text
+    samples = _samples(text)
+    assert samples['errors_total{stage="ack"}'] == "3"
+    assert samples['errors_total{stage="say \\"hi\\"\\n"}'] == "1"
+    # Giá trị đúng bằng cận trên thuộc bucket đó (le = nhỏ hơn hoặc bằng)
+    assert samples['latency_seconds_bucket{stage="route",le="0.1"}'] == "2"
+    assert samples['latency_seconds_bucket{stage="route",le="1.0"}'] == "3"
+    assert samples['latency_seconds_bucket{stage="route",le="+Inf"}'] == "4"
+    assert samples['latency_seconds_count{stage="route"}'] == "4"
+    assert float(samples['latency_seconds_sum{stage="route"}']) == pytest.approx(3.65)
+
+
+def test_unknown_event_names_share_one_label():
+    registry = MetricsRegistry()
+    assert registry.event_label("anything") == "anything"
+    registry.known_event_names = {"follow"}
+    assert registry.event_label("follow") == "follow"
+    assert registry.event_label("made_up_event") == "other"
+    assert registry.event_label(None) == "unknown"
+
+
+def test_full_registry_raises():
+    registry = MetricsRegistry(max_slots=4)
+    latency = registry.histogram("latency_seconds", "Độ trễ", ("stage",), buckets=(0.1, 1.0))
+    latency.observe(0.5, "a")
+    with pytest.raises(RuntimeError):
+        latency.observe(0.5, "b")
+    with pytest.raises(ValueError):
+        registry.counter("c", "c", ("label",)).inc("x" * 200)
+
+
+def _child(path):
+    store = SharedStatsStore(path, ring_slots=4, slot_size=512).open()
+    registry, errors, latency = _registry()
+    registry.attach(store)
+    errors.inc("route", amount=5)
+    latency.observe(2.0, "route")
+    store.close()
+
+
+def test_attached_registries_sum_every_worker(tmp_path):
+    path = str(tmp_path / "stats")
+    store = SharedStatsStore(path, ring_slots=4, slot_size=512).open()
+    registry, errors, latency = _registry()
+    errors.inc("ack")
+    registry.attach(store)
+    # Giá trị trước attach là cục bộ, không chuyển sang file chung
+    errors.inc("ack")
+    latency.observe(0.5, "route")
+    with multiprocessing.get_context("fork").Pool(1) as pool:
+        pool.apply(_child, (path,))
+
+    samples = _samples(registry.render())
+    assert samples['errors_total{stage="ack"}'] == "1"
+    assert samples['errors_total{stage="route"}'] == "5"
+    assert samples['latency_seconds_count{stage="route"}'] == "2"
+    assert samples['latency_seconds_bucket{stage="route",le="1.0"}'] == "1"
+    store.close()
@@ -0,0 +1,143 @@
+import asyncio
+import json
+
+import middleware
+from middleware import (
+    RateLimiter,
+    RateLimitMiddleware,
+    SignatureVerifier,
+    WebhookSecurityMiddleware,
+)
+
+BODY = b'{"app_id":"a","event_name":"follow","timestamp":"1","user_id_by_app":"u1"}'
+
+
+class DownstreamApp:
+    """App phía sau middleware: ghi lại body nhận được và trả 200"""
+
+    def __init__(self):
+        self.bodies = []
+
+    async def __call__(self, scope, receive, send):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        self.bodies.append(b"".join(chunks))
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+
+def call(app, headers, chunks=(BODY,), path="/webhook", disconnect=False):
+    """Gửi một request POST qua ASGI app, trả về (status, headers, body)"""
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": index < len(chunks) - 1 or disconnect}
+        for index, chunk in enumerate(chunks)
+    ]
+    if disconnect:
+        messages.append({"type": "http.disconnect"})
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": path,
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        "client": ("127.0.0.1", 5000),
+    }
+    asyncio.run(app(scope, receive, send))
+    if not sent:
+        return None, {}, b""
+    start = sent[0]
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    return start["status"], dict(start["headers"]), body
+
+
+def test_accepts_json_and_replays_body():
+    downstream = DownstreamApp()
+    app = WebhookSecurityMiddleware(downstream, max_size=1024)
+    status, _, _ = call(app, {"Content-Type": "application/json", "Content-Length": str(len(BODY))})
+    assert status == 200
+    assert downstream.bodies == [BODY]
+
+
+def test_rejects_wrong_content_type_with_415():
+    downstream = DownstreamApp()
+    app = WebhookSecurityMiddleware(downstream, max_size=1024)
+    status, _, body = call(app, {"Content-Type": "text/plain"})
+    assert status == 415
+    assert json.loads(body)["detail"] == "Content-Type must be application/json"
+    assert downstream.bodies == []
+
+
+def test_rejects_invalid_content_length_with_400():
+    app = WebhookSecurityMiddleware(DownstreamApp(), max_size=1024)
+    assert call(app, {"Content-Type": "application/json", "Content-Length": "abc"})[0] == 400
+    assert call(app, {"Content-Type": "application/json", "Content-Length": "-1"})[0] == 400
+
+
+def test_rejects_declared_oversized_body_with_413():
+    downstream = DownstreamApp()
+    app = WebhookSecurityMiddleware(downstream, max_size=10)
+    status, headers, _ = call(app, {"Content-Type": "application/json", "Content-Length": "11"})
+    assert status == 413
+    assert headers[b"connection"] == b"close"
+    assert downstream.bodies == []
+
+
+def test_rejects_oversized_chunked_body_with_413():
+    downstream = DownstreamApp()
+    app = WebhookSecurityMiddleware(downstream, max_size=10)
+    status, _, _ = call(app, {"Content-Type": "application/json"}, chunks=(b"123456", b"789012"))
+    assert status == 413
+    assert downstream.bodies == []
+
+
+def test_disconnect_mid_body_stops_processing():
+    downstream = DownstreamApp()
+    app = WebhookSecurityMiddleware(downstream, max_size=1024)
+    status, _, _ = call(app, {"Content-Type": "application/json"}, chunks=(BODY[:10],), disconnect=True)
+    assert status is None
+    assert downstream.bodies == []
+
+
+def test_other_paths_are_not_checked():
+    downstream = DownstreamApp()
+    app = WebhookSecurityMiddleware(downstream, max_size=1024)
+    assert call(app, {"Content-Type": "text/plain"}, path="/health")[0] == 200
+
+
+def test_rate_limit_returns_429_with_retry_after():
+    app = RateLimitMiddleware(DownstreamApp(), limiter=RateLimiter(rate_per_minute=1, burst=1), key="ip")
+    headers = {"Content-Type": "application/json"}
+    assert call(app, headers)[0] == 200
+    status, response_headers, _ = call(app, headers)
+    assert status == 429
+    assert int(response_headers[b"retry-after"]) >= 1
+
+
+def test_rate_limit_by_user_ignores_forged_signatures(monkeypatch):
+    verifier = SignatureVerifier(["secret"])
+    monkeypatch.setattr(middleware, "signature_verifier", verifier)
+    monkeypatch.setattr(middleware.settings, "REQUIRE_SIGNATURE", True)
+    downstream = DownstreamApp()
+    app = RateLimitMiddleware(
+        downstream, limiter=RateLimiter(rate_per_minute=1, burst=1), key="user_id_by_app"
+    )
+    signed = {"Content-Type": "application/json", "X-ZSign": verifier.sign(BODY)}
+    forged = {"Content-Type": "application/json", "X-ZSign": "0" * 64}
+
+    # Request sai chữ ký không tiêu quota của user (endpoint sẽ trả lỗi chữ ký)
+    assert call(app, forged)[0] == 200
+    assert call(app, signed)[0] == 200
+    assert call(app, signed)[0] == 429
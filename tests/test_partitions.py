@@ -0,0 +1,129 @@
+import asyncio
+import contextlib
+from datetime import datetime, timezone
+
+import pytest
+
+from storage.partitions import PartitionManager
+
+
+def _utc(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def _ms(*args) -> int:
+    return int(_utc(*args).timestamp() * 1000)
+
+
+class FakeResult:
+    def __init__(self, rows=(), rowcount=0):
+        self.rows = list(rows)
+        self.rowcount = rowcount
+
+    def scalars(self):
+        return iter(self.rows)
+
+    def scalar(self):
+        return self.rows[0] if self.rows else None
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+
+class FakeEngine:
+    """Engine PostgreSQL giả: ghi lại câu lệnh DDL, danh sách partition lấy từ `existing`"""
+
+    def __init__(self, existing=(), dialect="postgresql", default_rows_in=None, fail_on=None):
+        self.dialect = type("Dialect", (), {"name": dialect})()
+        self.existing = list(existing)
+        # (start_ms, end_ms) của khoảng mà partition default đang có row
+        self.default_rows_in = default_rows_in
+        self.fail_on = fail_on
+        self.statements = []
+
+    async def execute(self, statement, params=None):
+        sql = str(statement)
+        if "pg_inherits" in sql:
+            return FakeResult(self.existing)
+        if "to_regclass" in sql:
+            return FakeResult(["regclass"])
+        if sql.startswith("SELECT 1 FROM"):
+            conflict = self.default_rows_in == (params["start"], params["end"])
+            return FakeResult([(1,)] if conflict else [])
+        if "advisory" in sql:
+            return FakeResult()
+        if self.fail_on and self.fail_on in sql:
+            raise RuntimeError("permission denied")
+        self.statements.append(sql)
+        return FakeResult(rowcount=3 if sql.startswith(("DELETE", "WITH")) else 0)
+
+    @contextlib.asynccontextmanager
+    async def connect(self):
+        yield self
+
+    begin = connect
+
+
+def test_partition_names_and_bounds():
+    daily = PartitionManager(FakeEngine(), "events", interval="day")
+    monthly = PartitionManager(FakeEngine(), "events", interval="month")
+    assert daily._name(_utc(2024, 2, 29)) == "events_p20240229"
+    assert monthly._name(_utc(2024, 12, 1)) == "events_p202412"
+    assert daily._parse_name("events_p20240229") == (_utc(2024, 2, 29), _utc(2024, 3, 1))
+    assert monthly._parse_name("events_p202412") == (_utc(2024, 12, 1), _utc(2025, 1, 1))
+    # Tên không đúng kỳ hoặc của bảng khác không được coi là partition theo kỳ
+    assert daily._parse_name("events_p202412") is None
+    assert daily._parse_name("events_default") is None
+    assert daily._parse_name("other_events_p20240229") is None
+    assert monthly._period_start(_utc(2024, 1, 31, 23, 59)) == _utc(2024, 1, 1)
+    assert monthly._next_period(_utc(2024, 1, 1)) == _utc(2024, 2, 1)
+    with pytest.raises(ValueError):
+        PartitionManager(FakeEngine(), "events", interval="week")
+
+
+def test_maintain_creates_ahead_and_drops_expired_partitions():
+    engine = FakeEngine(existing=["events_default", "events_p20231230", "events_p20231231", "events_p20240330"])
+    manager = PartitionManager(engine, "events", interval="day", ahead=2, retention_days=90)
+    result = asyncio.run(manager.maintain(now=_utc(2024, 3, 30, 15)))
+
+    # Mốc retention 2023-12-31 15:00: partition ngày 31/12 còn chứa row chưa hết hạn
+    assert result == {"created": ["events_p20240331", "events_p20240401"], "dropped": ["events_p20231230"]}
+    assert (
+        'CREATE TABLE "events_p20240331" PARTITION OF "events" '
+        f"FOR VALUES FROM ({_ms(2024, 3, 31)}) TO ({_ms(2024, 4, 1)})"
+    ) in engine.statements
+    assert 'DROP TABLE IF EXISTS "events_p20231230"' in engine.statements
+    # Retention của partition default: xóa row cũ hơn mốc retention
+    assert 'DELETE FROM "events_default" WHERE timestamp < :cutoff' in engine.statements
+    stats = manager.get_stats()
+    assert (stats["partitions"], stats["created"], stats["dropped"], stats["default_rows_purged"]) == (5, 2, 1, 3)
+
+
+def test_rows_in_default_are_moved_into_the_new_partition():
+    start, end = _ms(2024, 4, 1), _ms(2024, 5, 1)
+    engine = FakeEngine(existing=["events_default", "events_p202403"], default_rows_in=(start, end))
+    manager = PartitionManager(engine, "events", interval="month", ahead=1, retention_days=0)
+    result = asyncio.run(manager.maintain(now=_utc(2024, 3, 15)))
+
+    assert result == {"created": ["events_p202404"], "dropped": []}
+    assert engine.statements[0].startswith('CREATE TABLE "events_p202404" (LIKE "events"')
+    assert engine.statements[1].startswith('WITH moved AS (DELETE FROM "events_default"')
+    assert engine.statements[2] == (
+        f'ALTER TABLE "events" ATTACH PARTITION "events_p202404" FOR VALUES FROM ({start}) TO ({end})'
+    )
+    assert manager.get_stats()["rows_moved_from_default"] == 3
+
+
+def test_failed_step_does_not_stop_the_others():
+    engine = FakeEngine(existing=["events_default"], fail_on="events_p20240101")
+    manager = PartitionManager(engine, "events", interval="day", ahead=1, retention_days=0)
+    result = asyncio.run(manager.maintain(now=_utc(2024, 1, 1)))
+    assert result["created"] == ["events_p20240102"]
+    assert "events_p20240101" in manager.get_stats()["last_error"]
+
+
+def test_other_databases_are_left_alone():
+    engine = FakeEngine(dialect="sqlite")
+    manager = PartitionManager(engine, "events")
+    assert asyncio.run(manager.maintain()) == {"created": [], "dropped": []}
+    assert engine.statements == []
@@ -0,0 +1,199 @@
+import asyncio
+
+import pytest
+
+from services import profile_cache as profile_cache_module
+from services.profile_cache import ProfileCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeLoader:
+    """Loader giả: đếm số lần gọi, có thể chặn tới khi `release` được set"""
+
+    def __init__(self, profiles=None):
+        self.profiles = profiles or {}
+        self.calls = []
+        self.release = asyncio.Event()
+        self.release.set()
+        self.error = None
+
+    async def __call__(self, user_id, zalo_user_id):
+        self.calls.append(user_id)
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.profiles.get(user_id)
+
+
+async def _settle():
+    """Cho các task nền và done-callback của chúng chạy xong"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(profile_cache_module.time, "monotonic", fake)
+    return fake
+
+
+def test_concurrent_lookups_share_one_load(clock):
+    async def scenario():
+        loader = FakeLoader({"u": {"display_name": "An"}})
+        loader.release.clear()
+        cache = ProfileCache(loader)
+        lookups = [asyncio.create_task(cache.get("u")) for _ in range(5)]
+        await asyncio.sleep(0)
+        loader.release.set()
+        results = await asyncio.gather(*lookups)
+        return results, loader.calls, cache.get_stats()
+
+    results, calls, stats = asyncio.run(scenario())
+    assert results == [{"display_name": "An"}] * 5
+    assert calls == ["u"]
+    assert (stats["miss"], stats["coalesced"], stats["inflight"]) == (1, 4, 0)
+
+
+def test_entries_expire_after_ttl(clock):
+    async def scenario():
+        loader = FakeLoader({"u": {"display_name": "An"}})
+        cache = ProfileCache(loader, ttl_seconds=100, negative_ttl_seconds=10, refresh_after=1.0)
+        await cache.get("u")
+        await cache.get("missing")
+        clock.now += 50
+        await cache.get("u")
+        await cache.get("missing")
+        clock.now += 51
+        await cache.get("u")
+        await cache.get("missing")
+        return loader.calls
+
+    # "missing" (không có profile) hết hạn sau 10 giây, "u" sau 100 giây
+    assert asyncio.run(scenario()) == ["u", "missing", "missing", "u", "missing"]
+
+
+def test_nearly_expired_entry_is_served_and_refreshed(clock):
+    async def scenario():
+        loader = FakeLoader({"u": {"display_name": "An"}})
+        cache = ProfileCache(loader, ttl_seconds=100, refresh_after=0.8)
+        await cache.get("u")
+        loader.profiles["u"] = {"display_name": "Bình"}
+        clock.now += 85
+        stale = await cache.get("u")
+        await _settle()
+        fresh = await cache.get("u")
+        return stale, fresh, loader.calls
+
+    stale, fresh, calls = asyncio.run(scenario())
+    assert stale == {"display_name": "An"}
+    assert fresh == {"display_name": "Bình"}
+    assert calls == ["u", "u"]
+
+
+def test_transient_errors_are_not_cached(clock):
+    async def scenario():
+        loader = FakeLoader({"u": {"display_name": "An"}})
+        loader.error = ConnectionError("timeout")
+        cache = ProfileCache(loader)
+        failed = await cache.get("u")
+        loader.error = None
+        recovered = await cache.get("u")
+        return failed, recovered, cache.get_stats()["load_errors"]
+
+    assert asyncio.run(scenario()) == (None, {"display_name": "An"}, 1)
+
+
+def test_lru_evicts_least_recently_used(clock):
+    async def scenario():
+        loader = FakeLoader()
+        cache = ProfileCache(loader, max_size=2)
+        for user in ("a", "b"):
+            cache.put(user, {"display_name": user})
+        await cache.get("a")
+        cache.put("c", {"display_name": "c"})
+        return await cache.get("a"), await cache.get("b"), loader.calls
+
+    assert asyncio.run(scenario()) == ({"display_name": "a"}, None, ["b"])
+
+
+def test_peek_never_waits_for_the_loader(clock):
+    async def scenario():
+        loader = FakeLoader({"u": {"display_name": "An"}})
+        loader.release.clear()
+        cache = ProfileCache(loader, ttl_seconds=100)
+        first = cache.peek_display_name("u", fallback="payload name")
+        loader.release.set()
+        await _settle()
+        second = cache.peek_display_name("u", fallback="payload name")
+        clock.now += 200
+        # Hết hạn: vẫn dùng tên cũ trong lúc tải lại ở nền
+        expired = cache.peek_display_name("u", fallback="payload name")
+        return first, second, expired, loader.calls
+
+    first, second, expired, calls = asyncio.run(scenario())
+    assert (first, second, expired) == ("payload name", "An", "An")
+    assert calls == ["u", "u"]
+
+
+def test_invalidate_discards_a_load_started_before_it(clock):
+    async def scenario():
+        gates = [asyncio.Event(), asyncio.Event()]
+        profiles = [None, {"display_name": "An"}]
+
+        async def loader(user_id, zalo_user_id):
+            gate, profile = gates.pop(0), profiles.pop(0)
+            await gate.wait()
+            return profile
+
+        cache = ProfileCache(loader)
+        old_gate, new_gate = gates
+        # Lần tải trước khi user follow sẽ trả về "không có profile"
+        old = asyncio.create_task(cache.get("u"))
+        await asyncio.sleep(0)
+        cache.invalidate("u")
+        new = asyncio.create_task(cache.get("u"))
+        await asyncio.sleep(0)
+        # Lần tải mới xong trước, lần tải cũ xong sau
+        new_gate.set()
+        await new
+        old_gate.set()
+        await old
+        await _settle()
+        return await cache.get("u"), cache.get_stats()["inflight"]
+
+    assert asyncio.run(scenario()) == ({"display_name": "An"}, 0)
+
+
+def test_finished_load_only_removes_itself_from_inflight(clock):
+    async def scenario():
+        gates = [asyncio.Event(), asyncio.Event()]
+
+        async def loader(user_id, zalo_user_id):
+            await gates.pop(0).wait()
+            return None
+
+        cache = ProfileCache(loader)
+        old_gate, new_gate = gates
+        old = cache._load("u", None)
+        await asyncio.sleep(0)
+        cache.invalidate("u")
+        new = cache._load("u", None)
+        await asyncio.sleep(0)
+        old_gate.set()
+        await old
+        await _settle()
+        still_tracked = cache._inflight.get("u") is new
+        new_gate.set()
+        await new
+        await _settle()
+        return still_tracked, cache.get_stats()["inflight"]
+
+    assert asyncio.run(scenario()) == (True, 0)
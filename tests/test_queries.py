@@ -0,0 +1,135 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import insert
+
+from storage.database import ImageMessageEvent, UserSubmission
+from storage.queries import (
+    decode_cursor,
+    encode_cursor,
+    list_submissions,
+    list_user_submissions,
+    stream_images,
+)
+
+
+def _submission(index: int, user: str, timestamp: int):
+    return {
+        "app_id": "app",
+        "user_id_by_app": user,
+        "sender_id": "sender",
+        "timestamp": timestamp,
+        "info": {"index": index},
+        "event_key": f"submit:{index}",
+    }
+
+
+def _image(index: int, user: str, timestamp: int):
+    return {
+        "app_id": "app",
+        "user_id_by_app": user,
+        "sender_id": "sender",
+        "recipient_id": "oa",
+        "event_name": "user_send_image",
+        "timestamp": timestamp,
+        "msg_id": f"m{index}",
+        "text": None,
+        "attachments": {"attachments": [{"type": "image", "payload": {"url": f"https://x.zdn.vn/{index}"}}]},
+    }
+
+
+async def _collect(stream) -> dict:
+    return json.loads(b"".join([chunk async for chunk in stream]))
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(1700000000000, 42)) == (1700000000000, 42)
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+
+def test_user_submissions_pages_cover_every_row_once(open_database):
+    # Nhiều row cùng timestamp: cursor (timestamp, id) vẫn không bỏ sót / lặp row
+    rows = [_submission(index, f"u{index % 2}", 1000 + index // 4) for index in range(101)]
+
+    async def scenario():
+        async with open_database() as session_factory:
+            async with session_factory() as session:
+                await session.execute(insert(UserSubmission.__table__), rows)
+                await session.commit()
+                pages = []
+                cursor = None
+                while True:
+                    page = await list_user_submissions(session, "u0", 7, cursor)
+                    pages.append(page["submissions"])
+                    cursor = page["next_cursor"]
+                    if cursor is None:
+                        return pages
+
+    pages = asyncio.run(scenario())
+    items = [item for page in pages for item in page]
+    expected = [row for row in rows if row["user_id_by_app"] == "u0"]
+    assert len(items) == len(expected) == 51
+    assert len({item["id"] for item in items}) == len(items)
+    assert {item["info"]["index"] for item in items} == {row["info"]["index"] for row in expected}
+    keys = [(item["timestamp"], item["id"]) for item in items]
+    assert keys == sorted(keys, reverse=True)
+    assert all(len(page) == 7 for page in pages[:-1])
+
+
+def test_list_submissions_in_write_order(open_database):
+    rows = [_submission(index, "u", 1000) for index in range(25)]
+
+    async def scenario():
+        async with open_database() as session_factory:
+            async with session_factory() as session:
+                await session.execute(insert(UserSubmission.__table__), rows)
+                await session.commit()
+                ids = []
+                after_id = 0
+                while after_id is not None:
+                    page = await list_submissions(session, 10, after_id)
+                    ids += [item["id"] for item in page["submissions"]]
+                    after_id = page["next_cursor"]
+                return ids
+
+    ids = asyncio.run(scenario())
+    assert ids == sorted(ids) and len(set(ids)) == 25
+
+
+def test_stream_images_keyset_pages(open_database):
+    rows = [_image(index, f"u{index % 3}", 5000 + index // 2) for index in range(40)]
+
+    async def scenario():
+        async with open_database() as session_factory:
+            async with session_factory() as session:
+                await session.execute(insert(ImageMessageEvent.__table__), rows)
+                await session.commit()
+
+            pages = []
+            cursor = None
+            while True:
+                page = await _collect(stream_images(session_factory, 6, cursor))
+                pages.append(page)
+                if page["next_cursor"] is None:
+                    break
+                cursor = decode_cursor(page["next_cursor"])
+
+            filtered = await _collect(stream_images(session_factory, 100, user_id="u1", since=5005, until=5010))
+            return pages, filtered
+
+    pages, filtered = asyncio.run(scenario())
+    images = [image for page in pages for image in page["images"]]
+    assert len(images) == 40
+    assert len({image["id"] for image in images}) == 40
+    keys = [(image["timestamp"], image["id"]) for image in images]
+    assert keys == sorted(keys, reverse=True)
+    assert images[0]["attachments"][0]["type"] == "image"
+    assert images[0]["local_paths"] == {}
+    assert "user_id" in images[0]
+
+    expected = [row for row in rows if row["user_id_by_app"] == "u1" and 5005 <= row["timestamp"] < 5010]
+    assert {image["msg_id"] for image in filtered["images"]} == {row["msg_id"] for row in expected}
+    assert filtered["next_cursor"] is None
+    assert all("user_id" not in image for image in filtered["images"])
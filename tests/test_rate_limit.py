@@ -0,0 +1,88 @@
+import pytest
+
+import middleware
+from middleware import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(middleware.time, "monotonic", fake)
+    return fake
+
+
+def test_burst_then_steady_rate(clock):
+    # 60/phút = 1 request mỗi giây, burst 5
+    limiter = RateLimiter(rate_per_minute=60, burst=5)
+    assert all(limiter.check("u")[0] for _ in range(5))
+
+    allowed, retry_after = limiter.check("u")
+    assert not allowed
+    assert retry_after == pytest.approx(1.0)
+
+    clock.now += 1.0
+    assert limiter.check("u")[0]
+    assert not limiter.check("u")[0]
+
+
+def test_keys_are_limited_independently(clock):
+    limiter = RateLimiter(rate_per_minute=60, burst=1)
+    assert limiter.check("a")[0]
+    assert not limiter.check("a")[0]
+    assert limiter.check("b")[0]
+
+
+def test_bucket_refills_completely_after_idle(clock):
+    limiter = RateLimiter(rate_per_minute=60, burst=3)
+    for _ in range(3):
+        limiter.check("u")
+    clock.now += 60
+    assert all(limiter.check("u")[0] for _ in range(3))
+    assert not limiter.check("u")[0]
+
+
+def test_idle_keys_are_evicted(clock):
+    limiter = RateLimiter(rate_per_minute=60, burst=1)
+    for index in range(100):
+        limiter.check(f"user-{index}")
+        clock.now += 2.0
+    # Mỗi request mới dọn key lâu nhất đã đầy lại bucket
+    assert len(limiter) <= 2
+    assert limiter.evicted >= 98
+
+
+def test_max_keys_bounds_memory(clock):
+    limiter = RateLimiter(rate_per_minute=60, burst=1, max_keys=10)
+    for index in range(100):
+        limiter.check(f"user-{index}")
+    assert len(limiter) <= 10
+
+
+def _scope(headers):
+    return {"headers": [(name, value) for name, value in headers.items()], "client": ("10.0.0.5", 4000)}
+
+
+def test_forwarded_headers_are_ignored_by_default(monkeypatch):
+    monkeypatch.setattr(middleware.settings, "RATE_LIMIT_TRUST_PROXY", False)
+    scope = _scope({b"x-forwarded-for": b"1.2.3.4", b"x-real-ip": b"5.6.7.8"})
+    assert middleware.client_ip_from_scope(scope) == "10.0.0.5"
+
+
+def test_trusted_proxy_headers_cannot_be_spoofed(monkeypatch):
+    monkeypatch.setattr(middleware.settings, "RATE_LIMIT_TRUST_PROXY", True)
+    # nginx ghi đè X-Real-IP và nối IP thật vào cuối X-Forwarded-For của client
+    assert middleware.client_ip_from_scope(
+        _scope({b"x-forwarded-for": b"1.2.3.4, 203.0.113.9", b"x-real-ip": b"203.0.113.9"})
+    ) == "203.0.113.9"
+    assert middleware.client_ip_from_scope(
+        _scope({b"x-forwarded-for": b"1.2.3.4, 203.0.113.9"})
+    ) == "203.0.113.9"
+    assert middleware.client_ip_from_scope(_scope({})) == "10.0.0.5"
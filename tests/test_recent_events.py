@@ -0,0 +1,84 @@
+import json
+
+from models.zalo_events import parse_event_envelope
+from monitoring.recent_events import RecentEventsRing, readable_timestamp
+from monitoring.shared_stats import SharedStatsStore
+
+
+def _envelope(event_name: str, user: str, index: int, text: str = ""):
+    return parse_event_envelope(json.dumps({
+        "app_id": "app",
+        "event_name": event_name,
+        "timestamp": str(1700000000000 + index),
+        "user_id_by_app": user,
+        "message": {"msg_id": f"m{index}", "text": text},
+    }).encode())
+
+
+def _open(tmp_path, ring_slots=16, slot_size=1024) -> RecentEventsRing:
+    store = SharedStatsStore(str(tmp_path / "stats"), ring_slots=ring_slots, slot_size=slot_size).open()
+    return RecentEventsRing(store)
+
+
+def _page(ring, **kwargs):
+    body = json.loads(ring.query_json(**kwargs))
+    return [(event["seq"], event["data"]["message"]["msg_id"]) for event in body["events"]], body["next_cursor"]
+
+
+def test_pages_follow_the_cursor(tmp_path):
+    ring = _open(tmp_path)
+    for index in range(7):
+        ring.add(_envelope("user_send_text", "u1", index))
+
+    first, cursor = _page(ring, limit=3)
+    second, cursor2 = _page(ring, limit=3, cursor=cursor)
+    last, end = _page(ring, limit=3, cursor=cursor2)
+    # Trong mỗi trang: cũ -> mới; trang sau chứa event cũ hơn
+    assert first == [(5, "m4"), (6, "m5"), (7, "m6")]
+    assert second == [(2, "m1"), (3, "m2"), (4, "m3")]
+    assert (last, end) == ([(1, "m0")], None)
+    ring.store.close()
+
+
+def test_filters_use_tags(tmp_path):
+    ring = _open(tmp_path)
+    for index in range(9):
+        event_name = "user_send_text" if index % 3 else "follow"
+        ring.add(_envelope(event_name, f"u{index % 2}", index))
+
+    follows, _ = _page(ring, event_name="follow")
+    u1_texts, _ = _page(ring, event_name="user_send_text", user_id="u1")
+    u1_page, cursor = _page(ring, user_id="u1", limit=2)
+    assert [msg_id for _, msg_id in follows] == ["m0", "m3", "m6"]
+    assert [msg_id for _, msg_id in u1_texts] == ["m1", "m5", "m7"]
+    assert [msg_id for _, msg_id in u1_page] == ["m5", "m7"]
+    assert _page(ring, user_id="u1", limit=2, cursor=cursor)[0] == [(2, "m1"), (4, "m3")]
+    assert _page(ring, user_id="nobody") == ([], None)
+    ring.store.close()
+
+
+def test_overwritten_events_leave_the_index(tmp_path):
+    ring = _open(tmp_path, ring_slots=4)
+    for index in range(3):
+        ring.add(_envelope("follow", "u1", index))
+    assert len(_page(ring, event_name="follow")[0]) == 3
+    for index in range(3, 8):
+        ring.add(_envelope("user_send_text", "u2", index))
+    assert _page(ring, event_name="follow") == ([], None)
+    assert [seq for seq, _ in _page(ring)[0]] == [5, 6, 7, 8]
+    ring.store.close()
+
+
+def test_large_events_keep_only_metadata(tmp_path):
+    ring = _open(tmp_path, slot_size=512)
+    ring.add(_envelope("user_send_text", "u1", 0, text="x" * 1000))
+    body = json.loads(ring.query_json())
+    event = body["events"][0]
+    assert event["truncated"] is True and event["data"] is None
+    assert (event["event_name"], event["user_id"]) == ("user_send_text", "u1")
+    ring.store.close()
+
+
+def test_readable_timestamp_accepts_seconds_and_milliseconds():
+    assert readable_timestamp("1700000000000") == readable_timestamp(1700000000)
+    assert readable_timestamp("not a number") is None
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from services import send_scheduler as send_scheduler_module
+from services.send_scheduler import (
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_TRANSACTIONAL,
+    SendScheduler,
+    _QuotaBucket,
+)
+from services.zalo_client import ZaloAPIError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeClient:
+    """Client giả: ghi lại tin đã gửi, `throttle` lần đầu bị báo vượt quota"""
+
+    def __init__(self, throttle: int = 0):
+        self.sent = []
+        self.throttle = throttle
+
+    async def send_text(self, user_id, text, retry_throttled=True):
+        if self.throttle:
+            self.throttle -= 1
+            raise ZaloAPIError("quota", status_code=429, retry_after=0.01)
+        self.sent.append(text)
+        return {"error": 0}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(send_scheduler_module.time, "monotonic", fake)
+    return fake
+
+
+def test_bucket_refills_at_the_configured_rate(clock):
+    bucket = _QuotaBucket("oa", rate=10, burst=2, queue_size=10)
+    for _ in range(2):
+        assert bucket.wait_time() == 0.0
+        bucket.take()
+    assert bucket.wait_time() == pytest.approx(0.1)
+    clock.now += 0.05
+    assert bucket.wait_time() == pytest.approx(0.05)
+    clock.now += 10
+    # Không tích quá burst
+    bucket.wait_time()
+    assert bucket.tokens == 2
+
+
+def test_throttling_halves_the_rate_and_success_restores_it(clock):
+    bucket = _QuotaBucket("oa", rate=16, burst=4, queue_size=10)
+    bucket.on_throttled(2.0)
+    # Các request đang bay cùng lúc bị từ chối chỉ giảm tốc một lần
+    bucket.on_throttled(2.0)
+    assert bucket.rate == 8 and bucket.throttled == 2
+    assert bucket.wait_time() == pytest.approx(2.0)
+    clock.now += 2.0
+    bucket.on_throttled(None)
+    assert bucket.rate == 4
+    for _ in range(200):
+        bucket.on_throttled(None)
+        clock.now += 10
+    assert bucket.rate == bucket.min_rate == 1
+    for _ in range(30):
+        bucket.on_success()
+    assert bucket.rate == 16
+
+
+def test_worker_share_scales_the_current_rate(clock):
+    bucket = _QuotaBucket("oa", rate=20, burst=4, queue_size=10)
+    bucket.on_throttled(None)
+    bucket.set_max_rate(10)
+    assert (bucket.max_rate, bucket.rate, bucket.min_rate) == (10, 5, 10 / 16)
+
+
+def test_higher_priority_messages_are_sent_first():
+    async def scenario():
+        client = FakeClient()
+        scheduler = SendScheduler(client, rate_per_second=1000, burst=1, queue_size=10)
+        futures = [
+            scheduler.enqueue("u", "bulk", PRIORITY_BULK),
+            scheduler.enqueue("u", "welcome", PRIORITY_TRANSACTIONAL),
+            scheduler.enqueue("u", "reply", PRIORITY_INTERACTIVE),
+        ]
+        results = await asyncio.gather(*futures)
+        await scheduler.close()
+        return client.sent, results, scheduler.get_stats()
+
+    sent, results, stats = asyncio.run(scenario())
+    assert sent == ["reply", "welcome", "bulk"]
+    assert results == [True, True, True]
+    assert stats["priorities"]["bulk"]["sent"] == 1
+
+
+def test_throttled_message_is_sent_again_at_a_lower_rate():
+    async def scenario():
+        client = FakeClient(throttle=2)
+        scheduler = SendScheduler(client, rate_per_second=100, burst=1)
+        ok = await asyncio.wait_for(scheduler.enqueue("u", "hello"), 5)
+        stats = scheduler.get_stats()
+        await scheduler.close()
+        return ok, client.sent, stats
+
+    ok, sent, stats = asyncio.run(scenario())
+    assert ok and sent == ["hello"]
+    quota = stats["quota"][0]
+    assert quota["throttled"] == 2 and quota["rate_per_second"] < 100
+
+
+def test_full_queue_and_closed_scheduler_reject():
+    async def scenario():
+        scheduler = SendScheduler(FakeClient(), rate_per_second=0.001, burst=1, queue_size=1)
+        scheduler._bucket("default").tokens = 0.0
+        first = scheduler.enqueue("u", "a", PRIORITY_BULK)
+        second = scheduler.enqueue("u", "b", PRIORITY_BULK)
+        other_priority = scheduler.enqueue("u", "c", PRIORITY_INTERACTIVE)
+        await scheduler.close(timeout=0)
+        after_close = scheduler.enqueue("u", "d")
+        return first, second, other_priority, after_close, scheduler.get_stats()
+
+    first, second, other_priority, after_close, stats = asyncio.run(scenario())
+    assert second is None and after_close is None and other_priority is not None
+    # Tin còn trong hàng đợi khi dừng được báo là không gửi được
+    assert first.result() is False
+    assert stats["priorities"]["bulk"]["rejected"] == 1
@@ -0,0 +1,79 @@
+import multiprocessing
+
+from monitoring.shared_stats import SharedStatsStore
+
+
+def _store(tmp_path, **kwargs) -> SharedStatsStore:
+    return SharedStatsStore(str(tmp_path / "stats"), max_workers=4, max_counters=8, ring_slots=4, slot_size=512, **kwargs)
+
+
+def _worker(path, counts):
+    store = SharedStatsStore(path, max_workers=4, max_counters=8, ring_slots=4, slot_size=512).open()
+    for name, amount in counts.items():
+        store.increment(name, amount)
+    store.append(b"from child", ("child", "u"))
+    store.close()
+    return store.worker_index
+
+
+def _run_worker(path, counts) -> int:
+    """Chạy một worker trong process riêng (fork), trả về worker_index nó nhận"""
+    context = multiprocessing.get_context("fork")
+    with context.Pool(1) as pool:
+        return pool.apply(_worker, (path, counts))
+
+
+def test_counters_are_summed_over_worker_rows(tmp_path):
+    store = _store(tmp_path).open()
+    store.increment("follow")
+    store.increment("follow")
+    store.increment("user_send_text", 5)
+    child_index = _run_worker(store.path, {"follow": 3, "unfollow": 1})
+    counters = store.counters()
+    assert store.worker_index == 0 and child_index == 1
+    assert {name: count for name, (count, _) in counters.items()} == {
+        "follow": 5, "user_send_text": 5, "unfollow": 1,
+    }
+    # Record của worker khác nằm trong cùng ring
+    assert store.read(store.head)[1] == b"from child"
+    # Hàng của worker đã chết được dùng lại, giữ nguyên counter
+    assert _run_worker(store.path, {"follow": 1}) == 1
+    assert store.counters()["follow"][0] == 6
+    assert store.used_worker_rows() == [0, 1]
+    assert store.live_workers() == 1
+    store.close()
+
+
+def test_store_is_reset_when_no_worker_is_alive(tmp_path):
+    path = str(tmp_path / "stats")
+    _run_worker(path, {"follow": 3})
+    store = _store(tmp_path).open()
+    assert store.counters() == {}
+    assert store.head == 0 and store.worker_index == 0
+    store.close()
+
+
+def test_ring_overwrites_oldest_slots(tmp_path):
+    store = _store(tmp_path).open()
+    seqs = [store.append(f"record {index}".encode(), ("event", f"u{index}")) for index in range(6)]
+    assert seqs == [1, 2, 3, 4, 5, 6]
+    assert (store.head, store.oldest) == (6, 3)
+    assert store.read(2) is None and store.read_tags(2) is None
+    assert store.read(3)[1] == b"record 2"
+    assert store.read_tags(6) == ("event", "u5")
+    assert store.read(7) is None and store.read(0) is None
+    # Record lớn hơn một slot không được ghi
+    assert store.append(b"x" * (store.max_record_size + 1)) == 0
+    assert store.append(b"x" * store.max_record_size) == 7
+    store.close()
+
+
+def test_long_tags_and_counter_names_are_truncated(tmp_path):
+    store = _store(tmp_path).open()
+    long_name = "n" * 100
+    store.increment(long_name)
+    store.increment(long_name)
+    seq = store.append(b"data", ("t" * 100,))
+    assert {name: count for name, (count, _) in store.counters().items()} == {"n" * 64: 2}
+    assert store.read_tags(seq) == ("t" * 64, "")
+    store.close()
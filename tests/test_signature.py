@@ -0,0 +1,44 @@
+import hashlib
+import hmac
+
+from middleware import SignatureVerifier, signature_from_scope
+
+BODY = b'{"app_id":"a","event_name":"follow","timestamp":"1"}'
+
+
+def test_signature_matches_plain_hmac():
+    verifier = SignatureVerifier(["secret"])
+    expected = hmac.new(b"secret", BODY, hashlib.sha256).hexdigest()
+    assert verifier.sign(BODY) == expected
+    # Key tính sẵn không bị "bẩn" sau nhiều lần dùng
+    assert verifier.sign(BODY) == expected
+    assert verifier.verify(BODY, expected)
+    assert verifier.verify(BODY, f"  {expected.upper()}  ")
+
+
+def test_rejects_missing_or_wrong_signature():
+    verifier = SignatureVerifier(["secret"])
+    assert not verifier.verify(BODY, None)
+    assert not verifier.verify(BODY, "")
+    assert not verifier.verify(BODY, "0" * 64)
+    assert not verifier.verify(BODY + b" ", verifier.sign(BODY))
+
+
+def test_previous_secrets_stay_valid_during_rotation():
+    old = SignatureVerifier(["old"])
+    rotated = SignatureVerifier(["new", "old"])
+    assert rotated.verify(BODY, old.sign(BODY))
+    assert rotated.verify(BODY, rotated.sign(BODY))
+    assert not SignatureVerifier(["new"]).verify(BODY, old.sign(BODY))
+
+
+def test_empty_secrets_disable_verification():
+    assert not SignatureVerifier([]).enabled
+    assert not SignatureVerifier([""]).enabled
+    assert SignatureVerifier(["secret"]).enabled
+
+
+def test_signature_header_lookup():
+    assert signature_from_scope({"headers": [(b"x-zalo-signature", b"abc")]}) == "abc"
+    assert signature_from_scope({"headers": [(b"x-zsign", b"def")]}) == "def"
+    assert signature_from_scope({"headers": []}) == ""
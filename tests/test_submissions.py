@@ -0,0 +1,58 @@
+import asyncio
+
+from sqlalchemy import select
+
+from handlers import user_action_handler as user_action_handler_module
+from handlers.user_action_handler import UserActionHandler
+from models.zalo_events import UserSubmitInfoEvent
+from storage import database
+from storage.batch_writer import BatchWriter
+from storage.database import UserSubmission
+
+TABLE = UserSubmission.__table__
+
+
+def _event(user: str, timestamp: int, info):
+    return UserSubmitInfoEvent(
+        app_id="app",
+        event_name="user_submit_info",
+        timestamp=str(timestamp),
+        user_id_by_app=user,
+        sender={"id": f"s-{user}"},
+        info=info,
+    )
+
+
+def test_submissions_are_batched_and_replays_are_ignored(open_database, monkeypatch):
+    info = {"name": "Nguyễn Văn A", "phone": "0900000000", "address": {"city": "Huế"}}
+
+    async def scenario():
+        async with open_database() as session_factory:
+            writer = BatchWriter(session_factory, max_delay_ms=1000)
+            # Cùng câu lệnh ON CONFLICT DO NOTHING đã đăng ký cho writer của ứng dụng
+            writer.register_statement(TABLE, database.batch_writer._statements[TABLE])
+            monkeypatch.setattr(user_action_handler_module, "batch_writer", writer)
+            await writer.start()
+            handler = UserActionHandler()
+            results = [
+                await handler._save_user_submitted_info(_event("u1", 1000, info)),
+                await handler._save_user_submitted_info(_event("u2", 1000, {"name": "B"})),
+                # Event replay từ journal sau restart
+                await handler._save_user_submitted_info(_event("u1", 1000, info)),
+            ]
+            await writer.close()
+            batched = writer.get_stats()
+            # Replay đến ở một lô sau, khi row đã nằm trong database
+            writer = BatchWriter(session_factory)
+            writer.register_statement(TABLE, database.batch_writer._statements[TABLE])
+            monkeypatch.setattr(user_action_handler_module, "batch_writer", writer)
+            results.append(await handler._save_user_submitted_info(_event("u1", 1000, info)))
+            async with session_factory() as session:
+                rows = (await session.execute(select(TABLE).order_by(TABLE.c.user_id_by_app))).mappings().all()
+            return results, rows, batched
+
+    results, rows, batched = asyncio.run(scenario())
+    assert results == [True, True, True, True]
+    assert [(row["user_id_by_app"], row["sender_id"]) for row in rows] == [("u1", "s-u1"), ("u2", "s-u2")]
+    assert rows[0]["info"] == info
+    assert (batched["batches"], batched["rows_written"]) == (1, 3)
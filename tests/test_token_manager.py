@@ -0,0 +1,126 @@
+import asyncio
+import json
+import os
+import stat
+import time
+
+import pytest
+
+from services.token_manager import OATokenManager, TokenRefreshError
+
+
+class FakeOAuth:
+    """Endpoint OAuth giả: mỗi lần đổi trả access token / refresh token mới"""
+
+    def __init__(self, expires_in=3600):
+        self.calls = []
+        self.expires_in = expires_in
+        self.release = asyncio.Event()
+        self.release.set()
+        self.error = None
+
+    async def request(self, method, url, data=None, headers=None, **kwargs):
+        self.calls.append(data["refresh_token"])
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        index = len(self.calls)
+        return {"access_token": f"access-{index}", "refresh_token": f"refresh-{index}", "expires_in": self.expires_in}
+
+
+def _manager(oauth, store_path=None, **kwargs) -> OATokenManager:
+    kwargs.setdefault("refresh_token", "refresh-0")
+    return OATokenManager(oauth, "app", "secret", store_path=store_path, **kwargs)
+
+
+def test_concurrent_callers_share_one_refresh(tmp_path):
+    store_path = str(tmp_path / "zalo_token.json")
+
+    async def scenario():
+        oauth = FakeOAuth()
+        oauth.release.clear()
+        manager = _manager(oauth, store_path)
+        waiters = [asyncio.create_task(manager.get_token()) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        oauth.release.set()
+        tokens = await asyncio.gather(*waiters)
+        await manager.close()
+        return tokens, oauth.calls, manager.get_stats()
+
+    tokens, calls, stats = asyncio.run(scenario())
+    assert tokens == ["access-1"] * 5
+    assert calls == ["refresh-0"]
+    assert stats["refreshes"] == 1 and stats["coalesced_waiters"] == 4
+    assert stat.S_IMODE(os.stat(store_path).st_mode) == 0o600
+    with open(store_path, encoding="utf-8") as f:
+        stored = json.load(f)
+    assert (stored["access_token"], stored["refresh_token"]) == ("access-1", "refresh-1")
+
+
+def test_other_worker_reuses_the_stored_token(tmp_path):
+    store_path = str(tmp_path / "zalo_token.json")
+
+    async def scenario():
+        oauth = FakeOAuth()
+        first = _manager(oauth, store_path)
+        await first.get_token()
+        # Worker khởi động sau đọc token từ file, không đổi refresh token lần nữa
+        second = _manager(oauth, store_path)
+        token = await second.get_token()
+        # Worker còn giữ token đã bị thu hồi: khi làm mới thì lấy token mới hơn trong file
+        stale = _manager(oauth)
+        stale.store_path = store_path
+        stale.access_token, stale.expires_at = "old", time.time() - 1
+        refreshed = await stale.refresh()
+        return token, refreshed, second.refresh_token, oauth.calls
+
+    token, refreshed, refresh_token, calls = asyncio.run(scenario())
+    assert token == refreshed == "access-1"
+    assert refresh_token == "refresh-1"
+    assert calls == ["refresh-0"]
+
+
+def test_nearly_expired_token_is_refreshed_in_the_background():
+    async def scenario():
+        oauth = FakeOAuth()
+        oauth.release.clear()
+        manager = _manager(oauth, refresh_margin=300)
+        manager.access_token, manager.expires_at = "current", time.time() + 100
+        token = await manager.get_token()
+        oauth.release.set()
+        await manager._refresh_task
+        return token, await manager.get_token()
+
+    assert asyncio.run(scenario()) == ("current", "access-1")
+
+
+def test_rejected_token_forces_a_refresh(tmp_path):
+    store_path = str(tmp_path / "zalo_token.json")
+
+    async def scenario():
+        oauth = FakeOAuth()
+        manager = _manager(oauth, store_path)
+        token = await manager.get_token()
+        manager.invalidate("some-other-token")
+        unchanged = await manager.get_token()
+        manager.invalidate(token)
+        # Token bị từ chối vẫn còn trong file nhưng không được đọc lại
+        return token, unchanged, await manager.get_token(), oauth.calls
+
+    assert asyncio.run(scenario()) == ("access-1", "access-1", "access-2", ["refresh-0", "refresh-1"])
+
+
+def test_failed_refresh_raises_and_keeps_the_new_refresh_token():
+    async def scenario():
+        oauth = FakeOAuth()
+        oauth.error = ConnectionError("down")
+        manager = _manager(oauth)
+        with pytest.raises(TokenRefreshError):
+            await manager.get_token()
+        oauth.error = None
+        oauth.expires_in = 0
+        with pytest.raises(TokenRefreshError):
+            await manager.get_token()
+        return manager.access_token, manager.refresh_token, manager.get_stats()["refresh_failures"]
+
+    assert asyncio.run(scenario()) == (None, "refresh-2", 2)
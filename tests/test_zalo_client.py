@@ -0,0 +1,118 @@
+import asyncio
+
+import httpx
+import pytest
+
+from services.zalo_client import ZaloAPIError, ZaloClient
+
+
+class FakeZalo:
+    """Zalo API giả: trả lần lượt các response (hoặc ném lỗi) trong `script`"""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        step = self.script.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        if isinstance(step, int):
+            return httpx.Response(step, json={})
+        return step
+
+
+def _client(api: FakeZalo, **kwargs) -> ZaloClient:
+    client = ZaloClient("https://openapi.zalo.me", access_token="token", backoff_base_ms=0, **kwargs)
+    client._client = httpx.AsyncClient(base_url=client.base_url, transport=httpx.MockTransport(api))
+    return client
+
+
+def _run(client: ZaloClient, method: str, **kwargs):
+    async def scenario():
+        try:
+            return await client.request(method, "/v3.0/oa/test", **kwargs)
+        finally:
+            await client.close()
+
+    return asyncio.run(scenario())
+
+
+def test_get_is_retried_on_server_errors():
+    api = FakeZalo(500, 502, httpx.Response(200, json={"error": 0, "data": 1}))
+    client = _client(api)
+    assert _run(client, "GET") == {"error": 0, "data": 1}
+    assert len(api.requests) == 3 and client.get_stats()["retries"] == 2
+    assert api.requests[0].headers["access_token"] == "token"
+
+
+def test_post_is_not_resent_after_it_may_have_reached_zalo():
+    api = FakeZalo(500)
+    with pytest.raises(ZaloAPIError) as raised:
+        _run(_client(api), "POST", json={})
+    assert raised.value.status_code == 500 and len(api.requests) == 1
+
+    api = FakeZalo(httpx.ReadTimeout("slow"))
+    with pytest.raises(httpx.ReadTimeout):
+        _run(_client(api), "POST", json={})
+    assert len(api.requests) == 1
+
+
+def test_post_is_retried_when_zalo_did_not_process_it():
+    api = FakeZalo(httpx.ConnectError("refused"), 503, 429, httpx.Response(200, json={"error": 0}))
+    client = _client(api)
+    assert _run(client, "POST", json={}) == {"error": 0}
+    assert len(api.requests) == 4
+
+
+def test_retries_are_limited():
+    api = FakeZalo(503, 503, 503)
+    client = _client(api, max_retries=2)
+    with pytest.raises(ZaloAPIError):
+        _run(client, "GET")
+    stats = client.get_stats()
+    assert (stats["requests"], stats["retries"], stats["failures"]) == (3, 2, 1)
+
+
+def test_throttling_can_be_left_to_the_caller():
+    api = FakeZalo(httpx.Response(429, headers={"retry-after": "7"}))
+    with pytest.raises(ZaloAPIError) as raised:
+        _run(_client(api), "POST", json={}, retry_throttled=False)
+    assert raised.value.throttled and raised.value.retry_after == 7.0
+    assert len(api.requests) == 1
+
+
+def test_error_field_in_body_raises():
+    api = FakeZalo(httpx.Response(200, json={"error": -32, "message": "quota exceeded"}))
+    with pytest.raises(ZaloAPIError) as raised:
+        _run(_client(api), "POST", json={})
+    assert raised.value.error_code == -32 and raised.value.throttled
+
+
+def test_rejected_token_is_refreshed_once():
+    class Tokens:
+        def __init__(self):
+            self.current = "old"
+            self.invalidated = []
+
+        async def get_token(self):
+            return self.current
+
+        def invalidate(self, token):
+            self.invalidated.append(token)
+            self.current = "new"
+
+    api = FakeZalo(httpx.Response(200, json={"error": -216}), httpx.Response(200, json={"error": 0}))
+    client = _client(api)
+    client.token_manager = Tokens()
+    assert _run(client, "GET") == {"error": 0}
+    assert [request.headers["access_token"] for request in api.requests] == ["old", "new"]
+    assert client.token_manager.invalidated == ["old"]
+
+
+def test_backoff_honours_retry_after_and_caps_delays():
+    client = ZaloClient("https://x", backoff_base_ms=100, backoff_max_ms=1000)
+    assert client._backoff(0, "0.5") == 0.5
+    assert client._backoff(0, "60") == 1.0
+    assert all(0 <= client._backoff(attempt) <= min(1.0, 0.1 * 2 ** attempt) for attempt in range(8))
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from config import settings
+from models.zalo_events import (
+    FollowOAEvent,
+    UserSendImageEvent,
+    UserSendTextEvent,
+    ZaloEvent,
+    parse_event_envelope,
+)
+
+TEXT = {
+    "app_id": "app",
+    "event_name": "user_send_text",
+    "timestamp": "1700000000000",
+    "user_id_by_app": "u1",
+    "sender": {"id": "s"},
+    "recipient": {"id": "oa"},
+    "message": {"msg_id": "m1", "text": "xin chào"},
+}
+
+
+def _raw(**changes) -> bytes:
+    return json.dumps({**TEXT, **changes}, ensure_ascii=False).encode("utf-8")
+
+
+@pytest.fixture(params=["pydantic", "orjson"])
+def json_backend(request, monkeypatch):
+    monkeypatch.setattr(settings, "JSON_BACKEND", request.param)
+    return request.param
+
+
+def test_envelope_fields_are_read_from_raw_bytes(json_backend):
+    raw = _raw()
+    envelope = parse_event_envelope(raw)
+    assert (envelope.app_id, envelope.event_name, envelope.user_id_by_app) == ("app", "user_send_text", "u1")
+    assert envelope.msg_id == "m1"
+    assert envelope.raw is raw
+    assert envelope.payload() == TEXT
+
+
+def test_invalid_json_raises_and_missing_fields_return_none(json_backend):
+    with pytest.raises(ValueError):
+        parse_event_envelope(b'{"app_id": ')
+    assert parse_event_envelope(json.dumps({"app_id": "app"}).encode()) is None
+
+
+def test_discriminator_picks_the_event_class(json_backend):
+    follow = parse_event_envelope(_raw(event_name="follow", follower={"id": "f"}, message=None))
+    image = parse_event_envelope(_raw(
+        event_name="user_send_image",
+        message={"msg_id": "m2", "attachments": [{"type": "image", "payload": {"url": "https://x"}}]},
+    ))
+    unknown = parse_event_envelope(_raw(event_name="oa_send_text"))
+    assert type(parse_event_envelope(_raw()).load_event()) is UserSendTextEvent
+    assert type(follow.load_event()) is FollowOAEvent
+    assert type(image.load_event()) is UserSendImageEvent
+    assert image.load_event().message.attachments[0]["type"] == "image"
+    assert type(unknown.load_event()) is ZaloEvent
+    assert not unknown.is_typed
+
+
+def test_full_model_is_built_lazily_and_once(json_backend):
+    envelope = parse_event_envelope(_raw())
+    assert envelope._event is None
+    event = envelope.load_event()
+    assert event.message.text == "xin chào"
+    assert envelope.load_event() is event
+    # Dict trung gian được bỏ sau khi dựng model, payload() vẫn đọc lại được từ raw bytes
+    assert envelope._data is None
+    assert envelope.payload()["message"]["msg_id"] == "m1"
+
+
+def test_invalid_full_payload_only_fails_in_the_worker(json_backend):
+    # Envelope hợp lệ nhưng message thiếu msg_id bắt buộc
+    envelope = parse_event_envelope(_raw(message={"text": "không có msg_id"}))
+    assert envelope is not None and envelope.msg_id is None
+    assert envelope.load_event() is None
+    assert envelope.load_event() is None